@@ -0,0 +1,596 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+import functions
+from functions import ConexionPreparada
+
+# =====================================
+# BENCHMARKS Y PRUEBAS DE CARGA
+# =====================================
+# Corre la API de functions.py contra un Postgres local con datos sintéticos
+# y guarda los resultados en JSON para comparar entre commits.
+#
+#     python benchmark.py correr --ventas 1000000 --cajeros 16
+#     python benchmark.py correr --levantar          (initdb + pg_ctl en un directorio temporal)
+#     python benchmark.py comparar base.json nuevo.json
+#
+# Nunca se usa la base de la app: los datos se cargan en BENCH_DB_NAME
+# (por defecto kiosco_bench), que se borra y se vuelve a crear en el servidor
+# configurado en el .env. No se permite correrlo contra Supabase.
+
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME", "kiosco_bench")
+RESULTADOS_DIR = Path(__file__).parent / "benchmarks"
+
+PALABRAS = ["Alfajor", "Chicle", "Agua", "Gaseosa", "Galletitas", "Caramelo", "Chocolate", "Jugo"]
+
+
+# ---- Conteo de viajes a la base ----
+# Cada execute, commit o rollback con una transacción abierta es un viaje de
+# ida y vuelta. Los FETCH de los cursores del lado del servidor no se cuentan.
+_viajes = threading.local()
+
+
+def _contar_viaje():
+    _viajes.cantidad = getattr(_viajes, "cantidad", 0) + 1
+
+
+def viajes_del_hilo():
+    return getattr(_viajes, "cantidad", 0)
+
+
+class _CursorContado(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _contar_viaje()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        for vars in vars_list:
+            _contar_viaje()
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        _contar_viaje()
+        return super().copy_expert(sql, file, size)
+
+
+class ConexionContada(ConexionPreparada):
+    """
+    Conexión que cuenta los viajes a la base del hilo que la usa. Hereda de
+    ConexionPreparada para no cambiar el uso de sentencias preparadas; con
+    SUPABASE_PREPARED_STATEMENTS=0 las queries se mandan como texto igual.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = _CursorContado
+        if not functions.usar_preparadas():
+            self.preparadas = None
+
+    def _en_transaccion(self):
+        return self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        if self._en_transaccion():
+            _contar_viaje()
+        return super().commit()
+
+    def rollback(self):
+        if self._en_transaccion():
+            _contar_viaje()
+        return super().rollback()
+
+
+# ---- Registro de mediciones ----
+class Registro:
+    """
+    Latencias y viajes por operación, compartido por los hilos de un escenario.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}
+
+    def medir(self, operacion, funcion, *args, **kwargs):
+        viajes = viajes_del_hilo()
+        inicio = time.perf_counter()
+        error = False
+        try:
+            resultado = funcion(*args, **kwargs)
+            if isinstance(resultado, tuple) and resultado and resultado[0] is False:
+                error = True
+            return resultado
+        except Exception:
+            error = True
+            raise
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            with self._lock:
+                datos = self._datos.setdefault(operacion, {"ms": [], "viajes": [], "errores": 0})
+                datos["ms"].append(ms)
+                datos["viajes"].append(viajes_del_hilo() - viajes)
+                datos["errores"] += int(error)
+
+    def resumen(self, segundos=None):
+        resumen = {}
+        for operacion, datos in self._datos.items():
+            ms = np.array(datos["ms"])
+            resumen[operacion] = {
+                "cantidad": len(ms),
+                "errores": datos["errores"],
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "max_ms": round(float(ms.max()), 3),
+                "viajes_promedio": round(float(np.mean(datos["viajes"])), 2),
+            }
+            if segundos:
+                resumen[operacion]["por_segundo"] = round(len(ms) / segundos, 2)
+        return resumen
+
+
+# ---- Postgres local ----
+def _binario_postgres(nombre):
+    directorio = os.getenv("BENCH_PG_BIN")
+    ruta = os.path.join(directorio, nombre) if directorio else shutil.which(nombre)
+    if not ruta or not os.path.exists(ruta):
+        raise SystemExit(f"No se encontró {nombre}: instalar Postgres o definir BENCH_PG_BIN")
+    return ruta
+
+
+def levantar_postgres():
+    """
+    Crea un cluster de Postgres en un directorio temporal y lo arranca
+    escuchando solo en un socket local. Devuelve una función para detenerlo.
+    """
+    directorio = tempfile.mkdtemp(prefix="kiosco_bench_")
+    datos = os.path.join(directorio, "datos")
+    subprocess.run(
+        [_binario_postgres("initdb"), "-D", datos, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        [_binario_postgres("pg_ctl"), "-D", datos, "-l", os.path.join(directorio, "postgres.log"),
+         "-o", f"-k {directorio} -h '' -c fsync=off", "-w", "start"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    os.environ.update({
+        "SUPABASE_DB_HOST": directorio,
+        "SUPABASE_DB_PORT": "5432",
+        "SUPABASE_DB_USER": "postgres",
+        "SUPABASE_DB_PASSWORD": "bench",
+    })
+
+    def detener():
+        subprocess.run([_binario_postgres("pg_ctl"), "-D", datos, "-m", "fast", "stop"],
+                       check=False, stdout=subprocess.DEVNULL)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return detener
+
+
+def _conexion_admin():
+    conn = psycopg2.connect(
+        host=os.getenv("SUPABASE_DB_HOST"),
+        port=os.getenv("SUPABASE_DB_PORT"),
+        dbname="postgres",
+        user=os.getenv("SUPABASE_DB_USER"),
+        password=os.getenv("SUPABASE_DB_PASSWORD"),
+    )
+    conn.autocommit = True
+    return conn
+
+
+def crear_base():
+    """
+    Borra y vuelve a crear la base de benchmarks.
+    """
+    if "supabase" in (os.getenv("SUPABASE_DB_HOST") or ""):
+        raise SystemExit("El benchmark borra y recrea su base: usar un Postgres local, no Supabase")
+    conn = _conexion_admin()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'DROP DATABASE IF EXISTS "{BENCH_DB_NAME}"')
+        cursor.execute(f'CREATE DATABASE "{BENCH_DB_NAME}"')
+    finally:
+        conn.close()
+
+
+def sembrar(productos, usuarios, ventas, dias=730):
+    """
+    Carga datos sintéticos: `productos` con stock de sobra, `usuarios`
+    empleados y `ventas` repartidas en los últimos `dias`, con 1 a 4 líneas
+    de detalle cada una.
+    """
+    from functions import connect_to_supabase, release_connection
+
+    conn = connect_to_supabase()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT setseed(0.42)")
+        cursor.execute("""
+            INSERT INTO proveedores (nombre)
+            SELECT 'Proveedor ' || i FROM generate_series(1, 50) AS i
+        """)
+        cursor.execute("""
+            INSERT INTO usuarios (usuario, contraseña, tipo_usuario)
+            SELECT 'cajero' || i, 'bench', 'empleado' FROM generate_series(1, %s) AS i
+        """, (usuarios,))
+        cursor.execute("""
+            INSERT INTO productos (nombre, proveedor_id, cantidad, precio)
+            SELECT (%s::text[])[1 + i %% 8] || ' ' || i,
+                   1 + i %% 50,
+                   1000000000,
+                   round((50 + random() * 2000)::numeric, 2)
+            FROM generate_series(1, %s) AS i
+        """, (PALABRAS, productos))
+        # Las ventas se reparten en meses pasados: hacen falta sus particiones
+        cursor.execute(
+            "SELECT crear_particiones_ventas(now() - make_interval(days => %s), now())",
+            (dias,),
+        )
+        cursor.execute("""
+            INSERT INTO ventas (fecha, empleado_id, descuento, total)
+            SELECT now() - random() * make_interval(days => %s),
+                   1 + (random() * (%s - 1))::int,
+                   0,
+                   0
+            FROM generate_series(1, %s)
+        """, (dias, usuarios, ventas))
+        cursor.execute("""
+            INSERT INTO venta_detalle (venta_id, fecha, producto_id, cantidad, subtotal)
+            SELECT v.id, v.fecha, p.id, l.cantidad, l.cantidad * p.precio
+            FROM ventas v
+            CROSS JOIN LATERAL (
+                SELECT 1 + (random() * 4)::int AS cantidad,
+                       1 + (random() * (%s - 1))::int AS producto_id
+                FROM generate_series(1, 1 + (v.id %% 4))
+            ) AS l
+            JOIN productos p ON p.id = l.producto_id
+        """, (productos,))
+        cursor.execute("""
+            UPDATE ventas v SET total = d.total
+            FROM (
+                SELECT venta_id, fecha, SUM(subtotal) AS total
+                FROM venta_detalle
+                GROUP BY venta_id, fecha
+            ) AS d
+            WHERE d.venta_id = v.id AND d.fecha = v.fecha
+        """)
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute("VACUUM ANALYZE")
+        conn.autocommit = False
+    finally:
+        release_connection(conn)
+
+
+# ---- Escenarios ----
+def _carrito(catalogo, ids, rng, lineas):
+    carrito = []
+    for producto_id in rng.sample(ids, min(lineas, len(ids))):
+        producto = catalogo.por_id(producto_id)
+        carrito.append({
+            "id": int(producto["id"]),
+            "nombre": producto["nombre"],
+            "precio": float(producto["precio"]),
+            "cantidad": rng.randint(1, 3),
+        })
+    return carrito
+
+
+def escenario_cajeros(cajeros, segundos, usuarios):
+    """
+    `cajeros` hilos que repiten buscar productos → armar carrito →
+    procesar_venta_completa_db durante `segundos`.
+    """
+    from catalogo import get_catalogo
+    from functions import procesar_venta_completa_db
+
+    registro = Registro()
+    fin = time.monotonic() + segundos
+
+    def cajero(n):
+        rng = random.Random(n)
+        while time.monotonic() < fin:
+            catalogo = registro.medir("navegar", get_catalogo)
+            ids = registro.medir("buscar", catalogo.buscar, rng.choice(PALABRAS), 50)
+            carrito = _carrito(catalogo, ids, rng, rng.randint(1, 6))
+            registro.medir("checkout", procesar_venta_completa_db, 1 + n % usuarios, carrito)
+
+    hilos = [threading.Thread(target=cajero, args=(n,)) for n in range(cajeros)]
+    inicio = time.monotonic()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return {"cajeros": cajeros, "segundos": segundos, "operaciones": registro.resumen(time.monotonic() - inicio)}
+
+
+def escenario_checkout_lineas(repeticiones, lineas=(1, 10, 100)):
+    """
+    Latencia y viajes del checkout según la cantidad de líneas del carrito.
+    Con el checkout en lote los viajes no deberían crecer con las líneas.
+    """
+    from catalogo import get_catalogo
+    from functions import procesar_venta_completa_db
+
+    registro = Registro()
+    rng = random.Random(0)
+    for cantidad in lineas:
+        for _ in range(repeticiones):
+            catalogo = get_catalogo()
+            carrito = _carrito(catalogo, list(catalogo.ids), rng, cantidad)
+            registro.medir(f"checkout_{cantidad}_lineas", procesar_venta_completa_db, 1, carrito)
+    return registro.resumen()
+
+
+def escenario_paginacion(repeticiones, profundidades=(0, 10_000, 100_000, 1_000_000)):
+    """
+    Latencia de una página de ventas según qué tan atrás en el historial
+    esté, con keyset (get_ventas_pagina) y con OFFSET como referencia.
+    """
+    from functions import _codificar_cursor, execute_query, get_ventas_pagina
+
+    total = int(execute_query("SELECT COUNT(*) AS n FROM ventas", nombre="bench_conteo").iloc[0]["n"])
+    registro = Registro()
+    for profundidad in profundidades:
+        if profundidad >= total:
+            continue
+        cursor = None
+        if profundidad:
+            fila = execute_query(
+                "SELECT fecha, id FROM ventas ORDER BY fecha DESC, id DESC OFFSET %s LIMIT 1",
+                params=(profundidad - 1,), nombre="bench_cursor",
+            ).iloc[0]
+            cursor = _codificar_cursor(fila["fecha"], int(fila["id"]))
+        for _ in range(repeticiones):
+            registro.medir(f"keyset_{profundidad}", get_ventas_pagina, cursor, 20)
+            registro.medir(
+                f"offset_{profundidad}", execute_query,
+                """
+                SELECT v.id, v.fecha, u.usuario AS empleado, v.total, v.descuento
+                FROM ventas v
+                JOIN usuarios u ON v.empleado_id = u.id
+                ORDER BY v.fecha DESC, v.id DESC
+                LIMIT 21 OFFSET %s
+                """,
+                params=(profundidad,), nombre="bench_offset",
+            )
+    return registro.resumen()
+
+
+def escenario_materializacion(filas):
+    """
+    Tiempo y memoria pico para traer `filas` filas de venta_detalle con
+    execute_query, copy_query y stream_query.
+    """
+    from functions import copy_query, execute_query, stream_query
+
+    query = "SELECT id, venta_id, producto_id, cantidad, subtotal FROM venta_detalle ORDER BY id LIMIT %s"
+    metodos = {
+        "execute_query": lambda: len(execute_query(query, params=(filas,), nombre="bench_materializar")),
+        "copy_query": lambda: len(copy_query(query, params=(filas,))),
+        "stream_query": lambda: sum(len(df) for df in stream_query(query, params=(filas,), itersize=50_000)),
+    }
+    resultados = {}
+    for nombre, metodo in metodos.items():
+        inicio = time.perf_counter()
+        leidas = metodo()
+        segundos = time.perf_counter() - inicio
+        # Segunda pasada para medir memoria: tracemalloc hace más lento el código
+        tracemalloc.start()
+        metodo()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultados[nombre] = {
+            "filas": leidas,
+            "segundos": round(segundos, 3),
+            "memoria_pico_mb": round(pico / 2**20, 1),
+        }
+    return resultados
+
+
+def escenario_sobreventa(cajeros, stock):
+    """
+    Varios cajeros compran el mismo producto con `stock` unidades hasta
+    agotarlo. Al final el stock tiene que ser 0 y las ventas exitosas `stock`.
+    """
+    from functions import execute_query, invalidate_cache, procesar_venta_completa_db
+
+    producto = execute_query("SELECT id, nombre, precio FROM productos ORDER BY id LIMIT 1", nombre="bench_producto").iloc[0]
+    execute_query("UPDATE productos SET cantidad = %s WHERE id = %s",
+                  params=(stock, int(producto["id"])), is_select=False, nombre="bench_stock")
+    invalidate_cache("productos")
+    carrito = [{"id": int(producto["id"]), "nombre": producto["nombre"], "precio": float(producto["precio"]), "cantidad": 1}]
+
+    exitosas = []
+    rechazadas = []
+    lock = threading.Lock()
+
+    def cajero():
+        while True:
+            ok, resultado = procesar_venta_completa_db(1, carrito)
+            with lock:
+                (exitosas if ok else rechazadas).append(resultado)
+            if not ok:
+                return
+
+    hilos = [threading.Thread(target=cajero) for _ in range(cajeros)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    final = int(execute_query("SELECT cantidad FROM productos WHERE id = %s",
+                              params=(int(producto["id"]),), nombre="bench_stock_final").iloc[0]["cantidad"])
+    # Se vuelve a dejar stock de sobra para los demás escenarios
+    execute_query("UPDATE productos SET cantidad = 1000000000 WHERE id = %s",
+                  params=(int(producto["id"]),), is_select=False, nombre="bench_stock")
+    invalidate_cache("productos")
+    return {
+        "cajeros": cajeros,
+        "stock_inicial": stock,
+        "ventas_exitosas": len(exitosas),
+        "ventas_rechazadas": len(rechazadas),
+        "stock_final": final,
+        "ok": len(exitosas) == stock and final == 0,
+    }
+
+
+# ---- Ejecución y comparación ----
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def correr(args):
+    detener = levantar_postgres() if args.levantar else None
+    try:
+        # Todo lo que sigue usa la base de benchmarks a través del pool de functions.py
+        os.environ["SUPABASE_DB_NAME"] = BENCH_DB_NAME
+        # Una sola base aunque haya un tiendas.json en el directorio
+        functions._tiendas = {}
+        os.environ.setdefault("SUPABASE_POOL_MAX", str(max(10, args.cajeros + 2)))
+        from migraciones import aplicar_migraciones
+
+        if not args.sin_sembrar:
+            print(f"Creando {BENCH_DB_NAME} y cargando {args.ventas} ventas...")
+            crear_base()
+        pool = functions._get_pool()
+        if pool is None:
+            raise SystemExit("Faltan variables de entorno para la conexión")
+        pool.parametros["connection_factory"] = ConexionContada
+        if not args.sin_sembrar:
+            aplicar_migraciones()
+            inicio = time.perf_counter()
+            sembrar(args.productos, args.usuarios, args.ventas)
+            print(f"Datos cargados en {time.perf_counter() - inicio:.1f} s")
+
+        escenarios = args.escenarios.split(",")
+        resultados = {}
+        if "cajeros" in escenarios:
+            print(f"Cajeros: {args.cajeros} durante {args.segundos} s")
+            resultados["cajeros"] = escenario_cajeros(args.cajeros, args.segundos, args.usuarios)
+        if "checkout" in escenarios:
+            print("Checkout por cantidad de líneas")
+            resultados["checkout"] = escenario_checkout_lineas(args.repeticiones)
+        if "paginacion" in escenarios:
+            print("Paginación")
+            resultados["paginacion"] = escenario_paginacion(args.repeticiones)
+        if "materializacion" in escenarios:
+            print(f"Materialización de {args.filas} filas")
+            resultados["materializacion"] = escenario_materializacion(args.filas)
+        if "sobreventa" in escenarios:
+            print("Sobreventa concurrente")
+            resultados["sobreventa"] = escenario_sobreventa(args.cajeros, args.stock)
+
+        salida = {
+            "commit": _commit_actual(),
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "configuracion": {
+                "productos": args.productos,
+                "usuarios": args.usuarios,
+                "ventas": args.ventas,
+                "pool_max": functions._get_pool().maximo,
+            },
+            "resultados": resultados,
+            "pool": functions.get_pool_stats(),
+            "sentencias_preparadas": functions.get_prepared_stats(),
+        }
+        destino = Path(args.salida) if args.salida else RESULTADOS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{salida['commit'] or 'local'}.json"
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        destino.write_text(json.dumps(salida, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(json.dumps(resultados, indent=2, ensure_ascii=False))
+        print(f"Resultados guardados en {destino}")
+        sobreventa = resultados.get("sobreventa")
+        return 1 if sobreventa and not sobreventa["ok"] else 0
+    finally:
+        functions.cerrar_pools()
+        if detener:
+            detener()
+
+
+def _metricas_comparables(resultados, prefijo=""):
+    """
+    Aplana los resultados a {ruta: valor} con las latencias y throughputs.
+    """
+    planas = {}
+    for clave, valor in resultados.items():
+        ruta = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planas.update(_metricas_comparables(valor, f"{ruta}."))
+        elif clave in ("p50_ms", "p95_ms", "p99_ms", "por_segundo", "segundos", "memoria_pico_mb", "viajes_promedio"):
+            planas[ruta] = valor
+    return planas
+
+
+def comparar(args):
+    """
+    Compara dos resultados y marca las métricas que empeoraron más del umbral.
+    """
+    base = _metricas_comparables(json.loads(Path(args.base).read_text(encoding="utf-8"))["resultados"])
+    nuevo = _metricas_comparables(json.loads(Path(args.nuevo).read_text(encoding="utf-8"))["resultados"])
+    regresiones = 0
+    for ruta in sorted(base.keys() & nuevo.keys()):
+        antes, despues = base[ruta], nuevo[ruta]
+        if not antes:
+            continue
+        cambio = (despues - antes) / antes
+        # Para el throughput más es mejor; para el resto, menos
+        peor = -cambio if ruta.endswith("por_segundo") else cambio
+        marca = "❌" if peor > args.umbral else "  "
+        regresiones += peor > args.umbral
+        print(f"{marca} {ruta}: {antes} → {despues} ({cambio:+.1%})")
+    print(f"Regresiones mayores a {args.umbral:.0%}: {regresiones}")
+    return 1 if regresiones else 0
+
+
+def _main(argumentos):
+    parser = argparse.ArgumentParser(description="Benchmarks del kiosco contra un Postgres local")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    correr_parser = comandos.add_parser("correr", help="carga datos y corre los escenarios")
+    correr_parser.add_argument("--levantar", action="store_true", help="crear y arrancar un Postgres temporal")
+    correr_parser.add_argument("--sin-sembrar", action="store_true", help="reutilizar los datos de la corrida anterior")
+    correr_parser.add_argument("--productos", type=int, default=5000)
+    correr_parser.add_argument("--usuarios", type=int, default=20)
+    correr_parser.add_argument("--ventas", type=int, default=200_000)
+    correr_parser.add_argument("--cajeros", type=int, default=8)
+    correr_parser.add_argument("--segundos", type=float, default=30)
+    correr_parser.add_argument("--repeticiones", type=int, default=30)
+    correr_parser.add_argument("--filas", type=int, default=1_000_000, help="filas del escenario de materialización")
+    correr_parser.add_argument("--stock", type=int, default=200, help="stock del escenario de sobreventa")
+    correr_parser.add_argument("--escenarios", default="cajeros,checkout,paginacion,materializacion,sobreventa")
+    correr_parser.add_argument("--salida", help="archivo JSON de resultados")
+
+    comparar_parser = comandos.add_parser("comparar", help="compara dos resultados")
+    comparar_parser.add_argument("base")
+    comparar_parser.add_argument("nuevo")
+    comparar_parser.add_argument("--umbral", type=float, default=0.10, help="empeoramiento tolerado (0.10 = 10%%)")
+
+    args = parser.parse_args(argumentos)
+    return correr(args) if args.comando == "correr" else comparar(args)
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+import io
+import os
+
+import pandas as pd
+
+from functions import connect_to_supabase, invalidate_cache, release_connection
+
+# =====================================
+# IMPORTACIÓN Y EXPORTACIÓN MASIVA
+# =====================================
+# Los archivos se cargan con COPY en una tabla temporal y se aplican a
+# productos con un único upsert/UPDATE, todo en una sola transacción. Así una
+# lista de precios o un conteo de inventario de 100k líneas tarda segundos
+# en lugar de una conexión y una query por fila.
+
+COLUMNAS_PRODUCTOS = ["id", "nombre", "proveedor_id", "cantidad", "precio"]
+COLUMNAS_ENTERAS = ["id", "proveedor_id", "cantidad"]
+
+
+def _leer_archivo(archivo):
+    """
+    Lee un CSV o Parquet desde una ruta o un archivo subido (por ejemplo con
+    st.file_uploader). El formato se deduce de la extensión.
+    """
+    nombre = archivo if isinstance(archivo, str) else getattr(archivo, "name", "")
+    if nombre.lower().endswith(".parquet"):
+        return pd.read_parquet(archivo)
+    return pd.read_csv(archivo)
+
+
+def _preparar(df, columnas):
+    """
+    Deja solo las columnas pedidas, con los enteros como Int64 para que los
+    valores vacíos lleguen como NULL y no como 1.0.
+    """
+    df = df.reindex(columns=columnas)
+    for columna in columnas:
+        if columna in COLUMNAS_ENTERAS:
+            df[columna] = pd.to_numeric(df[columna]).astype("Int64")
+    return df
+
+
+def _copiar_a_staging(cursor, tabla, df):
+    """
+    Crea una tabla temporal con las columnas de productos y la llena con COPY.
+    """
+    cursor.execute(f"""
+        CREATE TEMP TABLE {tabla} (
+            id integer,
+            nombre text,
+            proveedor_id integer,
+            cantidad integer,
+            precio numeric
+        ) ON COMMIT DROP
+    """)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {tabla} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def importar_productos(archivo, clave="id", tienda=None):
+    """
+    Importa productos desde un CSV/Parquet con columnas nombre, proveedor_id,
+    cantidad y precio (e id si clave="id").
+
+    Con clave="id" las filas con id existente se actualizan y las demás se
+    insertan. Con clave="nombre" se hace lo mismo comparando por nombre.
+    Retorna (True, filas procesadas) o (False, mensaje de error).
+    """
+    if clave not in ("id", "nombre"):
+        return False, f"Clave inválida: {clave}"
+
+    conn = None
+    try:
+        # Un archivo mal formado (columnas faltantes, números inválidos) se
+        # rechaza antes de tomar una conexión
+        df = _leer_archivo(archivo)
+        requeridas = ["nombre", "proveedor_id", "cantidad", "precio"] + (["id"] if clave == "id" else [])
+        faltantes = [c for c in requeridas if c not in df.columns]
+        if faltantes:
+            return False, f"Faltan columnas: {', '.join(faltantes)}"
+        df = _preparar(df, COLUMNAS_PRODUCTOS if clave == "id" else requeridas)
+
+        conn = connect_to_supabase(tienda)
+        if not conn:
+            return False, "Error de conexión a la base de datos"
+        cursor = conn.cursor()
+        _copiar_a_staging(cursor, "staging_productos", df)
+
+        if clave == "id":
+            cursor.execute("""
+                INSERT INTO productos (id, nombre, proveedor_id, cantidad, precio)
+                SELECT DISTINCT ON (id) id, nombre, proveedor_id, cantidad, precio
+                FROM staging_productos
+                WHERE id IS NOT NULL
+                ORDER BY id
+                ON CONFLICT (id) DO UPDATE SET
+                    nombre = EXCLUDED.nombre,
+                    proveedor_id = EXCLUDED.proveedor_id,
+                    cantidad = EXCLUDED.cantidad,
+                    precio = EXCLUDED.precio
+            """)
+            procesadas = cursor.rowcount
+            cursor.execute("""
+                INSERT INTO productos (nombre, proveedor_id, cantidad, precio)
+                SELECT nombre, proveedor_id, cantidad, precio
+                FROM staging_productos
+                WHERE id IS NULL
+            """)
+            procesadas += cursor.rowcount
+            # Con ids explícitos la secuencia puede quedar atrasada
+            cursor.execute("""
+                SELECT setval(
+                    pg_get_serial_sequence('productos', 'id'),
+                    GREATEST((SELECT MAX(id) FROM productos), 1)
+                )
+            """)
+        else:
+            cursor.execute("""
+                UPDATE productos AS p
+                SET proveedor_id = s.proveedor_id,
+                    cantidad = s.cantidad,
+                    precio = s.precio
+                FROM (
+                    SELECT DISTINCT ON (nombre) * FROM staging_productos
+                ) AS s
+                WHERE p.nombre = s.nombre
+            """)
+            procesadas = cursor.rowcount
+            cursor.execute("""
+                INSERT INTO productos (nombre, proveedor_id, cantidad, precio)
+                SELECT DISTINCT ON (s.nombre) s.nombre, s.proveedor_id, s.cantidad, s.precio
+                FROM staging_productos s
+                WHERE NOT EXISTS (SELECT 1 FROM productos p WHERE p.nombre = s.nombre)
+            """)
+            procesadas += cursor.rowcount
+
+        conn.commit()
+        invalidate_cache("productos", tienda=tienda)
+        return True, procesadas
+    except Exception as e:
+        print(f"Error importando productos: {e}")
+        if conn:
+            conn.rollback()
+        return False, str(e)
+    finally:
+        release_connection(conn, tienda)
+
+
+def importar_stock(archivo, clave="id", tienda=None):
+    """
+    Aplica un conteo de inventario desde un CSV/Parquet con las columnas
+    cantidad e id (o nombre si clave="nombre"). Reemplaza el stock de cada
+    producto encontrado con un único UPDATE.
+    Retorna (True, productos actualizados) o (False, mensaje de error).
+    """
+    if clave not in ("id", "nombre"):
+        return False, f"Clave inválida: {clave}"
+
+    conn = None
+    try:
+        df = _leer_archivo(archivo)
+        faltantes = [c for c in (clave, "cantidad") if c not in df.columns]
+        if faltantes:
+            return False, f"Faltan columnas: {', '.join(faltantes)}"
+        df = _preparar(df, [clave, "cantidad"])
+
+        conn = connect_to_supabase(tienda)
+        if not conn:
+            return False, "Error de conexión a la base de datos"
+        cursor = conn.cursor()
+        _copiar_a_staging(cursor, "staging_stock", df)
+        cursor.execute(f"""
+            UPDATE productos AS p
+            SET cantidad = s.cantidad
+            FROM (
+                SELECT DISTINCT ON ({clave}) {clave}, cantidad FROM staging_stock
+            ) AS s
+            WHERE p.{clave} = s.{clave}
+        """)
+        actualizados = cursor.rowcount
+        conn.commit()
+        invalidate_cache("productos", tienda=tienda)
+        return True, actualizados
+    except Exception as e:
+        print(f"Error importando stock: {e}")
+        if conn:
+            conn.rollback()
+        return False, str(e)
+    finally:
+        release_connection(conn, tienda)
+
+
+def _exportar(query, destino, params=None, tienda=None):
+    """
+    Escribe el resultado de la query en CSV directamente desde COPY, sin
+    cargarlo en memoria. `destino` es una ruta o un archivo binario abierto.
+    """
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return False
+    archivo = None
+    try:
+        cursor = conn.cursor()
+        sql = cursor.mogrify(query, params).decode() if params else query
+        archivo = open(destino, "wb") if isinstance(destino, (str, os.PathLike)) else destino
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", archivo)
+        return True
+    except Exception as e:
+        print(f"Error exportando: {e}")
+        return False
+    finally:
+        if archivo is not None and archivo is not destino:
+            archivo.close()
+        release_connection(conn, tienda)
+
+
+def exportar_catalogo(destino, tienda=None):
+    """
+    Exporta el catálogo de productos a CSV.
+    """
+    return _exportar(
+        "SELECT id, nombre, proveedor_id, cantidad, precio FROM productos ORDER BY id",
+        destino,
+        tienda=tienda,
+    )
+
@@ -0,0 +1,370 @@
+import bisect
+import json
+import os
+import select
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import metricas
+from functions import (
+    CACHE_TTL,
+    _clave_tienda,
+    connect_session,
+    execute_query,
+    get_cache_generation,
+    get_productos,
+    registrar_aviso_stock,
+)
+
+# =====================================
+# CATÁLOGO DE PRODUCTOS EN MEMORIA
+# =====================================
+class Catalogo:
+    """
+    Catálogo de productos indexado para las búsquedas del carrito.
+
+    Se arma una sola vez por generación del cache de productos. Las búsquedas
+    por id y por nombre son O(1), precio y stock se guardan en arrays de numpy
+    y hay un índice de prefijos y de trigramas para filtrar el selectbox sin
+    recorrer todo el catálogo en cada rerun.
+    """
+
+    def __init__(self, df_productos):
+        self.ids = df_productos["id"].to_numpy(dtype=np.int64)
+        self.nombres = df_productos["nombre"].astype(str).tolist()
+        self.precios = df_productos["precio"].to_numpy(dtype=np.float64, copy=True)
+        self.stock = df_productos["cantidad"].to_numpy(dtype=np.int64, copy=True)
+
+        self._por_id = {int(producto_id): i for i, producto_id in enumerate(self.ids)}
+        self._minusculas = [nombre.lower() for nombre in self.nombres]
+
+        # Los nombres no son únicos: se guarda cada posición en la que aparece
+        self._por_nombre = {}
+        for i, nombre in enumerate(self._minusculas):
+            self._por_nombre.setdefault(nombre, []).append(i)
+
+        # Índice de prefijos: posiciones ordenadas alfabéticamente
+        self._orden = sorted(range(len(self.nombres)), key=self._minusculas.__getitem__)
+        self._ordenados = [self._minusculas[i] for i in self._orden]
+
+        # Índice de trigramas para búsquedas por substring
+        self._trigramas = {}
+        for i, nombre in enumerate(self._minusculas):
+            for trigrama in {nombre[j:j + 3] for j in range(len(nombre) - 2)}:
+                self._trigramas.setdefault(trigrama, []).append(i)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _fila(self, i):
+        return {
+            "id": int(self.ids[i]),
+            "nombre": self.nombres[i],
+            "precio": float(self.precios[i]),
+            "cantidad": int(self.stock[i]),
+        }
+
+    def por_id(self, producto_id):
+        """
+        Devuelve el producto como diccionario o None si no existe.
+        """
+        i = self._por_id.get(int(producto_id))
+        return None if i is None else self._fila(i)
+
+    def actualizar(self, producto_id, nombre, cantidad, precio):
+        """
+        Cambia stock y precio de un producto en el lugar. Devuelve False si
+        el producto no está o si cambió el nombre (hay que rearmar los índices).
+        """
+        i = self._por_id.get(int(producto_id))
+        if i is None or self.nombres[i] != nombre:
+            return False
+        self.stock[i] = cantidad
+        self.precios[i] = precio
+        return True
+
+    def descontar_stock(self, stock):
+        """
+        Aplica el stock que quedó después de una venta ({producto_id: cantidad}).
+        Las ventas solo bajan el stock, así que si dos avisos llegan en otro
+        orden se queda el menor. Los productos que no están se ignoran.
+        """
+        for producto_id, cantidad in stock.items():
+            i = self._por_id.get(int(producto_id))
+            if i is not None and cantidad < self.stock[i]:
+                self.stock[i] = cantidad
+
+    def a_dataframe(self):
+        return pd.DataFrame({
+            "id": self.ids,
+            "nombre": self.nombres,
+            "cantidad": self.stock,
+            "precio": self.precios,
+        })
+
+    def por_nombre(self, nombre):
+        """
+        Devuelve todos los productos con ese nombre (sin distinguir mayúsculas).
+        """
+        return [self._fila(i) for i in self._por_nombre.get(nombre.lower(), [])]
+
+    def etiqueta(self, producto_id):
+        """
+        Texto para mostrar en el selectbox; agrega el id si el nombre se repite.
+        """
+        i = self._por_id[int(producto_id)]
+        if len(self._por_nombre[self._minusculas[i]]) > 1:
+            return f"{self.nombres[i]} (#{self.ids[i]})"
+        return self.nombres[i]
+
+    def buscar(self, texto="", limite=100):
+        """
+        Devuelve hasta `limite` ids de productos cuyo nombre contiene `texto`.
+        Primero los que empiezan con el texto y después el resto.
+        """
+        texto = (texto or "").strip().lower()
+        if not texto:
+            return [int(self.ids[i]) for i in self._orden[:limite]]
+
+        resultado = []
+        vistos = set()
+
+        # Coincidencias por prefijo, usando búsqueda binaria sobre los nombres ordenados
+        k = bisect.bisect_left(self._ordenados, texto)
+        while k < len(self._ordenados) and len(resultado) < limite and self._ordenados[k].startswith(texto):
+            i = self._orden[k]
+            resultado.append(i)
+            vistos.add(i)
+            k += 1
+
+        # Coincidencias por substring: se parte de la lista de trigramas más corta
+        if len(resultado) < limite:
+            if len(texto) >= 3:
+                listas = [self._trigramas.get(texto[j:j + 3], []) for j in range(len(texto) - 2)]
+                candidatos = min(listas, key=len)
+            else:
+                candidatos = self._orden
+            for i in candidatos:
+                if len(resultado) >= limite:
+                    break
+                if i not in vistos and texto in self._minusculas[i]:
+                    resultado.append(i)
+                    vistos.add(i)
+
+        return [int(self.ids[i]) for i in resultado]
+
+
+_catalogo = None
+_catalogo_generacion = None
+_catalogo_vence = 0.0
+_catalogo_lock = threading.Lock()
+# Catálogos de las demás tiendas: tienda -> (Catalogo, generación, vencimiento)
+_catalogos_tiendas = {}
+
+
+def _catalogo_de_tienda(tienda):
+    """
+    Catálogo de una tienda que no es la de este proceso: solo con el cache
+    por generación y TTL, sin escucha en vivo.
+    """
+    generacion = get_cache_generation("productos", tienda=tienda)
+    with _catalogo_lock:
+        catalogo, generacion_anterior, vence = _catalogos_tiendas.get(tienda, (None, None, 0.0))
+        if catalogo is None or generacion != generacion_anterior or time.monotonic() >= vence:
+            df = get_productos(tienda=tienda)
+            if len(df.columns) == 0 and catalogo is not None:
+                return catalogo
+            if len(df.columns) == 0:
+                df = df.reindex(columns=["id", "nombre", "cantidad", "precio"])
+            catalogo = Catalogo(df)
+            _catalogos_tiendas[tienda] = (catalogo, generacion, time.monotonic() + CACHE_TTL)
+    return catalogo
+
+
+def _aviso_stock(tienda, generacion, stock):
+    """
+    Aviso del checkout (ver functions.registrar_aviso_stock). Si desde que se
+    armó el catálogo de la tienda solo pasó esta venta, se le descuenta el
+    stock en el lugar y queda al día con la nueva generación. Si hubo otros
+    cambios en el medio (altas, ediciones, importaciones) no se toca y se
+    rearma en la próxima lectura, como antes.
+    """
+    global _catalogo_generacion
+    with _catalogo_lock:
+        if tienda == _clave_tienda():
+            # Con la escucha en vivo el cambio ya llega por NOTIFY
+            if _catalogo is None or _escucha_lista.is_set() or _catalogo_generacion != generacion - 1:
+                return
+            _catalogo.descontar_stock(stock)
+            _catalogo_generacion = generacion
+        else:
+            catalogo, generacion_anterior, vence = _catalogos_tiendas.get(tienda, (None, None, 0.0))
+            if catalogo is None or generacion_anterior != generacion - 1:
+                return
+            catalogo.descontar_stock(stock)
+            _catalogos_tiendas[tienda] = (catalogo, generacion, vence)
+
+
+registrar_aviso_stock(_aviso_stock)
+
+
+def get_catalogo(tienda=None):
+    """
+    Devuelve el catálogo compartido por todas las sesiones. Se vuelve a armar
+    solo cuando cambia la generación del cache de productos o vence el TTL;
+    las ventas de este proceso le descuentan el stock sin rearmarlo.
+    Con CATALOGO_EN_VIVO=1, mientras la escucha de cambios esté conectada se
+    devuelve el catálogo que ella mantiene al día, sin consultar la base.
+    La escucha es solo para la tienda de este proceso (TIENDA_ID).
+    """
+    global _catalogo, _catalogo_generacion, _catalogo_vence
+    clave = _clave_tienda(tienda)
+    if clave != _clave_tienda():
+        return _catalogo_de_tienda(clave)
+    if CATALOGO_EN_VIVO:
+        iniciar_escucha()
+        if _escucha_lista.is_set():
+            return _catalogo
+    generacion = get_cache_generation("productos")
+    if _catalogo is not None and generacion == _catalogo_generacion and time.monotonic() < _catalogo_vence:
+        return _catalogo
+    with _catalogo_lock:
+        if _catalogo is None or generacion != _catalogo_generacion or time.monotonic() >= _catalogo_vence:
+            df = get_productos()
+            # Si la query falló se sigue usando el catálogo anterior
+            if len(df.columns) == 0 and _catalogo is not None:
+                return _catalogo
+            if len(df.columns) == 0:
+                df = df.reindex(columns=["id", "nombre", "cantidad", "precio"])
+            _catalogo = Catalogo(df)
+            _catalogo_generacion = generacion
+            _catalogo_vence = time.monotonic() + CACHE_TTL
+    return _catalogo
+
+
+# =====================================
+# CATÁLOGO EN VIVO (LISTEN/NOTIFY)
+# =====================================
+# El trigger de migraciones/0005_notificar_productos.sql publica cada cambio
+# de productos con la fila completa. Un hilo por proceso escucha el canal y
+# aplica los cambios al catálogo compartido: las ventas de otras cajas, los
+# cambios de stock y los productos nuevos se ven sin volver a leer la tabla.
+# LISTEN necesita una conexión de sesión: el Transaction Pooler de Supabase
+# no la soporta, así que se usa SUPABASE_DB_SESSION_HOST/PORT. Con varias
+# tiendas se escucha solo la base de la tienda de este proceso.
+
+CATALOGO_EN_VIVO = os.getenv("CATALOGO_EN_VIVO", "0") == "1"
+CANAL_PRODUCTOS = "productos_cambios"
+# Con más cambios juntos que esto (por ejemplo una importación masiva) se relee la tabla
+MAX_CAMBIOS_POR_LOTE = 500
+# Segundos sin mensajes tras los cuales se chequea que la conexión siga viva
+ESCUCHA_KEEPALIVE = 60
+
+_escucha = None
+_escucha_lista = threading.Event()
+_escucha_lock = threading.Lock()
+_escucha_stats = {"cambios": 0, "recargas": 0, "reconexiones": 0}
+
+
+def _recargar():
+    """
+    Vuelve a leer todos los productos. Se llama con _catalogo_lock tomado.
+    """
+    global _catalogo
+    df = execute_query("SELECT id, nombre, cantidad, precio FROM productos", is_select=True, nombre="catalogo_en_vivo")
+    if len(df.columns) == 0:
+        raise RuntimeError("no se pudo leer la tabla productos")
+    _catalogo = Catalogo(df)
+    _escucha_stats["recargas"] += 1
+
+
+def _aplicar_cambios(cambios):
+    """
+    Aplica al catálogo una tanda de cambios recibidos por NOTIFY. Los cambios
+    de stock y precio se aplican en el lugar; altas, bajas y cambios de
+    nombre rearman el catálogo desde memoria, una sola vez por tanda.
+    """
+    global _catalogo
+    with _catalogo_lock:
+        _escucha_stats["cambios"] += len(cambios)
+        metricas.contar("catalogo_en_vivo", "cambios", len(cambios))
+        if _catalogo is None or len(cambios) > MAX_CAMBIOS_POR_LOTE or any(c["op"] == "TRUNCATE" for c in cambios):
+            _recargar()
+            return
+
+        estructurales = [
+            c for c in cambios
+            if not (c["op"] == "UPDATE" and _catalogo.actualizar(c["id"], c["nombre"], c["cantidad"], c["precio"]))
+        ]
+        if not estructurales:
+            return
+        df = _catalogo.a_dataframe().set_index("id")
+        for cambio in estructurales:
+            if cambio["op"] == "DELETE":
+                df = df.drop(cambio["id"], errors="ignore")
+            else:
+                df.loc[cambio["id"], ["nombre", "cantidad", "precio"]] = [cambio["nombre"], cambio["cantidad"], cambio["precio"]]
+        _catalogo = Catalogo(df.reset_index())
+
+
+def _loop_escucha():
+    espera = 1
+    while True:
+        conn = connect_session()
+        if conn is not None:
+            try:
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CANAL_PRODUCTOS}")
+                # Se escucha antes de leer la tabla: lo que cambie mientras tanto
+                # llega después como mensaje y se aplica sobre lo leído.
+                with _catalogo_lock:
+                    _recargar()
+                _escucha_lista.set()
+                espera = 1
+                while True:
+                    if not select.select([conn], [], [], ESCUCHA_KEEPALIVE)[0]:
+                        cursor.execute("SELECT 1")
+                    conn.poll()
+                    if conn.notifies:
+                        cambios = [json.loads(notificacion.payload) for notificacion in conn.notifies]
+                        conn.notifies.clear()
+                        _aplicar_cambios(cambios)
+            except Exception as e:
+                print(f"Error escuchando cambios de productos: {e}")
+            finally:
+                # Mientras no haya escucha, get_catalogo vuelve a usar el cache con TTL
+                _escucha_lista.clear()
+                conn.close()
+        _escucha_stats["reconexiones"] += 1
+        time.sleep(espera)
+        espera = min(espera * 2, 60)
+
+
+def iniciar_escucha():
+    """
+    Arranca el hilo que escucha los cambios de productos (uno solo por
+    proceso). No hace nada si CATALOGO_EN_VIVO no está activo.
+    """
+    global _escucha
+    if not CATALOGO_EN_VIVO:
+        return
+    with _escucha_lock:
+        if _escucha is None or not _escucha.is_alive():
+            _escucha = threading.Thread(target=_loop_escucha, name="catalogo-en-vivo", daemon=True)
+            _escucha.start()
+
+
+def get_catalogo_stats():
+    """
+    Estado de la escucha en vivo: si está activa y conectada, y cuántos
+    cambios, recargas y reconexiones hubo.
+    """
+    return {
+        "en_vivo": CATALOGO_EN_VIVO,
+        "conectado": _escucha_lista.is_set(),
+        **_escucha_stats,
+    }
@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from functions import ERROR_CONEXION, _clave_tienda, procesar_venta_completa_db
+
+# =====================================
+# COLA OFFLINE DE VENTAS
+# =====================================
+# Las ventas confirmadas se pueden guardar en un archivo SQLite local y un
+# hilo en segundo plano las envía a la base cuando hay conexión. Cada venta
+# lleva una clave de idempotencia generada acá, así que reintentarla nunca
+# la graba dos veces (ver migraciones/0004_idempotencia_ventas.sql).
+# Cada venta guarda también la tienda a la que va (NULL con una sola base).
+
+# Junto a este archivo y no en el directorio desde el que se lanzó la app,
+# así la cola pendiente no se pierde si se arranca desde otra carpeta
+COLA_PATH = Path(__file__).parent / os.getenv("COLA_VENTAS_PATH", "cola_ventas.db")
+# Si está activo, todas las ventas pasan por la cola y el checkout solo espera al disco
+COLA_SIEMPRE = os.getenv("COLA_VENTAS_SIEMPRE", "0") == "1"
+COLA_LOTE = int(os.getenv("COLA_VENTAS_LOTE", "20"))
+COLA_INTERVALO = float(os.getenv("COLA_VENTAS_INTERVALO", "5"))
+COLA_BACKOFF_MAX = float(os.getenv("COLA_VENTAS_BACKOFF_MAX", "300"))
+
+_lock = threading.Lock()
+_despertar = threading.Event()
+_worker = None
+
+
+def _conectar():
+    conn = sqlite3.connect(COLA_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ventas_pendientes (
+            clave TEXT PRIMARY KEY,
+            empleado_id INTEGER NOT NULL,
+            carrito TEXT NOT NULL,
+            descuento REAL NOT NULL,
+            creada REAL NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            proximo_intento REAL NOT NULL DEFAULT 0,
+            venta_id INTEGER,
+            error TEXT,
+            tienda TEXT
+        )
+    """)
+    # Colas creadas antes de que hubiera varias tiendas
+    columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(ventas_pendientes)")}
+    if "tienda" not in columnas:
+        conn.execute("ALTER TABLE ventas_pendientes ADD COLUMN tienda TEXT")
+    return conn
+
+
+def encolar_venta(empleado_id, productos_carrito, descuento=0.0, clave=None, tienda=None):
+    """
+    Guarda la venta en la cola local y despierta al sincronizador.
+    Devuelve la clave de idempotencia de la venta.
+    """
+    clave = clave or str(uuid.uuid4())
+    tienda = _clave_tienda(tienda)
+    with _lock:
+        conn = _conectar()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO ventas_pendientes (clave, empleado_id, carrito, descuento, creada, tienda)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (clave, int(empleado_id), json.dumps(productos_carrito), float(descuento), time.time(), tienda),
+                )
+        finally:
+            conn.close()
+    _despertar.set()
+    return clave
+
+
+def _ticket_pendiente(clave, productos_carrito, descuento):
+    """
+    Ticket provisorio para mostrar mientras la venta espera en la cola.
+    """
+    detalle = pd.DataFrame(
+        [(None, item["nombre"], item["cantidad"], item["precio"] * item["cantidad"]) for item in productos_carrito],
+        columns=["id", "nombre", "cantidad", "subtotal"],
+    )
+    return {
+        "venta_id": None,
+        "clave": clave,
+        "pendiente": True,
+        "fecha": None,
+        "total": float(detalle["subtotal"].sum()),
+        "descuento": descuento,
+        "detalle": detalle,
+    }
+
+
+def registrar_venta(empleado_id, productos_carrito, descuento=0.0, tienda=None):
+    """
+    Registra una venta sin bloquear la caja si se cae la conexión.
+
+    Intenta grabarla directamente; si no hay conexión (o si COLA_VENTAS_SIEMPRE=1)
+    la guarda en la cola local y devuelve un ticket con "pendiente": True.
+    Los rechazos de la base (por ejemplo falta de stock) se devuelven como error.
+    """
+    clave = str(uuid.uuid4())
+    if not COLA_SIEMPRE:
+        success, result = procesar_venta_completa_db(
+            empleado_id, productos_carrito, descuento, clave_idempotencia=clave, tienda=tienda
+        )
+        if success or result != ERROR_CONEXION:
+            return success, result
+
+    encolar_venta(empleado_id, productos_carrito, descuento, clave=clave, tienda=tienda)
+    iniciar_sincronizacion()
+    return True, _ticket_pendiente(clave, productos_carrito, descuento)
+
+
+def sincronizar_lote(limite=None):
+    """
+    Envía a la base hasta `limite` ventas pendientes, en orden de llegada.
+    Devuelve cuántas se enviaron. Si se corta la conexión con una tienda se
+    dejan de intentar sus ventas y se reprograman con espera exponencial;
+    las de las demás tiendas siguen.
+    """
+    limite = limite or COLA_LOTE
+    with _lock:
+        conn = _conectar()
+        try:
+            pendientes = conn.execute(
+                """
+                SELECT clave, empleado_id, carrito, descuento, intentos, tienda
+                FROM ventas_pendientes
+                WHERE estado = 'pendiente' AND proximo_intento <= ?
+                ORDER BY creada
+                LIMIT ?
+                """,
+                (time.time(), limite),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    enviadas = 0
+    sin_conexion = set()
+    for clave, empleado_id, carrito, descuento, intentos, tienda in pendientes:
+        if tienda in sin_conexion:
+            continue
+        success, result = procesar_venta_completa_db(
+            empleado_id, json.loads(carrito), descuento, clave_idempotencia=clave, tienda=tienda
+        )
+        with _lock:
+            conn = _conectar()
+            try:
+                with conn:
+                    if success:
+                        conn.execute(
+                            "UPDATE ventas_pendientes SET estado = 'enviada', venta_id = ?, error = NULL WHERE clave = ?",
+                            (int(result["venta_id"]), clave),
+                        )
+                    elif result == ERROR_CONEXION:
+                        espera = min(COLA_INTERVALO * (2 ** intentos), COLA_BACKOFF_MAX)
+                        conn.execute(
+                            """
+                            UPDATE ventas_pendientes
+                            SET intentos = intentos + 1, proximo_intento = ?, error = ?
+                            WHERE clave = ?
+                            """,
+                            (time.time() + espera, result, clave),
+                        )
+                    else:
+                        # La base rechazó la venta (por ejemplo por stock): queda para revisión
+                        conn.execute(
+                            "UPDATE ventas_pendientes SET estado = 'rechazada', intentos = intentos + 1, error = ? WHERE clave = ?",
+                            (result, clave),
+                        )
+            finally:
+                conn.close()
+
+        if success:
+            enviadas += 1
+        elif result == ERROR_CONEXION:
+            sin_conexion.add(tienda)
+    return enviadas
+
+
+def _loop_sincronizacion():
+    while True:
+        try:
+            enviadas = sincronizar_lote()
+        except Exception as e:
+            print(f"Error sincronizando ventas pendientes: {e}")
+            enviadas = 0
+        # Si se llenó el lote puede haber más: se sigue sin esperar
+        if enviadas < COLA_LOTE:
+            _despertar.wait(COLA_INTERVALO)
+            _despertar.clear()
+
+
+def iniciar_sincronizacion():
+    """
+    Arranca el hilo que vacía la cola (uno solo por proceso).
+    """
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_loop_sincronizacion, name="cola-ventas", daemon=True)
+            _worker.start()
+
+
+def estado_cola():
+    """
+    Devuelve la cantidad de ventas por estado (pendiente, enviada, rechazada).
+    """
+    with _lock:
+        conn = _conectar()
+        try:
+            filas = conn.execute("SELECT estado, COUNT(*) FROM ventas_pendientes GROUP BY estado").fetchall()
+        finally:
+            conn.close()
+    return dict(filas)
+
+
+def get_ventas_rechazadas():
+    """
+    Devuelve las ventas de la cola que la base rechazó, para revisarlas.
+    """
+    with _lock:
+        conn = _conectar()
+        try:
+            return conn.execute(
+                """
+                SELECT clave, empleado_id, carrito, descuento, creada, error, tienda
+                FROM ventas_pendientes
+                WHERE estado = 'rechazada'
+                ORDER BY creada
+                """
+            ).fetchall()
+        finally:
+            conn.close()
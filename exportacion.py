@@ -0,0 +1,321 @@
+import os
+import queue
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from functions import ERROR_CONEXION, _clave_tienda, connect_to_supabase, execute_query, release_connection
+
+# =====================================
+# EXPORTACIÓN DE VENTAS POR TRAMOS
+# =====================================
+# Exporta las ventas con su detalle (una fila por línea de ticket) a CSV,
+# Parquet o Excel sin cargarlas en memoria. El rango de fechas se parte en
+# tramos de EXPORTACION_DIAS días; varios hilos leen tramos a la vez con
+# cursores del servidor, convierten cada lote al formato del archivo y se lo
+# pasan al hilo que escribe por colas acotadas. El archivo se escribe en
+# orden de fecha y en memoria nunca hay más de
+# EXPORTACION_HILOS * (EXPORTACION_COLA + 1) lotes.
+#
+# Cada tramo filtra ventas y venta_detalle por su propia fecha, así que solo
+# se recorren las particiones de los meses pedidos.
+#
+# Es la única exportación de ventas con detalle: la pantalla de Reportes y
+# cualquier script la usan a través de exportar_ventas_por_tramos().
+
+# Tramos que se leen a la vez (cada uno ocupa una conexión del pool)
+EXPORTACION_HILOS = int(os.getenv("EXPORTACION_HILOS", "3"))
+EXPORTACION_DIAS = int(os.getenv("EXPORTACION_DIAS", "7"))
+# Filas por lote leído de la base y escrito en el archivo
+EXPORTACION_LOTE = int(os.getenv("EXPORTACION_LOTE", "5000"))
+# Lotes que un tramo puede tener leídos esperando a ser escritos
+EXPORTACION_COLA = int(os.getenv("EXPORTACION_COLA", "4"))
+# Relativa a la carpeta de la app, no al directorio desde el que se lanzó Streamlit
+EXPORTACION_DIR = Path(__file__).parent / os.getenv("EXPORTACION_DIR", "exportaciones")
+EXPORTACION_COMPRESION = os.getenv("EXPORTACION_COMPRESION", "zstd")
+
+FORMATOS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Columnas del archivo con su tipo en Arrow (el mismo en todos los lotes)
+ESQUEMA = pa.schema([
+    ("venta_id", pa.int32()),
+    ("fecha", pa.timestamp("us", tz="UTC")),
+    ("empleado", pa.string()),
+    ("descuento", pa.decimal128(5, 4)),
+    ("total", pa.decimal128(12, 2)),
+    ("producto_id", pa.int32()),
+    ("producto", pa.string()),
+    ("cantidad", pa.int32()),
+    ("subtotal", pa.decimal128(12, 2)),
+])
+
+_QUERY_TRAMO = """
+    SELECT v.id, v.fecha, u.usuario, v.descuento, v.total,
+           vd.producto_id, p.nombre, vd.cantidad, vd.subtotal
+    FROM ventas v
+    JOIN usuarios u ON u.id = v.empleado_id
+    JOIN venta_detalle vd ON vd.venta_id = v.id AND vd.fecha = v.fecha
+    JOIN productos p ON p.id = vd.producto_id
+    WHERE v.fecha >= %(inicio)s AND v.fecha < %(fin)s
+      AND vd.fecha >= %(inicio)s AND vd.fecha < %(fin)s
+    ORDER BY v.fecha, v.id, vd.id
+"""
+
+# Marca de fin de tramo en su cola
+_FIN = object()
+
+
+def _tramos(desde, hasta, dias=None):
+    """
+    Parte el rango [desde, hasta] (fechas inclusive) en tramos de `dias`
+    días. Retorna [(inicio, fin exclusivo)].
+    """
+    paso = timedelta(days=dias or EXPORTACION_DIAS)
+    tramos = []
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(inicio + paso, hasta + timedelta(days=1))
+        tramos.append((inicio, fin))
+        inicio = fin
+    return tramos
+
+
+def _primera_fecha(tienda=None):
+    """
+    Fecha de la venta más vieja, o None si no hay ventas.
+    """
+    filas = execute_query(
+        "SELECT min(fecha)::date FROM ventas",
+        is_select=True,
+        nombre="exportacion_desde",
+        as_tuples=True,
+        tienda=tienda,
+    )
+    # Si la query falla execute_query devuelve un DataFrame vacío en lugar de filas
+    if not isinstance(filas, list):
+        raise RuntimeError(ERROR_CONEXION)
+    return filas[0][0]
+
+
+def _poner(cola, item, cancelada):
+    """
+    Encola sin bloquear para siempre: si la exportación se cancela mientras
+    la cola está llena, se deja de esperar.
+    """
+    while not cancelada.is_set():
+        try:
+            cola.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            pass
+
+
+def _leer_tramo(inicio, fin, cola, cancelada, preparar, tienda):
+    """
+    Lee un tramo con un cursor del servidor y lo encola de a
+    EXPORTACION_LOTE filas, ya pasadas por `preparar`. Al terminar encola
+    _FIN, o el error si falló.
+    """
+    conn = None
+    try:
+        conn = connect_to_supabase(tienda)
+        if conn is None:
+            raise RuntimeError(ERROR_CONEXION)
+        cursor = conn.cursor(name=f"exportacion_{uuid.uuid4().hex}")
+        cursor.itersize = EXPORTACION_LOTE
+        cursor.execute(_QUERY_TRAMO, {"inicio": inicio, "fin": fin})
+        while not cancelada.is_set():
+            lote = cursor.fetchmany(EXPORTACION_LOTE)
+            if not lote:
+                break
+            _poner(cola, preparar(lote), cancelada)
+        cursor.close()
+        _poner(cola, _FIN, cancelada)
+    except Exception as e:
+        _poner(cola, e, cancelada)
+    finally:
+        release_connection(conn, tienda)
+
+
+class _EscritorArrow:
+    """
+    Escribe CSV o Parquet de a un lote por vez. Los lotes llegan como
+    tablas de Arrow, que ocupan mucho menos que las tuplas mientras esperan.
+    """
+
+    def __init__(self, ruta, formato):
+        if formato == "parquet":
+            self._writer = pq.ParquetWriter(ruta, ESQUEMA, compression=EXPORTACION_COMPRESION)
+        else:
+            self._writer = pa_csv.CSVWriter(ruta, ESQUEMA)
+
+    @staticmethod
+    def preparar(lote):
+        return pa.Table.from_arrays(
+            [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*lote), ESQUEMA)],
+            schema=ESQUEMA,
+        )
+
+    def escribir(self, tabla):
+        self._writer.write_table(tabla)
+
+    def cerrar(self):
+        self._writer.close()
+
+
+class _EscritorExcel:
+    """
+    Escribe un .xlsx en modo write_only de openpyxl, que va pasando las filas
+    a disco. Si se llena una hoja (el límite de Excel) se sigue en otra.
+    """
+
+    FILAS_POR_HOJA = 1_048_576
+
+    def __init__(self, ruta):
+        # Dependencia opcional: solo hace falta para exportar a Excel
+        from openpyxl import Workbook
+
+        self._ruta = ruta
+        self._libro = Workbook(write_only=True)
+        self._hoja = None
+        self._filas = 0
+        self._hojas = 0
+
+    def _nueva_hoja(self):
+        self._hojas += 1
+        self._hoja = self._libro.create_sheet("ventas" if self._hojas == 1 else f"ventas_{self._hojas}")
+        self._hoja.append(ESQUEMA.names)
+        self._filas = 1
+
+    @staticmethod
+    def preparar(lote):
+        # Excel no guarda zona horaria: la fecha va en UTC, como en los otros formatos
+        return [
+            (fila[0], fila[1].astimezone(timezone.utc).replace(tzinfo=None)) + fila[2:]
+            for fila in lote
+        ]
+
+    def escribir(self, filas):
+        for fila in filas:
+            if self._hoja is None or self._filas >= self.FILAS_POR_HOJA:
+                self._nueva_hoja()
+            self._hoja.append(fila)
+            self._filas += 1
+
+    def cerrar(self):
+        if self._hoja is None:
+            self._nueva_hoja()
+        self._libro.save(self._ruta)
+
+
+def nombre_exportacion(formato, desde, hasta, tienda=None):
+    """
+    Nombre legible del archivo: ventas_<desde>_<hasta>.<formato>, con la
+    tienda si hay varias. Es el que se ofrece al descargarlo.
+    """
+    clave = _clave_tienda(tienda)
+    prefijo = "ventas" if clave is None else f"ventas_tienda_{re.sub(r'[^A-Za-z0-9_-]', '_', clave)}"
+    return f"{prefijo}_{desde}_{hasta}.{formato}"
+
+
+def ruta_exportacion(formato, desde, hasta, tienda=None):
+    """
+    Ruta por defecto del archivo en EXPORTACION_DIR. Lleva una parte única
+    para que dos exportaciones del mismo rango a la vez no se pisen.
+    """
+    nombre = nombre_exportacion(formato, desde, hasta, tienda)
+    base, extension = nombre.rsplit(".", 1)
+    return EXPORTACION_DIR / f"{base}_{uuid.uuid4().hex[:12]}.{extension}"
+
+
+def exportar_ventas_por_tramos(formato="csv", desde=None, hasta=None, destino=None, progreso=None, tienda=None):
+    """
+    Exporta las ventas con su detalle entre `desde` y `hasta` (fechas,
+    inclusive; por defecto desde la primera venta hasta hoy) a un archivo
+    CSV, Parquet o Excel, escribiéndolo a medida que llegan los lotes.
+
+    `progreso`, si se pasa, se llama como progreso(tramos terminados,
+    tramos totales, filas escritas) desde el hilo que llamó a esta función.
+    El archivo se escribe en un .tmp propio de esta exportación y se renombra
+    al final, así nunca queda a medias con el nombre definitivo.
+
+    Retorna (True, {"ruta", "nombre", "filas", "tramos"}) o (False, mensaje
+    de error). "nombre" es el nombre legible para ofrecer la descarga.
+    """
+    if formato not in FORMATOS:
+        return False, f"Formato inválido: {formato}"
+    if isinstance(desde, datetime) or isinstance(hasta, datetime):
+        return False, "El rango se indica con fechas, sin hora"
+    try:
+        hasta = hasta or datetime.now(timezone.utc).date()
+        desde = desde or _primera_fecha(tienda) or hasta
+    except Exception as e:
+        return False, str(e)
+    if desde > hasta:
+        return False, "La fecha inicial es posterior a la final"
+
+    ruta = Path(destino) if destino else ruta_exportacion(formato, desde, hasta, tienda)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_name(f".{ruta.name}.{uuid.uuid4().hex}.tmp")
+    tramos = _tramos(desde, hasta)
+    colas = {}  # tramo lanzado -> cola con sus lotes
+    cancelada = threading.Event()
+    filas = 0
+
+    hilos = max(1, EXPORTACION_HILOS)
+    executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="exportacion")
+    try:
+        escritor = _EscritorExcel(temporal) if formato == "xlsx" else _EscritorArrow(temporal, formato)
+
+        def lanzar(i):
+            if i < len(tramos):
+                inicio, fin = tramos[i]
+                colas[i] = queue.Queue(maxsize=EXPORTACION_COLA)
+                executor.submit(_leer_tramo, inicio, fin, colas[i], cancelada, escritor.preparar, tienda)
+
+        # Nunca hay más de `hilos` tramos leídos y sin escribir: uno nuevo
+        # arranca recién cuando se termina de escribir otro
+        for i in range(hilos):
+            lanzar(i)
+        try:
+            for terminados in range(len(tramos)):
+                cola = colas.pop(terminados)
+                while True:
+                    lote = cola.get()
+                    if lote is _FIN:
+                        break
+                    if isinstance(lote, Exception):
+                        raise lote
+                    escritor.escribir(lote)
+                    filas += len(lote)
+                    if progreso:
+                        progreso(terminados, len(tramos), filas)
+                lanzar(terminados + hilos)
+                if progreso:
+                    progreso(terminados + 1, len(tramos), filas)
+        finally:
+            escritor.cerrar()
+        os.replace(temporal, ruta)
+        nombre = ruta.name if destino else nombre_exportacion(formato, desde, hasta, tienda)
+        return True, {"ruta": ruta, "nombre": nombre, "filas": filas, "tramos": len(tramos)}
+    except Exception as e:
+        print(f"Error exportando ventas: {e}")
+        temporal.unlink(missing_ok=True)
+        return False, str(e)
+    finally:
+        # Si se cortó antes de tiempo, los hilos que esperan en una cola llena
+        # dejan de esperar y los tramos que no arrancaron no se leen
+        cancelada.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
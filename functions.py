@@ -1,79 +1,1113 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import base64
+import hashlib
+import hmac
+import json
 import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
+import metricas
+
 # Load environment variables from .env file
 load_dotenv()
 
 # =====================================
-# CONEXIÓN Y EJECUCIÓN DE QUERIES
+# POOL DE CONEXIONES
 # =====================================
-def connect_to_supabase():
+class PoolConexiones:
     """
-    Conecta a la base de datos de Supabase.
+    Pool de conexiones compartido por todo el proceso.
+
+    Reutiliza las conexiones entre llamadas para no pagar el handshake
+    TCP+TLS+auth en cada query. Al devolver una conexión se hace rollback,
+    así no queda estado de transacción entre usos (compatible con el
+    Transaction Pooler de Supabase).
     """
+
+    def __init__(self, parametros, minimo=1, maximo=10, timeout_espera=30,
+                 timeout_idle=300, chequeo_idle=30):
+        self.parametros = parametros
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout_espera = timeout_espera
+        self.timeout_idle = timeout_idle
+        self.chequeo_idle = chequeo_idle
+        self._libres = []  # lista de (conexión, momento en que se devolvió)
+        self._en_uso = 0
+        self._cond = threading.Condition()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "esperas": 0,
+            "tiempo_espera_total": 0.0,
+            "timeouts": 0,
+            "reconexiones": 0,
+            "descartadas": 0,
+        }
+
+    def _abrir(self):
+        try:
+            with metricas.medir("conexion", "connect"):
+                return psycopg2.connect(**self.parametros)
+        except psycopg2.Error as e:
+            print(f"Error conectando a Supabase: {e}")
+            return None
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _desalojar_idle(self):
+        # Saca del pool las conexiones que pasaron demasiado tiempo sin
+        # usarse, respetando el mínimo configurado. Se llama con el lock
+        # tomado y devuelve las conexiones a cerrar: el close es I/O de red
+        # y se hace después de soltar el lock.
+        ahora = time.monotonic()
+        desalojadas = []
+        while len(self._libres) + self._en_uso > self.minimo and self._libres:
+            conn, devuelta = self._libres[0]
+            if ahora - devuelta < self.timeout_idle:
+                break
+            self._libres.pop(0)
+            desalojadas.append(conn)
+            self.stats["descartadas"] += 1
+        return desalojadas
+
+    def _esta_viva(self, conn, devuelta):
+        if conn.closed:
+            return False
+        if time.monotonic() - devuelta < self.chequeo_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obtener(self):
+        """
+        Saca una conexión del pool. Devuelve None si no se pudo conectar
+        o si se agotó el tiempo de espera.
+        """
+        conn = None
+        devuelta = None
+        desalojadas = []
+        agotado = False
+        inicio = time.monotonic()
+        with self._cond:
+            espero = False
+            while True:
+                desalojadas += self._desalojar_idle()
+                if self._libres:
+                    conn, devuelta = self._libres.pop()
+                    self.stats["hits"] += 1
+                    break
+                if self._en_uso + len(self._libres) < self.maximo:
+                    self.stats["misses"] += 1
+                    break
+                restante = self.timeout_espera - (time.monotonic() - inicio)
+                if restante <= 0:
+                    self.stats["timeouts"] += 1
+                    agotado = True
+                    break
+                espero = True
+                self._cond.wait(restante)
+            if not agotado:
+                self._en_uso += 1
+                metricas.observar("conexion", "espera_pool", time.monotonic() - inicio)
+                if espero:
+                    self.stats["esperas"] += 1
+                    self.stats["tiempo_espera_total"] += time.monotonic() - inicio
+
+        # Cierres y chequeo de salud fuera del lock para no bloquear a otros hilos
+        for vieja in desalojadas:
+            self._cerrar(vieja)
+        if agotado:
+            print("Error: no hay conexiones disponibles en el pool.")
+            return None
+        if conn is not None and not self._esta_viva(conn, devuelta):
+            self._cerrar(conn)
+            conn = None
+            with self._cond:
+                self.stats["reconexiones"] += 1
+        if conn is None:
+            conn = self._abrir()
+            if conn is None:
+                with self._cond:
+                    self._en_uso -= 1
+                    self._cond.notify()
+        return conn
+
+    def devolver(self, conn):
+        """
+        Devuelve una conexión al pool. Si quedó rota se descarta.
+        """
+        if not conn.closed:
+            try:
+                # No dejar transacciones abiertas entre usos
+                conn.rollback()
+            except psycopg2.Error:
+                self._cerrar(conn)
+        with self._cond:
+            self._en_uso -= 1
+            if conn.closed:
+                self.stats["descartadas"] += 1
+            else:
+                self._libres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def cerrar_todo(self):
+        with self._cond:
+            libres, self._libres = self._libres, []
+        for conn, _ in libres:
+            self._cerrar(conn)
+
+    def estado(self):
+        with self._cond:
+            estado = dict(self.stats)
+            estado["libres"] = len(self._libres)
+            estado["en_uso"] = self._en_uso
+            estado["minimo"] = self.minimo
+            estado["maximo"] = self.maximo
+            return estado
+
+
+# =====================================
+# SENTENCIAS PREPARADAS
+# =====================================
+# Las queries fijas de las funciones auxiliares se preparan una vez por
+# conexión del pool (PREPARE) y después solo se ejecutan (EXECUTE), así el
+# servidor no vuelve a parsear y planificar el mismo texto en cada llamada.
+# El Transaction Pooler de Supabase (puerto 6543) reparte las transacciones
+# entre distintas conexiones del servidor, así que ahí no se preparan y las
+# queries se mandan como texto.
+
+# Máximo de sentencias distintas a preparar; las que sobran se mandan como texto
+SENTENCIAS_MAX = int(os.getenv("SENTENCIAS_MAX", "200"))
+
+
+def usar_preparadas(puerto=None):
+    """
+    SUPABASE_PREPARED_STATEMENTS=1/0 las activa o desactiva; por defecto
+    ("auto") se usan salvo que la conexión sea al Transaction Pooler.
+    `puerto` es el de la base de una tienda; por defecto SUPABASE_DB_PORT.
+    """
+    valor = os.getenv("SUPABASE_PREPARED_STATEMENTS", "auto")
+    if valor == "auto":
+        return str(puerto or os.getenv("SUPABASE_DB_PORT")) != "6543"
+    return valor == "1"
+
+
+class ConexionPreparada(psycopg2.extensions.connection):
+    """
+    Conexión que recuerda qué sentencias ya preparó en el servidor. Una
+    conexión nueva (por ejemplo después de reconectar) empieza vacía y las
+    vuelve a preparar en el primer uso.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        # Si falla un PREPARE + EXECUTE no se sabe si el PREPARE quedó hecho
+        # (no se deshace con el rollback): se relee la lista del servidor.
+        self.preparadas_dudosas = False
+
+
+_sentencias = {}  # query -> (nombre en el servidor, texto con $1, $2...)
+_sentencias_stats = {}  # nombre en el servidor -> contadores
+_sentencias_lock = threading.Lock()
+
+
+def _sentencia(nombre, query):
+    """
+    Registra la query y devuelve (nombre en el servidor, texto con $1, $2...),
+    o None si ya se alcanzó SENTENCIAS_MAX.
+    """
+    with _sentencias_lock:
+        sentencia = _sentencias.get(query)
+        if sentencia is None:
+            if len(_sentencias) >= SENTENCIAS_MAX:
+                return None
+            partes = re.split(r"(%%|%s)", query)
+            numero = 0
+            for i, parte in enumerate(partes):
+                if parte == "%s":
+                    numero += 1
+                    partes[i] = f"${numero}"
+            digest = hashlib.sha1(query.encode()).hexdigest()[:8]
+            servidor = f"q_{re.sub(r'[^a-z0-9_]', '_', nombre.lower())}_{digest}"
+            sentencia = _sentencias[query] = (servidor, "".join(partes))
+            _sentencias_stats[servidor] = {"query": nombre, "preparaciones": 0, "ejecuciones": 0}
+        return sentencia
+
+
+def ejecutar_preparada(cursor, nombre, query, params=None):
+    """
+    Ejecuta `query` (con parámetros posicionales %s) como sentencia preparada
+    si la conexión lo permite; si no, la ejecuta como texto. La primera vez
+    en cada conexión el PREPARE y el EXECUTE viajan juntos, sin un round-trip extra.
+    """
+    conn = cursor.connection
+    preparadas = getattr(conn, "preparadas", None)
+    sentencia = _sentencia(nombre, query) if preparadas is not None else None
+    if sentencia is None:
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        return
+
+    servidor, texto = sentencia
+    if conn.preparadas_dudosas:
+        cursor.execute("SELECT name FROM pg_prepared_statements")
+        preparadas.clear()
+        preparadas.update(fila[0] for fila in cursor.fetchall())
+        conn.preparadas_dudosas = False
+
+    ejecutar = f"EXECUTE {servidor} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {servidor}"
+    with _sentencias_lock:
+        stats = _sentencias_stats[servidor]
+        stats["ejecuciones"] += 1
+        if servidor not in preparadas:
+            stats["preparaciones"] += 1
+    if servidor in preparadas:
+        try:
+            cursor.execute(ejecutar, params or None)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # El servidor la olvidó (por ejemplo con un DISCARD ALL)
+            conn.preparadas_dudosas = True
+            raise
+        return
+
+    sql = f"PREPARE {servidor} AS {texto}; {ejecutar}"
+    primera = conn.autocommit or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
     try:
-        host = os.getenv("SUPABASE_DB_HOST")
-        port = os.getenv("SUPABASE_DB_PORT")
-        dbname = os.getenv("SUPABASE_DB_NAME")
-        user = os.getenv("SUPABASE_DB_USER")
-        password = os.getenv("SUPABASE_DB_PASSWORD")
-
-        if not all([host, port, dbname, user, password]):
-            print("Error: faltan variables de entorno para la conexión.")
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql.replace("%%", "%"))
+    except psycopg2.errors.DuplicatePreparedStatement:
+        # El servidor ya la tenía (por ejemplo una conexión del servidor
+        # reutilizada): queda marcada y se ejecuta. Si la transacción ya
+        # traía trabajo, quedó abortada y la repite quien llamó.
+        preparadas.add(servidor)
+        if not primera:
+            raise
+        if not conn.autocommit:
+            conn.rollback()
+        cursor.execute(ejecutar, params or None)
+        return
+    except psycopg2.Error:
+        conn.preparadas_dudosas = True
+        raise
+    preparadas.add(servidor)
+
+
+def get_prepared_stats():
+    """
+    Devuelve por sentencia cuántas veces se preparó (una por conexión) y
+    cuántas se ejecutó; la diferencia son los planes reutilizados.
+    """
+    with _sentencias_lock:
+        return {
+            "activas": usar_preparadas(),
+            "sentencias": [
+                dict(stats, nombre=servidor, reutilizaciones=stats["ejecuciones"] - stats["preparaciones"])
+                for servidor, stats in sorted(_sentencias_stats.items())
+            ],
+        }
+
+
+# =====================================
+# TIENDAS
+# =====================================
+# Cada tienda (sucursal) puede tener su propia base de datos. TIENDAS_CONFIG
+# apunta a un JSON con los parámetros de conexión de cada una, por ejemplo:
+#     {"1": {"nombre": "Centro", "dbname": "kiosco_centro"},
+#      "2": {"nombre": "Norte", "host": "db.norte.supabase.co", "password": "..."}}
+# Lo que no se indica se toma de las variables SUPABASE_DB_* del .env. Sin el
+# archivo hay una sola tienda: la base del .env.
+#
+# Las funciones que van a la base aceptan `tienda`. Si no se pasa se usa
+# TIENDA_ID (la tienda de este proceso) o, si no está, la primera del archivo.
+# Cada tienda tiene su propio pool de conexiones.
+
+TIENDAS_CONFIG = os.getenv("TIENDAS_CONFIG", "tiendas.json")
+TIENDA_ID = os.getenv("TIENDA_ID")
+# Máximo de tiendas consultadas a la vez por ejecutar_en_tiendas
+TIENDAS_HILOS = int(os.getenv("TIENDAS_HILOS", "8"))
+
+_tiendas = None
+_tiendas_lock = threading.Lock()
+
+
+def get_tiendas():
+    """
+    Devuelve {id de tienda: configuración} leído de TIENDAS_CONFIG, o {} si
+    no hay archivo (una sola base). Los ids son texto, como en el JSON.
+    """
+    global _tiendas
+    if _tiendas is None:
+        with _tiendas_lock:
+            if _tiendas is None:
+                try:
+                    with open(TIENDAS_CONFIG, encoding="utf-8") as archivo:
+                        _tiendas = {str(tienda): config for tienda, config in json.load(archivo).items()}
+                except FileNotFoundError:
+                    _tiendas = {}
+    return _tiendas
+
+
+def _clave_tienda(tienda=None):
+    """
+    Id de la tienda a la que va una llamada, o None si hay una sola base.
+    """
+    tiendas = get_tiendas()
+    if tienda is None:
+        if not tiendas:
             return None
+        tienda = TIENDA_ID or next(iter(tiendas))
+    if str(tienda) not in tiendas:
+        raise ValueError(f"Tienda desconocida: {tienda}")
+    return str(tienda)
+
+
+def _parametros_conexion(sesion=False, tienda=None):
+    """
+    Arma los parámetros de conexión de una tienda, completando con el .env
+    lo que no esté en TIENDAS_CONFIG. Con sesion=True usa
+    SUPABASE_DB_SESSION_HOST/PORT (o session_host/session_port de la tienda)
+    si están definidos: el Session Pooler o la conexión directa de Supabase,
+    necesarios para LISTEN.
+    """
+    config = get_tiendas().get(_clave_tienda(tienda), {})
+    host = config.get("host", os.getenv("SUPABASE_DB_HOST"))
+    port = config.get("port", os.getenv("SUPABASE_DB_PORT"))
+    if sesion:
+        # Una tienda con host propio no usa el Session Pooler de la base del .env
+        if "host" in config:
+            host, port = config.get("session_host", host), config.get("session_port", port)
+        else:
+            host = os.getenv("SUPABASE_DB_SESSION_HOST", host)
+            port = os.getenv("SUPABASE_DB_SESSION_PORT", port)
+    dbname = config.get("dbname", os.getenv("SUPABASE_DB_NAME"))
+    user = config.get("user", os.getenv("SUPABASE_DB_USER"))
+    password = config.get("password", os.getenv("SUPABASE_DB_PASSWORD"))
+
+    if not all([host, port, dbname, user, password]):
+        print("Error: faltan variables de entorno para la conexión.")
+        return None
+    return dict(host=host, port=port, dbname=dbname, user=user, password=password)
+
+
+_pools = {}  # tienda (None con una sola base) -> PoolConexiones
+_pool_lock = threading.Lock()
+
+
+def _get_pool(tienda=None):
+    """
+    Crea el pool de la tienda la primera vez que se necesita.
+    """
+    clave = _clave_tienda(tienda)
+    pool = _pools.get(clave)
+    if pool is not None:
+        return pool
+    with _pool_lock:
+        if clave not in _pools:
+            parametros = _parametros_conexion(tienda=clave)
+            if parametros is None:
+                return None
+            if usar_preparadas(parametros["port"]):
+                parametros["connection_factory"] = ConexionPreparada
+
+            _pools[clave] = PoolConexiones(
+                parametros,
+                minimo=int(os.getenv("SUPABASE_POOL_MIN", "1")),
+                maximo=int(os.getenv("SUPABASE_POOL_MAX", "10")),
+                timeout_espera=float(os.getenv("SUPABASE_POOL_TIMEOUT", "30")),
+                timeout_idle=float(os.getenv("SUPABASE_POOL_IDLE_TIMEOUT", "300")),
+            )
+    return _pools[clave]
+
+
+def get_pool_stats(tienda=None):
+    """
+    Devuelve los contadores del pool (hits, misses, esperas, etc.)
+    para poder dimensionarlo bajo carga.
+    """
+    pool = _get_pool(tienda)
+    return pool.estado() if pool else {}
+
+
+def cerrar_pools():
+    """
+    Cierra las conexiones libres de los pools de todas las tiendas.
+    """
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.cerrar_todo()
 
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            dbname=dbname,
-            user=user,
-            password=password,
+
+def ejecutar_en_tiendas(funcion, *args, tiendas=None, **kwargs):
+    """
+    Corre `funcion(*args, tienda=..., **kwargs)` en varias tiendas a la vez
+    (todas por defecto), cada una con su pool, y junta los resultados.
+
+    Si la función devuelve DataFrames se concatenan en el orden de las
+    tiendas, con una columna "tienda" al principio; si no, se devuelve
+    {tienda: resultado}. Una tienda que falla no frena a las demás.
+    Retorna (resultado, {tienda: mensaje de error}).
+    """
+    if tiendas is None:
+        tiendas = list(get_tiendas()) or [None]
+    tiendas = [None if tienda is None else str(tienda) for tienda in tiendas]
+    resultados = {}
+    errores = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(TIENDAS_HILOS, len(tiendas))), thread_name_prefix="tiendas") as executor:
+        futuros = {executor.submit(funcion, *args, tienda=tienda, **kwargs): tienda for tienda in tiendas}
+        for futuro in as_completed(futuros):
+            tienda = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                print(f"Error en la tienda {tienda}: {e}")
+                errores[tienda] = str(e)
+                continue
+            # Un DataFrame sin columnas es una query que falló (ver execute_query)
+            if isinstance(resultado, pd.DataFrame) and len(resultado.columns) == 0:
+                errores[tienda] = "Error ejecutando la query"
+                continue
+            resultados[tienda] = resultado
+
+    metricas.contar("ejecutar_en_tiendas", "tiendas", len(tiendas))
+    metricas.contar("ejecutar_en_tiendas", "errores", len(errores))
+    ordenados = [(tienda, resultados[tienda]) for tienda in tiendas if tienda in resultados]
+    if ordenados and all(isinstance(resultado, pd.DataFrame) for _, resultado in ordenados):
+        combinado = pd.concat(
+            [resultado.assign(tienda=tienda) for tienda, resultado in ordenados],
+            ignore_index=True,
         )
-        return conn
+        return combinado[["tienda"] + [c for c in combinado.columns if c != "tienda"]], errores
+    return dict(ordenados), errores
+
+
+# =====================================
+# CONEXIÓN Y EJECUCIÓN DE QUERIES
+# =====================================
+def connect_to_supabase(tienda=None):
+    """
+    Obtiene una conexión a la base de datos de Supabase desde el pool de la
+    tienda. Hay que devolverla con release_connection() (con la misma
+    tienda) al terminar de usarla.
+    """
+    pool = _get_pool(tienda)
+    if pool is None:
+        return None
+    return pool.obtener()
+
+
+def connect_session(tienda=None):
+    """
+    Abre una conexión fuera del pool, en modo sesión, para lo que necesita
+    mantener estado en el servidor (por ejemplo LISTEN). Hay que cerrarla
+    con conn.close().
+    """
+    parametros = _parametros_conexion(sesion=True, tienda=tienda)
+    if parametros is None:
+        return None
+    try:
+        return psycopg2.connect(**parametros)
     except psycopg2.Error as e:
         print(f"Error conectando a Supabase: {e}")
         return None
 
 
-def execute_query(query, conn=None, is_select=True, params=None, commit=True):
+def release_connection(conn, tienda=None):
+    """
+    Devuelve al pool una conexión obtenida con connect_to_supabase().
+    """
+    if conn is None:
+        return
+    pool = _get_pool(tienda)
+    if pool is None:
+        conn.close()
+    else:
+        pool.devolver(conn)
+
+
+def execute_query(query, conn=None, is_select=True, params=None, commit=True, nombre=None, as_tuples=False, preparar=False, tienda=None):
     """
     Ejecuta una query SQL. Devuelve un DataFrame si es SELECT,
     o True/False si es DML (INSERT, UPDATE, DELETE).
+    Las columnas del DataFrame usan tipos nativos (float64, int64,
+    datetime64) en lugar de objetos Decimal. Con as_tuples=True un SELECT
+    devuelve directamente la lista de tuplas, sin armar el DataFrame.
+    Si no se pasa conn, usa una conexión del pool de la `tienda`.
+    `nombre` identifica la query en las métricas (metricas.py).
+    Con preparar=True se ejecuta como sentencia preparada (ejecutar_preparada);
+    conviene solo para queries de texto fijo.
     """
-    try:
-        close_conn = False
-        if conn is None:
-            conn = connect_to_supabase()
-            close_conn = True
+    nombre = nombre or "sin_nombre"
+    inicio = time.perf_counter()
+    close_conn = conn is None
+    # Los SELECT se reintentan una vez si la conexión del pool se cayó, y
+    # cualquier query preparada si el servidor había olvidado la sentencia
+    intentos = 2 if close_conn and (is_select or preparar) else 1
+    for intento in range(intentos):
+        if close_conn:
+            conn = connect_to_supabase(tienda)
+        try:
+            cursor = conn.cursor()
+            with metricas.medir(nombre, "execute"):
+                if preparar:
+                    ejecutar_preparada(cursor, nombre, query, params)
+                elif params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
 
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(query, params)
+            if is_select:
+                with metricas.medir(nombre, "fetch"):
+                    results = cursor.fetchall()
+                metricas.contar(nombre, "filas", len(results))
+                if as_tuples:
+                    result = results
+                else:
+                    with metricas.medir(nombre, "dataframe"):
+                        result = _armar_dataframe(results, cursor.description)
+            else:
+                if commit:
+                    with metricas.medir(nombre, "commit"):
+                        conn.commit()
+                result = True
+
+            cursor.close()
+            duracion = time.perf_counter() - inicio
+            metricas.observar(nombre, "total", duracion)
+            metricas.registrar_lenta(nombre, duracion, query)
+            return result
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement) as e:
+            conn.rollback()
+            if intento + 1 < intentos:
+                continue
+            print(f"Error ejecutando query: {e}")
+            metricas.contar(nombre, "errores")
+            return pd.DataFrame() if is_select else False
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if intento + 1 < intentos and is_select and conn is not None and conn.closed:
+                print(f"Conexión caída, reintentando: {e}")
+                continue
+            print(f"Error ejecutando query: {e}")
+            metricas.contar(nombre, "errores")
+            return pd.DataFrame() if is_select else False
+        except Exception as e:
+            print(f"Error ejecutando query: {e}")
+            metricas.contar(nombre, "errores")
+            if conn and not is_select:
+                conn.rollback()
+            return pd.DataFrame() if is_select else False
+        finally:
+            if close_conn:
+                release_connection(conn, tienda)
+
+
+# Tipo de columna de pandas según el OID del tipo de Postgres
+_TIPOS_OID = {
+    16: "bool",
+    20: "int", 21: "int", 23: "int", 26: "int",
+    700: "float", 701: "float", 1700: "float",
+    1082: "fecha", 1114: "fecha",
+    1184: "fecha_tz",
+    19: "texto", 25: "texto", 1042: "texto", 1043: "texto",
+}
+
+# Las columnas de texto con muchas filas y pocos valores distintos se guardan como category
+CATEGORIA_MIN_FILAS = 1000
+CATEGORIA_MAX_PROPORCION = 0.5
+
+
+def _columna_tipada(valores, oid):
+    """
+    Convierte los valores de una columna al tipo nativo de pandas/numpy
+    que corresponde al tipo de Postgres (Decimal -> float64, etc.).
+    """
+    tipo = _TIPOS_OID.get(oid)
+    hay_nulos = None in valores
+    if tipo == "int":
+        if hay_nulos:
+            return pd.array(valores, dtype="Int64")
+        return np.fromiter(valores, dtype=np.int64, count=len(valores))
+    if tipo == "float":
+        if hay_nulos:
+            valores = [np.nan if v is None else v for v in valores]
+        return np.array(valores, dtype=np.float64)
+    if tipo == "bool":
+        return pd.array(valores, dtype="boolean") if hay_nulos else np.array(valores, dtype=bool)
+    if tipo == "fecha":
+        return pd.to_datetime(valores)
+    if tipo == "fecha_tz":
+        return pd.to_datetime(valores, utc=True)
+    if tipo == "texto" and len(valores) >= CATEGORIA_MIN_FILAS:
+        if len(set(valores)) <= len(valores) * CATEGORIA_MAX_PROPORCION:
+            return pd.Categorical(valores)
+    return pd.Series(valores, dtype=object)
+
+
+def _armar_dataframe(rows, description, dtypes=None):
+    """
+    Arma un DataFrame a partir de filas, columna por columna y con tipos
+    nativos según el tipo de Postgres de cada una. `dtypes` ({columna: dtype})
+    permite forzar el tipo de alguna columna.
+    """
+    dtypes = dtypes or {}
+    columnas = list(zip(*rows)) if rows else [() for _ in description]
+    datos = {}
+    for desc, valores in zip(description, columnas):
+        nombre = desc[0]
+        valores = list(valores)
+        if nombre in dtypes:
+            datos[nombre] = pd.Series(valores, dtype=dtypes[nombre])
         else:
-            cursor.execute(query)
+            datos[nombre] = _columna_tipada(valores, desc[1])
+    return pd.DataFrame(datos)
+
+
+def _ajustar_columna_copy(columna, tipo):
+    """
+    Deja una columna leída del CSV de COPY con el mismo tipo que le daría
+    _columna_tipada: enteros y booleanos sin nulos como numpy, NULL de
+    texto como None y texto repetitivo como category.
+    """
+    if tipo in ("int", "bool"):
+        if columna.hasnans:
+            return columna
+        return columna.to_numpy(dtype=np.int64 if tipo == "int" else bool)
+    if tipo in ("float", "fecha", "fecha_tz"):
+        return columna
+    columna = columna.astype(object).where(columna.notna(), None)
+    if tipo == "texto" and len(columna) >= CATEGORIA_MIN_FILAS:
+        if columna.nunique(dropna=False) <= len(columna) * CATEGORIA_MAX_PROPORCION:
+            return pd.Categorical(columna)
+    return columna
 
-        if is_select:
-            results = cursor.fetchall()
-            colnames = [desc[0] for desc in cursor.description]
-            df = pd.DataFrame(results, columns=colnames)
-            result = df
+
+def copy_query(query, params=None, dtypes=None, tienda=None):
+    """
+    Ejecuta un SELECT grande usando COPY ... TO STDOUT en formato CSV, que es
+    bastante más rápido que traer las filas como tuplas de Python.
+    Devuelve un DataFrame con los mismos tipos que execute_query.
+    """
+    conn = connect_to_supabase(tienda)
+    if conn is None:
+        return pd.DataFrame()
+    try:
+        cursor = conn.cursor()
+        sql = cursor.mogrify(query, params).decode() if params else query
+
+        # Se piden 0 filas solo para conocer nombres y tipos de las columnas
+        cursor.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0")
+        description = cursor.description
+
+        tipos = {}
+        fechas = []
+        for desc in description:
+            tipo = _TIPOS_OID.get(desc[1])
+            if desc[0] in (dtypes or {}):
+                tipos[desc[0]] = dtypes[desc[0]]
+            elif tipo == "int":
+                tipos[desc[0]] = "Int64"
+            elif tipo == "float":
+                tipos[desc[0]] = "float64"
+            elif tipo == "bool":
+                tipos[desc[0]] = "boolean"
+            elif tipo in ("fecha", "fecha_tz"):
+                fechas.append((desc[0], tipo == "fecha_tz"))
+            else:
+                tipos[desc[0]] = object
+
+        # Con FORCE_QUOTE y NULL '\N' un texto vacío llega como "" y un NULL
+        # como \N, así no se confunden. Los booleanos llegan como t/f.
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024, mode="w+b") as buffer:
+            cursor.copy_expert(
+                f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '\\N', FORCE_QUOTE *)",
+                buffer,
+            )
+            buffer.seek(0)
+            df = pd.read_csv(
+                buffer,
+                dtype=tipos,
+                keep_default_na=False,
+                na_values=["\\N"],
+                true_values=["t"],
+                false_values=["f"],
+            )
+        for columna, con_zona in fechas:
+            df[columna] = pd.to_datetime(df[columna], utc=con_zona)
+        for desc in description:
+            if desc[0] not in (dtypes or {}):
+                df[desc[0]] = _ajustar_columna_copy(df[desc[0]], _TIPOS_OID.get(desc[1]))
+        cursor.close()
+        return df
+    except Exception as e:
+        print(f"Error ejecutando COPY: {e}")
+        return pd.DataFrame()
+    finally:
+        release_connection(conn, tienda)
+
+
+def stream_query(query, params=None, itersize=2000, chunksize=None, as_dataframe=True, dtypes=None, tienda=None):
+    """
+    Ejecuta un SELECT con un cursor del lado del servidor y devuelve los
+    resultados de a poco, así los reportes grandes usan memoria constante.
+
+    Trae `itersize` filas por viaje a la base. Con as_dataframe=True devuelve
+    DataFrames de hasta `chunksize` filas, con columnas ya tipadas; si no,
+    devuelve las filas (tuplas) una por una. `dtypes` ({columna: dtype})
+    permite forzar el tipo de alguna columna.
+
+    La conexión queda tomada mientras se recorre el generador: hay que
+    consumirlo entero o cerrarlo.
+    """
+    conn = connect_to_supabase(tienda)
+    if conn is None:
+        return
+    try:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+
+        if not as_dataframe:
+            for row in cursor:
+                yield row
         else:
-            if commit:
-                conn.commit()
-            result = True
+            chunksize = chunksize or itersize
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield _armar_dataframe(rows, cursor.description, dtypes)
 
         cursor.close()
-        if close_conn:
-            conn.close()
+    except psycopg2.Error as e:
+        print(f"Error ejecutando query en streaming: {e}")
+    finally:
+        release_connection(conn, tienda)
 
-        return result
-    except Exception as e:
-        print(f"Error ejecutando query: {e}")
-        if conn and not is_select:
-            conn.rollback()
-        return pd.DataFrame() if is_select else False
+
+# =====================================
+# CACHE DE CATÁLOGOS
+# =====================================
+class CacheConsultas:
+    """
+    Cache en memoria para las consultas de catálogo (productos, proveedores,
+    usuarios), compartido por todas las sesiones del proceso.
+
+    Cada entrada vence a los `ttl` segundos y se guardan como máximo
+    `max_entradas` (se descartan las menos usadas). Las funciones que
+    escriben invalidan las tablas que modifican.
+    """
+
+    def __init__(self, ttl=30, max_entradas=128):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()  # clave -> (vence, tablas, DataFrame)
+        self._cargando = {}  # clave -> lock para que una sola sesión haga la query
+        self._generaciones = {}  # tabla -> número de invalidaciones
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidaciones": 0}
+
+    def _buscar(self, clave):
+        entrada = self._datos.get(clave)
+        if entrada is not None and entrada[0] > time.monotonic():
+            self._datos.move_to_end(clave)
+            self.stats["hits"] += 1
+            return entrada[2]
+        return None
+
+    def obtener(self, tablas, clave, cargar):
+        """
+        Devuelve el resultado cacheado para `clave` o lo carga con `cargar()`.
+        """
+        with self._lock:
+            df = self._buscar(clave)
+            if df is not None:
+                return df.copy()
+            lock_clave = self._cargando.setdefault(clave, threading.Lock())
+
+        with lock_clave:
+            with self._lock:
+                # Otra sesión pudo haberlo cargado mientras esperábamos
+                df = self._buscar(clave)
+                if df is not None:
+                    return df.copy()
+                self.stats["misses"] += 1
+                generaciones = tuple(self._generaciones.get(t, 0) for t in tablas)
+
+            df = cargar()
+
+            with self._lock:
+                self._cargando.pop(clave, None)
+                # Un DataFrame sin columnas es un error de la query: no se guarda.
+                # Tampoco si hubo una escritura mientras se cargaba.
+                vigente = generaciones == tuple(self._generaciones.get(t, 0) for t in tablas)
+                if len(df.columns) > 0 and vigente:
+                    self._datos[clave] = (time.monotonic() + self.ttl, tablas, df)
+                    self._datos.move_to_end(clave)
+                    while len(self._datos) > self.max_entradas:
+                        self._datos.popitem(last=False)
+        return df.copy()
+
+    def invalidar(self, *tablas):
+        """
+        Descarta todas las entradas que dependen de alguna de las tablas.
+        Devuelve la generación nueva de cada tabla, en el mismo orden.
+        """
+        with self._lock:
+            for tabla in tablas:
+                self._generaciones[tabla] = self._generaciones.get(tabla, 0) + 1
+            for clave in [c for c, e in self._datos.items() if set(e[1]) & set(tablas)]:
+                del self._datos[clave]
+            self.stats["invalidaciones"] += 1
+            return tuple(self._generaciones[tabla] for tabla in tablas)
+
+    def generacion(self, tabla):
+        with self._lock:
+            return self._generaciones.get(tabla, 0)
+
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+_cache = CacheConsultas(
+    ttl=CACHE_TTL,
+    max_entradas=int(os.getenv("CACHE_MAX_ENTRADAS", "128")),
+)
+
+
+def cached_query(query, tablas, params=None, nombre=None, preparar=False, tienda=None):
+    """
+    Igual que execute_query para un SELECT, pero el resultado se comparte
+    entre sesiones hasta que vence o se escribe alguna de las `tablas`.
+    Cada tienda tiene sus propias entradas.
+    """
+    clave = _clave_tienda(tienda)
+    return _cache.obtener(
+        tuple((clave, tabla) for tabla in tablas),
+        (clave, query, params),
+        lambda: execute_query(query, params=params, is_select=True, nombre=nombre, preparar=preparar, tienda=clave),
+    )
+
+
+def invalidate_cache(*tablas, tienda=None):
+    """
+    Invalida el cache de las tablas indicadas de una tienda.
+    """
+    clave = _clave_tienda(tienda)
+    _cache.invalidar(*((clave, tabla) for tabla in tablas))
+
+
+def get_cache_stats():
+    """
+    Devuelve los contadores del cache (hits, misses, invalidaciones).
+    """
+    return dict(_cache.stats)
+
+
+def get_cache_generation(tabla, tienda=None):
+    """
+    Devuelve cuántas veces se invalidó la tabla; sirve para saber si un
+    objeto armado a partir de ella quedó desactualizado.
+    """
+    return _cache.generacion((_clave_tienda(tienda), tabla))
+
+
+# Funciones a las que el checkout avisa el stock que quedó después de cada
+# venta, para actualizar lo que tengan armado sin releer productos.
+_avisos_stock = []
+
+
+def registrar_aviso_stock(funcion):
+    """
+    Registra funcion(tienda, generacion, stock) para que se llame después de
+    cada venta confirmada. `stock` es {producto_id: cantidad nueva} y
+    `generacion` la de productos tras invalidarla por esa venta.
+    """
+    _avisos_stock.append(funcion)
+
+
+def _avisar_stock(tienda, stock):
+    """
+    Invalida el cache de productos de la tienda y pasa el stock nuevo a los
+    avisos registrados. Un aviso que falla no afecta a la venta.
+    """
+    clave = _clave_tienda(tienda)
+    (generacion,) = _cache.invalidar((clave, "productos"))
+    for aviso in _avisos_stock:
+        try:
+            aviso(clave, generacion, stock)
+        except Exception as e:
+            print(f"Error avisando el stock nuevo: {e}")
+
+
+# =====================================
+# VENTAS RECIENTES
+# =====================================
+class VentasRecientes:
+    """
+    Buffer circular con las últimas ventas, compartido por todas las sesiones.
+
+    Se llena con una query la primera vez que se lee; después el checkout le
+    agrega cada venta al confirmarla y un hilo lo revalida cada tanto contra
+    la base (para ver las ventas de otros procesos). Las lecturas nunca
+    esperan a la base: mientras se revalida se sirve lo que hay.
+    """
+
+    COLUMNAS = ["id", "fecha", "empleado", "total", "descuento"]
+
+    def __init__(self, capacidad=50, tienda=None):
+        self.capacidad = capacidad
+        self.tienda = tienda
+        self._ventas = {}  # venta_id -> (id, fecha, empleado, total, descuento)
+        self._cargado = False
+        self._lock = threading.Lock()
+        self.stats = {"lecturas": 0, "agregadas": 0, "revalidaciones": 0, "errores": 0, "ultima_revalidacion": None}
+
+    def _recortar(self):
+        # Se quedan las `capacidad` más nuevas por (fecha, id), igual que get_ventas
+        if len(self._ventas) > self.capacidad:
+            ordenadas = sorted(self._ventas.values(), key=lambda v: (v[1], v[0]), reverse=True)
+            self._ventas = {v[0]: v for v in ordenadas[:self.capacidad]}
+
+    def agregar(self, venta_id, fecha, empleado, total, descuento):
+        """
+        Agrega una venta recién confirmada. Si el buffer todavía no se llenó
+        desde la base no se agrega: la primera lectura la va a traer igual.
+        """
+        # El checkout trae la fecha con el huso de su sesión y la base la
+        # devuelve en UTC: todo en UTC para poder ordenar y comparar
+        fecha = pd.to_datetime(fecha, utc=True)
+        with self._lock:
+            if not self._cargado:
+                return
+            self._ventas[venta_id] = (venta_id, fecha, empleado, float(total), float(descuento))
+            self._recortar()
+            self.stats["agregadas"] += 1
+
+    def revalidar(self):
+        """
+        Vuelve a consultar las últimas ventas y las combina con las que ya
+        están en memoria. Se combina en lugar de reemplazar porque una venta
+        confirmada mientras corría la query no viene en el resultado.
+        Retorna True si la query anduvo.
+        """
+        df = get_ventas(limit=self.capacidad, tienda=self.tienda)
+        if len(df.columns) == 0:
+            with self._lock:
+                self.stats["errores"] += 1
+            return False
+        df["fecha"] = pd.to_datetime(df["fecha"], utc=True)
+        filas = [
+            (int(v.id), v.fecha, v.empleado, float(v.total), float(v.descuento))
+            for v in df.itertuples(index=False)
+        ]
+        with self._lock:
+            for fila in filas:
+                self._ventas[fila[0]] = fila
+            self._recortar()
+            self._cargado = True
+            self.stats["revalidaciones"] += 1
+            self.stats["ultima_revalidacion"] = time.time()
+        return True
+
+    def leer(self, limite):
+        """
+        Devuelve las últimas `limite` ventas como DataFrame, de la más nueva
+        a la más vieja. Si el buffer nunca se llenó, lo llena ahora.
+        """
+        if not self._cargado:
+            self.revalidar()
+        with self._lock:
+            self.stats["lecturas"] += 1
+            ordenadas = sorted(self._ventas.values(), key=lambda v: (v[1], v[0]), reverse=True)
+        return pd.DataFrame(ordenadas[:limite], columns=self.COLUMNAS)
+
+
+VENTAS_RECIENTES_MAX = int(os.getenv("VENTAS_RECIENTES_MAX", "50"))
+# Cada cuántos segundos se revalida el buffer contra la base
+VENTAS_RECIENTES_REVALIDAR = float(os.getenv("VENTAS_RECIENTES_REVALIDAR", "30"))
+
+_ventas_recientes = {}  # tienda -> VentasRecientes
+_revalidador = None
+_revalidador_lock = threading.Lock()
+
+
+def _buffer_ventas_recientes(tienda=None):
+    clave = _clave_tienda(tienda)
+    buffer = _ventas_recientes.get(clave)
+    if buffer is None:
+        with _revalidador_lock:
+            buffer = _ventas_recientes.setdefault(clave, VentasRecientes(VENTAS_RECIENTES_MAX, clave))
+    return buffer
+
+
+def _loop_revalidacion():
+    while True:
+        time.sleep(VENTAS_RECIENTES_REVALIDAR)
+        # Solo los buffers que alguien leyó alguna vez
+        for buffer in list(_ventas_recientes.values()):
+            try:
+                buffer.revalidar()
+            except Exception as e:
+                print(f"Error revalidando ventas recientes: {e}")
+
+
+def _iniciar_revalidacion():
+    """
+    Arranca el hilo que revalida las ventas recientes (uno solo por proceso).
+    """
+    global _revalidador
+    with _revalidador_lock:
+        if _revalidador is None or not _revalidador.is_alive():
+            _revalidador = threading.Thread(target=_loop_revalidacion, name="ventas-recientes", daemon=True)
+            _revalidador.start()
+
+
+def get_ventas_recientes(limite=5, tienda=None):
+    """
+    Últimas ventas desde memoria, con las mismas columnas que get_ventas.
+    Solo la primera llamada del proceso (por tienda) consulta la base.
+    """
+    buffer = _buffer_ventas_recientes(tienda)
+    _iniciar_revalidacion()
+    return buffer.leer(min(int(limite), VENTAS_RECIENTES_MAX))
+
+
+def get_ventas_recientes_stats(tienda=None):
+    """
+    Devuelve los contadores del buffer de ventas recientes de una tienda.
+    """
+    buffer = _buffer_ventas_recientes(tienda)
+    with buffer._lock:
+        stats = dict(buffer.stats)
+        stats["ventas"] = len(buffer._ventas)
+    return stats
 
 
 # =====================================
@@ -81,60 +1115,176 @@ def execute_query(query, conn=None, is_select=True, params=None, commit=True):
 # =====================================
 
 # ---- Usuarios ----
-def add_usuario(usuario, contraseña, tipo_usuario):
+# Las contraseñas se guardan como "pbkdf2_sha256$iteraciones$salt$hash".
+# Si se cambia PASSWORD_ITERACIONES, cada usuario se re-hashea en su próximo login.
+PASSWORD_ITERACIONES = int(os.getenv("PASSWORD_ITERACIONES", "600000"))
+_PASSWORD_ALGORITMO = "pbkdf2_sha256"
+
+# Verificaciones exitosas recientes, para no repetir el PBKDF2 en cada login.
+# La clave es un HMAC con un secreto que solo vive en memoria del proceso.
+_VERIFICACIONES_MAX = 256
+_verificaciones = OrderedDict()
+_verificaciones_lock = threading.Lock()
+_verificaciones_secreto = os.urandom(32)
+
+# Hash fijo contra el que se verifica cuando el usuario no existe: el login
+# tarda lo mismo y no deja adivinar qué usuarios hay. Ninguna contraseña da
+# una clave de ceros, así que nunca coincide.
+_HASH_FICTICIO = "$".join([
+    _PASSWORD_ALGORITMO,
+    str(PASSWORD_ITERACIONES),
+    base64.b64encode(bytes(16)).decode(),
+    base64.b64encode(bytes(32)).decode(),
+])
+
+
+def hash_password(contraseña, iteraciones=None):
+    """
+    Devuelve el hash con sal de una contraseña, listo para guardar en la base.
+    """
+    iteraciones = iteraciones or PASSWORD_ITERACIONES
+    salt = os.urandom(16)
+    clave = hashlib.pbkdf2_hmac("sha256", contraseña.encode(), salt, iteraciones)
+    return "$".join([
+        _PASSWORD_ALGORITMO,
+        str(iteraciones),
+        base64.b64encode(salt).decode(),
+        base64.b64encode(clave).decode(),
+    ])
+
+
+def verificar_password(contraseña, guardado):
+    """
+    Verifica una contraseña contra el valor guardado.
+    Retorna (es_correcta, hay_que_rehashear).
+    """
+    partes = guardado.split("$")
+    if len(partes) != 4 or partes[0] != _PASSWORD_ALGORITMO:
+        # Contraseña vieja guardada en texto plano: se acepta una vez y se re-hashea
+        ok = hmac.compare_digest(contraseña.encode(), guardado.encode())
+        return ok, ok
+
+    iteraciones = int(partes[1])
+    salt = base64.b64decode(partes[2])
+    esperado = base64.b64decode(partes[3])
+    clave = hashlib.pbkdf2_hmac("sha256", contraseña.encode(), salt, iteraciones)
+    ok = hmac.compare_digest(clave, esperado)
+    return ok, ok and iteraciones != PASSWORD_ITERACIONES
+
+
+def _clave_verificacion(usuario, guardado, contraseña):
+    mensaje = "\0".join([usuario, guardado, contraseña]).encode()
+    return hmac.new(_verificaciones_secreto, mensaje, hashlib.sha256).digest()
+
+
+def add_usuario(usuario, contraseña, tipo_usuario, tienda=None):
     query = """
         INSERT INTO usuarios (usuario, contraseña, tipo_usuario)
         VALUES (%s, %s, %s)
     """
-    return execute_query(query, params=(usuario, contraseña, tipo_usuario), is_select=False)
+    ok = execute_query(query, params=(usuario, hash_password(contraseña), tipo_usuario), is_select=False, nombre="add_usuario", preparar=True, tienda=tienda)
+    if ok:
+        invalidate_cache("usuarios", tienda=tienda)
+    return ok
 
 
-def get_usuario_by_credentials(usuario, contraseña):
-    query = """
-        SELECT id, usuario, tipo_usuario
-        FROM usuarios
-        WHERE usuario = %s AND contraseña = %s
+# Las queries que migraciones.verificar_indices revisa con EXPLAIN están como
+# constantes, así la verificación corre exactamente lo mismo que la app.
+QUERY_USUARIO_POR_NOMBRE = """
+    SELECT id, usuario, tipo_usuario, contraseña
+    FROM usuarios
+    WHERE usuario = %s
+"""
+
+
+def get_usuario_by_credentials(usuario, contraseña, tienda=None):
     """
-    return execute_query(query, params=(usuario, contraseña), is_select=True)
+    Busca el usuario por nombre (columna indexada) y verifica la contraseña
+    en Python. Devuelve un DataFrame con id, usuario y tipo_usuario, vacío
+    si las credenciales no son válidas.
+    """
+    df = execute_query(QUERY_USUARIO_POR_NOMBRE, params=(usuario,), is_select=True, nombre="get_usuario_by_credentials", preparar=True, tienda=tienda)
+    columnas = ["id", "usuario", "tipo_usuario"]
+    if df.empty:
+        verificar_password(contraseña, _HASH_FICTICIO)
+        return pd.DataFrame(columns=columnas)
+
+    fila = df.iloc[0]
+    guardado = fila["contraseña"]
+    clave = _clave_verificacion(usuario, guardado, contraseña)
+    with _verificaciones_lock:
+        verificada = clave in _verificaciones
+        if verificada:
+            _verificaciones.move_to_end(clave)
+
+    if not verificada:
+        ok, rehashear = verificar_password(contraseña, guardado)
+        if not ok:
+            return pd.DataFrame(columns=columnas)
+        if rehashear:
+            execute_query(
+                "UPDATE usuarios SET contraseña = %s WHERE id = %s",
+                params=(hash_password(contraseña), int(fila["id"])),
+                is_select=False,
+                nombre="rehash_password",
+                preparar=True,
+                tienda=tienda,
+            )
+        else:
+            with _verificaciones_lock:
+                _verificaciones[clave] = True
+                while len(_verificaciones) > _VERIFICACIONES_MAX:
+                    _verificaciones.popitem(last=False)
+
+    return df.iloc[:1][columnas]
 
 
-def get_usuarios():
+def get_usuarios(tienda=None):
     query = "SELECT id, usuario, tipo_usuario FROM usuarios"
-    return execute_query(query, is_select=True)
+    return cached_query(query, ["usuarios"], nombre="get_usuarios", preparar=True, tienda=tienda)
 
 
 # ---- Proveedores ----
-def add_proveedor(nombre):
+def add_proveedor(nombre, tienda=None):
     query = "INSERT INTO proveedores (nombre) VALUES (%s)"
-    return execute_query(query, params=(nombre,), is_select=False)
+    ok = execute_query(query, params=(nombre,), is_select=False, nombre="add_proveedor", preparar=True, tienda=tienda)
+    if ok:
+        invalidate_cache("proveedores", tienda=tienda)
+    return ok
 
 
-def get_proveedores():
+def get_proveedores(tienda=None):
     query = "SELECT id, nombre FROM proveedores"
-    return execute_query(query, is_select=True)
+    return cached_query(query, ["proveedores"], nombre="get_proveedores", preparar=True, tienda=tienda)
 
 
 # ---- Productos ----
-def add_producto(nombre, proveedor_id, cantidad, precio):
+def add_producto(nombre, proveedor_id, cantidad, precio, tienda=None):
     query = """
         INSERT INTO productos (nombre, proveedor_id, cantidad, precio)
         VALUES (%s, %s, %s, %s)
     """
-    return execute_query(query, params=(nombre, proveedor_id, cantidad, precio), is_select=False)
+    ok = execute_query(query, params=(nombre, proveedor_id, cantidad, precio), is_select=False, nombre="add_producto", preparar=True, tienda=tienda)
+    if ok:
+        invalidate_cache("productos", tienda=tienda)
+    return ok
 
 
-def update_producto_stock(producto_id, nueva_cantidad):
+def update_producto_stock(producto_id, nueva_cantidad, tienda=None):
     query = "UPDATE productos SET cantidad = %s WHERE id = %s"
-    return execute_query(query, params=(nueva_cantidad, producto_id), is_select=False)
+    ok = execute_query(query, params=(nueva_cantidad, producto_id), is_select=False, nombre="update_producto_stock", preparar=True, tienda=tienda)
+    if ok:
+        invalidate_cache("productos", tienda=tienda)
+    return ok
 
 
-def get_productos():
+def get_productos(tienda=None):
     query = "SELECT id, nombre, cantidad, precio FROM productos"
-    return execute_query(query, is_select=True)
+    return cached_query(query, ["productos"], nombre="get_productos", preparar=True, tienda=tienda)
 
 
 # ---- Ventas ----
-def add_venta(empleado_id, descuento=0):
+def add_venta(empleado_id, descuento=0, tienda=None):
     """
     Crea una nueva venta (ticket) en la base de datos.
     Cada llamada a esta función crea un NUEVO ticket con un ID único.
@@ -143,7 +1293,7 @@ def add_venta(empleado_id, descuento=0):
         INSERT INTO ventas (empleado_id, descuento, total)
         VALUES (%s, %s, 0) RETURNING id, fecha
     """
-    result = execute_query(query, params=(empleado_id, descuento), is_select=True)
+    result = execute_query(query, params=(empleado_id, descuento), is_select=True, nombre="add_venta", preparar=True, tienda=tienda)
     
     if not result.empty:
         print(f"✅ Nueva venta creada - ID: {result.iloc[0]['id']}, Fecha: {result.iloc[0]['fecha']}")
@@ -153,125 +1303,540 @@ def add_venta(empleado_id, descuento=0):
     return result
 
 
-def get_ventas(limit=20):
-    query = f"""
-        SELECT v.id, v.fecha, u.usuario AS empleado, v.total, v.descuento
-        FROM ventas v
-        JOIN usuarios u ON v.empleado_id = u.id
-        ORDER BY v.fecha DESC
-        LIMIT {limit}
+def _rango_fechas(columnas, desde=None, hasta=None):
+    """
+    Condiciones para un rango de fechas sobre una o varias columnas que
+    llevan la fecha de la venta (por ejemplo v.fecha y vd.fecha). Filtrar cada
+    tabla por su propia columna permite que Postgres descarte las particiones
+    de los meses que no se piden.
+
+    `desde`/`hasta` son fechas (inclusive, el día completo) o fecha y hora
+    exactas. Retorna (lista de condiciones, lista de parámetros).
     """
-    return execute_query(query, is_select=True)
+    if isinstance(columnas, str):
+        columnas = [columnas]
+    condiciones = []
+    params = []
+    for columna in columnas:
+        if desde is not None:
+            condiciones.append(f"{columna} >= %s")
+            params.append(desde)
+        if isinstance(hasta, datetime):
+            condiciones.append(f"{columna} <= %s")
+            params.append(hasta)
+        elif hasta is not None:
+            condiciones.append(f"{columna} < %s")
+            params.append(hasta + timedelta(days=1))
+    return condiciones, params
+
+
+QUERY_VENTAS = """
+    SELECT v.id, v.fecha, u.usuario AS empleado, v.total, v.descuento
+    FROM ventas v
+    JOIN usuarios u ON v.empleado_id = u.id
+    {where}
+    ORDER BY v.fecha DESC, v.id DESC
+    LIMIT %s
+"""
+
+
+def get_ventas(limit=20, desde=None, hasta=None, tienda=None):
+    """
+    Últimas ventas, de la más nueva a la más vieja. Con `desde`/`hasta` solo
+    se recorren las particiones de esos meses.
+    """
+    condiciones, params = _rango_fechas("v.fecha", desde, hasta)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    query = QUERY_VENTAS.format(where=where)
+    params.append(int(limit))
+    return execute_query(query, params=tuple(params), is_select=True, nombre="get_ventas", preparar=not condiciones, tienda=tienda)
+
+
+def _codificar_cursor(fecha, venta_id):
+    texto = f"{fecha.isoformat()}|{venta_id}"
+    return base64.urlsafe_b64encode(texto.encode()).decode()
+
+
+def _decodificar_cursor(cursor):
+    fecha, venta_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+    return fecha, int(venta_id)
+
+
+def query_ventas_pagina(posicion=None, desde=None, hasta=None, empleado_id=None):
+    """
+    Query de una página de get_ventas_pagina y sus parámetros, sin el LIMIT.
+    `posicion` es (fecha, id) de la última venta de la página anterior.
+    """
+    condiciones, params = _rango_fechas("v.fecha", desde, hasta)
+    if posicion is not None:
+        fecha, venta_id = posicion
+        # La comparación de filas no sirve para descartar particiones: la
+        # condición sobre fecha sola deja afuera los meses posteriores al cursor
+        condiciones.append("(v.fecha, v.id) < (%s, %s)")
+        condiciones.append("v.fecha <= %s")
+        params.extend([fecha, venta_id, fecha])
+    if empleado_id is not None:
+        condiciones.append("v.empleado_id = %s")
+        params.append(int(empleado_id))
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return QUERY_VENTAS.format(where=where), params
+
+
+def get_ventas_pagina(cursor=None, limite=20, desde=None, hasta=None, empleado_id=None, tienda=None):
+    """
+    Devuelve una página de ventas, de la más nueva a la más vieja, usando
+    paginación por keyset sobre (fecha, id): cada página cuesta lo mismo sin
+    importar qué tan atrás esté en el historial.
+
+    `cursor` es el token devuelto por la página anterior (None para la primera).
+    `desde`/`hasta` son fechas (inclusive) y `empleado_id` filtra por empleado.
+    Retorna (DataFrame, cursor de la página siguiente o None si no hay más).
+    """
+    posicion = _decodificar_cursor(cursor) if cursor else None
+    query, params = query_ventas_pagina(posicion, desde, hasta, empleado_id)
+    # Se pide una fila de más para saber si existe una página siguiente
+    params.append(int(limite) + 1)
+    df = execute_query(query, params=tuple(params), is_select=True, nombre="get_ventas_pagina", tienda=tienda)
+
+    siguiente = None
+    if len(df) > limite:
+        df = df.iloc[:limite]
+        ultima = df.iloc[-1]
+        siguiente = _codificar_cursor(ultima["fecha"], ultima["id"])
+    return df, siguiente
 
 
 # ---- Detalle de ventas ----
-def add_venta_detalle(venta_id, producto_id, cantidad, subtotal):
+def add_venta_detalle(venta_id, producto_id, cantidad, subtotal, tienda=None):
+    # El detalle se guarda con la fecha de su venta (columna de partición)
     query = """
-        INSERT INTO venta_detalle (venta_id, producto_id, cantidad, subtotal)
-        VALUES (%s, %s, %s, %s)
+        INSERT INTO venta_detalle (venta_id, fecha, producto_id, cantidad, subtotal)
+        SELECT v.id, v.fecha, %s, %s, %s
+        FROM ventas v
+        WHERE v.id = %s
     """
-    return execute_query(query, params=(venta_id, producto_id, cantidad, subtotal), is_select=False)
+    return execute_query(query, params=(producto_id, cantidad, subtotal, venta_id), is_select=False, nombre="add_venta_detalle", preparar=True, tienda=tienda)
 
 
-def get_detalle_por_venta(venta_id):
-    query = """
-        SELECT vd.id, p.nombre, vd.cantidad, vd.subtotal
-        FROM venta_detalle vd
-        JOIN productos p ON vd.producto_id = p.id
-        WHERE vd.venta_id = %s
+QUERY_DETALLE_POR_VENTA = """
+    SELECT vd.id, p.nombre, vd.cantidad, vd.subtotal
+    FROM venta_detalle vd
+    JOIN productos p ON vd.producto_id = p.id
+    WHERE vd.venta_id = %s
+"""
+QUERY_DETALLE_POR_VENTA_FECHA = """
+    SELECT vd.id, p.nombre, vd.cantidad, vd.subtotal
+    FROM venta_detalle vd
+    JOIN productos p ON vd.producto_id = p.id
+    WHERE vd.venta_id = %s AND vd.fecha = %s
+"""
+
+
+def get_detalle_por_venta(venta_id, fecha=None, tienda=None):
     """
-    return execute_query(query, params=(venta_id,), is_select=True)
+    Detalle de una venta. Si se pasa la `fecha` de la venta solo se busca
+    en la partición de ese mes.
+    """
+    if fecha is not None:
+        return execute_query(QUERY_DETALLE_POR_VENTA_FECHA, params=(venta_id, fecha), is_select=True, nombre="get_detalle_por_venta", preparar=True, tienda=tienda)
+    return execute_query(QUERY_DETALLE_POR_VENTA, params=(venta_id,), is_select=True, nombre="get_detalle_por_venta", preparar=True, tienda=tienda)
 
 
-def get_venta_completa(venta_id):
+def get_ventas_completas(venta_ids, desde=None, hasta=None, tienda=None):
     """
-    Obtiene la información completa de una venta incluyendo el detalle.
+    Obtiene encabezado y detalle de varias ventas en un solo round-trip
+    (útil para reimprimir o exportar tickets). Con `desde`/`hasta` solo se
+    buscan en las particiones de esos meses.
+    Retorna (DataFrame de ventas, DataFrame de detalle con la columna venta_id).
     """
-    # Obtener información de la venta
-    venta_query = """
-        SELECT v.id, v.fecha, v.descuento, v.total, u.usuario AS empleado
+    condiciones_ventas, params_ventas = _rango_fechas("v.fecha", desde, hasta)
+    # Las condiciones sobre vd van en el LEFT JOIN para no perder ventas sin detalle
+    condiciones_detalle, params_detalle = _rango_fechas("vd.fecha", desde, hasta)
+    en_ventas = "".join(f" AND {c}" for c in condiciones_ventas)
+    en_detalle = "".join(f" AND {c}" for c in condiciones_detalle)
+    query = f"""
+        SELECT v.id, v.fecha, v.descuento, v.total, u.usuario AS empleado,
+               COALESCE(
+                   json_agg(
+                       json_build_object(
+                           'id', vd.id,
+                           'nombre', p.nombre,
+                           'cantidad', vd.cantidad,
+                           'subtotal', vd.subtotal
+                       ) ORDER BY vd.id
+                   ) FILTER (WHERE vd.id IS NOT NULL),
+                   '[]'
+               ) AS detalle
         FROM ventas v
         JOIN usuarios u ON v.empleado_id = u.id
-        WHERE v.id = %s
+        LEFT JOIN venta_detalle vd ON vd.venta_id = v.id AND vd.fecha = v.fecha{en_detalle}
+        LEFT JOIN productos p ON vd.producto_id = p.id
+        WHERE v.id = ANY(%s::int[]){en_ventas}
+        GROUP BY v.id, v.fecha, u.usuario
+        ORDER BY v.id
     """
-    venta_info = execute_query(venta_query, params=(venta_id,), is_select=True)
-    
-    # Obtener detalle de la venta
-    detalle = get_detalle_por_venta(venta_id)
-    
-    return venta_info, detalle
+    params = tuple(params_detalle + [[int(i) for i in venta_ids]] + params_ventas)
+    df = execute_query(query, params=params, is_select=True, nombre="get_ventas_completas", preparar=True, tienda=tienda)
+    columnas_detalle = ["venta_id", "id", "nombre", "cantidad", "subtotal"]
+    if df.empty:
+        return df, pd.DataFrame(columns=columnas_detalle)
+
+    lineas = [
+        dict(linea, venta_id=venta_id)
+        for venta_id, detalle in zip(df["id"], df["detalle"])
+        for linea in detalle
+    ]
+    detalle = pd.DataFrame(lineas, columns=columnas_detalle)
+    return df.drop(columns=["detalle"]), detalle
 
 
-def update_venta_total(venta_id, total):
+def get_venta_completa(venta_id, fecha=None, tienda=None):
+    """
+    Obtiene la información completa de una venta incluyendo el detalle,
+    con una sola query. Si se pasa la `fecha` de la venta solo se busca en
+    la partición de ese mes.
+    """
+    venta_info, detalle = get_ventas_completas([venta_id], desde=fecha, hasta=fecha, tienda=tienda)
+    return venta_info, detalle.drop(columns=["venta_id"])
+
+
+def update_venta_total(venta_id, total, tienda=None):
     """
     Actualiza el total de una venta después de agregar todos los productos.
     """
     query = "UPDATE ventas SET total = %s WHERE id = %s"
-    return execute_query(query, params=(total, venta_id), is_select=False)
+    return execute_query(query, params=(total, venta_id), is_select=False, nombre="update_venta_total", preparar=True, tienda=tienda)
+
+
+# Errores de concurrencia ante los que conviene reintentar la transacción completa
+ERRORES_REINTENTABLES = (
+    psycopg2.errors.SerializationFailure,
+    psycopg2.errors.DeadlockDetected,
+    # Sentencia preparada que el servidor olvidó o que ya tenía: al reintentar
+    # se vuelve a preparar o se ejecuta directamente
+    psycopg2.errors.InvalidSqlStatementName,
+    psycopg2.errors.DuplicatePreparedStatement,
+)
+CHECKOUT_MAX_REINTENTOS = int(os.getenv("CHECKOUT_MAX_REINTENTOS", "3"))
+
+# Nombre con el que se registra el checkout en las métricas
+_CHECKOUT = "procesar_venta_completa_db"
+
+# Si está activo, cada venta actualiza las tablas de resumen de migraciones/0003_resumenes_ventas.sql
+USAR_RESUMENES = os.getenv("REPORTES_USAR_RESUMENES", "0") == "1"
+
+
+def _actualizar_resumenes(cursor, venta_id, fecha):
+    """
+    Suma la venta a las tablas de resumen de reportes, en la misma
+    transacción y en un solo round-trip.
+    """
+    resumen_query = """
+        INSERT INTO resumen_ventas_diario AS r
+            (dia, empleado_id, cantidad_ventas, total, total_descuento)
+        SELECT v.fecha::date, v.empleado_id, 1, v.total, v.total * v.descuento
+        FROM ventas v
+        WHERE v.id = %(venta_id)s AND v.fecha = %(fecha)s
+        ON CONFLICT (dia, empleado_id) DO UPDATE SET
+            cantidad_ventas = r.cantidad_ventas + EXCLUDED.cantidad_ventas,
+            total = r.total + EXCLUDED.total,
+            total_descuento = r.total_descuento + EXCLUDED.total_descuento;
+
+        INSERT INTO resumen_productos_diario AS r
+            (dia, producto_id, unidades, ingresos)
+        SELECT vd.fecha::date, vd.producto_id, SUM(vd.cantidad), SUM(vd.subtotal)
+        FROM venta_detalle vd
+        WHERE vd.venta_id = %(venta_id)s AND vd.fecha = %(fecha)s
+        GROUP BY vd.fecha::date, vd.producto_id
+        ORDER BY vd.producto_id
+        ON CONFLICT (dia, producto_id) DO UPDATE SET
+            unidades = r.unidades + EXCLUDED.unidades,
+            ingresos = r.ingresos + EXCLUDED.ingresos;
+    """
+    cursor.execute(resumen_query, {"venta_id": venta_id, "fecha": fecha})
+
+
+def _reservar_stock(cursor, cantidades_por_producto):
+    """
+    Bloquea las filas de productos de la venta, siempre en orden de id para
+    que dos cajas no se bloqueen mutuamente, y devuelve la lista de faltantes.
+    """
+    stock_query = """
+        SELECT id, nombre, cantidad
+        FROM productos
+        WHERE id = ANY(%s::int[])
+        ORDER BY id
+        FOR UPDATE
+    """
+    ejecutar_preparada(cursor, "checkout_reserva", stock_query, (sorted(cantidades_por_producto),))
+    stock = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    faltantes = []
+    for producto_id in sorted(cantidades_por_producto):
+        pedida = cantidades_por_producto[producto_id]
+        if producto_id not in stock:
+            faltantes.append(f"producto {producto_id} no existe")
+            continue
+        nombre, disponible = stock[producto_id]
+        if disponible < pedida:
+            faltantes.append(f"{nombre}: pedido {pedida}, disponible {disponible}")
+    return faltantes
+
+
+# Mensaje con el que el checkout avisa que no pudo hablar con la base;
+# la cola offline (cola_ventas.py) lo usa para decidir si guarda la venta.
+ERROR_CONEXION = "Error de conexión a la base de datos"
+
+
+def _ticket_por_clave(cursor, clave_idempotencia):
+    """
+    Si ya existe una venta registrada con esa clave devuelve su ticket, si no None.
+    """
+    ejecutar_preparada(cursor, "checkout_clave", """
+        SELECT v.id, v.fecha, v.total, v.descuento
+        FROM ventas_idempotencia vi
+        JOIN ventas v ON v.id = vi.venta_id AND v.fecha = vi.venta_fecha
+        WHERE vi.clave = %s
+    """, (clave_idempotencia,))
+    venta = cursor.fetchone()
+    if venta is None:
+        return None
+    ejecutar_preparada(cursor, "checkout_ticket", """
+        SELECT vd.id, p.nombre, vd.cantidad, vd.subtotal
+        FROM venta_detalle vd
+        JOIN productos p ON vd.producto_id = p.id
+        WHERE vd.venta_id = %s AND vd.fecha = %s
+        ORDER BY vd.id
+    """, (venta[0], venta[1]))
+    return {
+        "venta_id": venta[0],
+        "fecha": venta[1],
+        "total": venta[2],
+        "descuento": venta[3],
+        "detalle": pd.DataFrame(cursor.fetchall(), columns=["id", "nombre", "cantidad", "subtotal"]),
+    }
+
+
+def _crear_particion_actual(conn):
+    """
+    Crea la partición de ventas del mes actual cuando el checkout no la
+    encontró. Solo pasa si el mantenimiento de particiones.py no corrió a
+    tiempo, así que se avisa fuerte: la venta sigue, pero hay que revisarlo.
+    """
+    print(
+        "ATENCIÓN: no había partición de ventas para el mes actual y se creó "
+        "desde el checkout. El mantenimiento de particiones (particiones.py) "
+        "no está corriendo o está atrasado."
+    )
+    metricas.contar(_CHECKOUT, "particion_faltante")
+    try:
+        conn.cursor().execute("SELECT crear_particiones_ventas(now(), now())")
+        conn.commit()
+    except psycopg2.Error as e:
+        # El reintento vuelve a fallar y la venta se rechaza con el error original
+        print(f"Error creando la partición del mes actual: {e}")
+        conn.rollback()
 
 
-def procesar_venta_completa_db(empleado_id, productos_carrito, descuento=0.0):
+def procesar_venta_completa_db(empleado_id, productos_carrito, descuento=0.0, clave_idempotencia=None, tienda=None):
     """
     Procesa una venta completa con múltiples productos en una sola transacción.
     Esto evita problemas de claves foráneas.
+
+    Usa siempre la misma cantidad de round-trips sin importar cuántas líneas
+    tenga el carrito: el encabezado ya con el total, todo el detalle en un
+    único INSERT y todos los descuentos de stock en un único UPDATE. Las
+    líneas viajan como arrays (unnest), así el texto de cada sentencia es
+    fijo y se puede preparar una vez por conexión.
+
+    Antes de escribir bloquea los productos involucrados y verifica el stock,
+    así dos cajas vendiendo las últimas unidades no dejan el stock negativo.
+    Si falta stock la venta se rechaza completa con el detalle por producto.
+
+    Retorna (True, ticket) con el ticket persistido (venta_id, fecha, total,
+    descuento y el DataFrame de detalle) o (False, mensaje de error).
+
+    Si se pasa `clave_idempotencia`, una venta ya registrada con la misma clave
+    no se vuelve a grabar: se devuelve el ticket existente. Así se puede
+    reintentar una venta sin saber si el intento anterior llegó a la base.
     """
-    conn = None
-    try:
-        # Conectar a la base de datos
-        conn = connect_to_supabase()
-        if not conn:
-            return False, "Error de conexión a la base de datos"
-        
-        cursor = conn.cursor()
-        
-        # 1. Crear la venta
-        venta_query = """
-            INSERT INTO ventas (empleado_id, descuento, total)
-            VALUES (%s, %s, 0) RETURNING id
-        """
-        cursor.execute(venta_query, (empleado_id, descuento))
-        venta_id = cursor.fetchone()[0]
-        
-        # 2. Calcular total y agregar detalles
-        total_venta = 0
-        for item in productos_carrito:
-            subtotal = item['precio'] * item['cantidad']
-            total_venta += subtotal
+    if not productos_carrito:
+        return False, "El carrito está vacío"
+
+    # Calcular subtotales y total antes de escribir
+    lineas = []
+    cantidades_por_producto = {}
+    total_venta = 0
+    for item in productos_carrito:
+        subtotal = item['precio'] * item['cantidad']
+        total_venta += subtotal
+        lineas.append((item['id'], item['cantidad'], subtotal))
+        # Si un producto aparece en varias líneas se descuenta una sola vez la suma
+        cantidades_por_producto[item['id']] = (
+            cantidades_por_producto.get(item['id'], 0) + item['cantidad']
+        )
+
+    inicio = time.perf_counter()
+    particion_creada = False
+    for intento in range(CHECKOUT_MAX_REINTENTOS + 1):
+        conn = None
+        try:
+            # Conectar a la base de datos
+            conn = connect_to_supabase(tienda)
+            if not conn:
+                return False, ERROR_CONEXION
             
-            # Insertar detalle
-            detalle_query = """
-                INSERT INTO venta_detalle (venta_id, producto_id, cantidad, subtotal)
-                VALUES (%s, %s, %s, %s)
+            cursor = conn.cursor()
+
+            if clave_idempotencia:
+                ticket = _ticket_por_clave(cursor, clave_idempotencia)
+                if ticket is not None:
+                    conn.rollback()
+                    metricas.contar(_CHECKOUT, "duplicadas")
+                    return True, ticket
+
+            # 1. Bloquear los productos y verificar stock
+            with metricas.medir(_CHECKOUT, "reserva_stock"):
+                faltantes = _reservar_stock(cursor, cantidades_por_producto)
+            if faltantes:
+                conn.rollback()
+                metricas.contar(_CHECKOUT, "sin_stock")
+                return False, "Stock insuficiente: " + "; ".join(faltantes)
+            
+            # 2. Crear la venta con el total ya calculado
+            venta_query = """
+                INSERT INTO ventas (empleado_id, descuento, total)
+                VALUES (%s, %s, %s)
+                RETURNING id, fecha, total,
+                    (SELECT u.usuario FROM usuarios u WHERE u.id = ventas.empleado_id)
             """
-            cursor.execute(detalle_query, (
-                venta_id,
-                item['id'],
-                item['cantidad'],
-                subtotal
-            ))
+            with metricas.medir(_CHECKOUT, "encabezado"):
+                ejecutar_preparada(cursor, "checkout_encabezado", venta_query, (empleado_id, descuento, total_venta))
+                venta_id, fecha, total, empleado = cursor.fetchone()
+                if clave_idempotencia:
+                    ejecutar_preparada(
+                        cursor,
+                        "checkout_idempotencia",
+                        "INSERT INTO ventas_idempotencia (clave, venta_id, venta_fecha) VALUES (%s, %s, %s)",
+                        (clave_idempotencia, venta_id, fecha),
+                    )
             
-            # Actualizar stock del producto
+            # 3. Insertar todo el detalle en un solo INSERT multi-fila
+            detalle_query = """
+                INSERT INTO venta_detalle (venta_id, fecha, producto_id, cantidad, subtotal)
+                SELECT %s::int, %s::timestamptz, d.producto_id, d.cantidad, d.subtotal
+                FROM unnest(%s::int[], %s::int[], %s::numeric[])
+                    WITH ORDINALITY AS d(producto_id, cantidad, subtotal, orden)
+                ORDER BY d.orden
+                RETURNING id, producto_id, cantidad, subtotal
+            """
+            with metricas.medir(_CHECKOUT, "detalle"):
+                productos_ids, cantidades, subtotales = (list(columna) for columna in zip(*lineas))
+                ejecutar_preparada(
+                    cursor,
+                    "checkout_detalle",
+                    detalle_query,
+                    (venta_id, fecha, productos_ids, cantidades, subtotales),
+                )
+                detalle = cursor.fetchall()
+
+            # 4. Descontar el stock de todos los productos en un solo UPDATE.
+            # La condición cantidad >= v.cantidad es una red de seguridad extra.
             stock_query = """
-                UPDATE productos 
-                SET cantidad = cantidad - %s 
-                WHERE id = %s
+                UPDATE productos AS p
+                SET cantidad = p.cantidad - v.cantidad
+                FROM unnest(%s::int[], %s::int[]) AS v(id, cantidad)
+                WHERE p.id = v.id AND p.cantidad >= v.cantidad
+                RETURNING p.id, p.cantidad
             """
-            cursor.execute(stock_query, (item['cantidad'], item['id']))
-        
-        # 3. Actualizar el total de la venta
-        total_query = "UPDATE ventas SET total = %s WHERE id = %s"
-        cursor.execute(total_query, (total_venta, venta_id))
-        
-        # 4. Confirmar toda la transacción
-        conn.commit()
-        
-        return True, venta_id
-        
-    except Exception as e:
-        print(f"Error procesando venta completa: {e}")
-        if conn:
+            with metricas.medir(_CHECKOUT, "stock"):
+                ejecutar_preparada(
+                    cursor,
+                    "checkout_stock",
+                    stock_query,
+                    (list(cantidades_por_producto), list(cantidades_por_producto.values())),
+                )
+                stock_nuevo = dict(cursor.fetchall())
+            if len(stock_nuevo) != len(cantidades_por_producto):
+                conn.rollback()
+                metricas.contar(_CHECKOUT, "sin_stock")
+                return False, "Stock insuficiente: el stock cambió durante la venta"
+            
+            if USAR_RESUMENES:
+                with metricas.medir(_CHECKOUT, "resumenes"):
+                    _actualizar_resumenes(cursor, venta_id, fecha)
+            
+            # 5. Confirmar toda la transacción
+            with metricas.medir(_CHECKOUT, "commit"):
+                conn.commit()
+            # El catálogo recibe el stock nuevo en vez de rearmarse entero
+            invalidate_cache("ventas", tienda=tienda)
+            _avisar_stock(tienda, stock_nuevo)
+            _buffer_ventas_recientes(tienda).agregar(venta_id, fecha, empleado, total, descuento)
+
+            duracion = time.perf_counter() - inicio
+            metricas.observar(_CHECKOUT, "total", duracion)
+            metricas.contar(_CHECKOUT, "lineas", len(lineas))
+            metricas.registrar_lenta(_CHECKOUT, duracion)
+            
+            # El ticket se arma con lo que devolvieron los RETURNING, sin volver a consultar
+            nombres = {item['id']: item['nombre'] for item in productos_carrito}
+            ticket = {
+                "venta_id": venta_id,
+                "fecha": fecha,
+                "total": total,
+                "descuento": descuento,
+                "detalle": pd.DataFrame(
+                    [(d[0], nombres.get(d[1]), d[2], d[3]) for d in detalle],
+                    columns=["id", "nombre", "cantidad", "subtotal"],
+                ),
+            }
+            return True, ticket
+
+        except ERRORES_REINTENTABLES as e:
+            print(f"Conflicto de concurrencia procesando venta (intento {intento + 1}): {e}")
+            metricas.contar(_CHECKOUT, "reintentos")
+            if conn:
+                conn.rollback()
+            if intento == CHECKOUT_MAX_REINTENTOS:
+                return False, str(e)
+            # Espera exponencial con algo de azar para que las cajas no choquen de nuevo
+            time.sleep(0.05 * (2 ** intento) * (1 + random.random()))
+        except psycopg2.errors.UniqueViolation as e:
+            # Otro proceso registró la misma clave al mismo tiempo: se devuelve esa venta
             conn.rollback()
-        return False, str(e)
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+            ticket = _ticket_por_clave(conn.cursor(), clave_idempotencia) if clave_idempotencia else None
+            if ticket is not None:
+                metricas.contar(_CHECKOUT, "duplicadas")
+                return True, ticket
+            print(f"Error procesando venta completa: {e}")
+            metricas.contar(_CHECKOUT, "errores")
+            return False, str(e)
+        except psycopg2.errors.CheckViolation as e:
+            conn.rollback()
+            # Sin nombre de restricción es "no partition of relation found":
+            # falta la partición del mes actual
+            if e.diag.constraint_name is None and not particion_creada and intento < CHECKOUT_MAX_REINTENTOS:
+                _crear_particion_actual(conn)
+                particion_creada = True
+                continue
+            print(f"Error procesando venta completa: {e}")
+            metricas.contar(_CHECKOUT, "errores")
+            return False, str(e)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"Error de conexión procesando venta: {e}")
+            metricas.contar(_CHECKOUT, "errores_conexion")
+            if conn and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            return False, ERROR_CONEXION
+        except Exception as e:
+            print(f"Error procesando venta completa: {e}")
+            metricas.contar(_CHECKOUT, "errores")
+            if conn:
+                conn.rollback()
+            return False, str(e)
+        finally:
+            release_connection(conn, tienda)
@@ -0,0 +1,82 @@
+import asyncio
+import concurrent.futures
+
+import functions
+
+# =====================================
+# VERSIÓN ASÍNCRONA DE functions.py
+# =====================================
+# psycopg2 no tiene soporte para asyncio, así que cada función corre la
+# versión sincrónica en un hilo (asyncio.to_thread) usando el mismo pool de
+# conexiones. La concurrencia real queda limitada por SUPABASE_POOL_MAX.
+
+
+def _version_async(funcion):
+    """
+    Crea la versión async de una función de functions.py.
+    """
+    async def envoltura(*args, **kwargs):
+        return await asyncio.to_thread(funcion, *args, **kwargs)
+
+    envoltura.__name__ = f"{funcion.__name__}_async"
+    envoltura.__doc__ = f"Versión async de functions.{funcion.__name__}."
+    return envoltura
+
+
+# ---- Conexión y queries ----
+execute_query_async = _version_async(functions.execute_query)
+cached_query_async = _version_async(functions.cached_query)
+
+# ---- Usuarios ----
+add_usuario_async = _version_async(functions.add_usuario)
+get_usuario_by_credentials_async = _version_async(functions.get_usuario_by_credentials)
+get_usuarios_async = _version_async(functions.get_usuarios)
+
+# ---- Proveedores ----
+add_proveedor_async = _version_async(functions.add_proveedor)
+get_proveedores_async = _version_async(functions.get_proveedores)
+
+# ---- Productos ----
+add_producto_async = _version_async(functions.add_producto)
+update_producto_stock_async = _version_async(functions.update_producto_stock)
+get_productos_async = _version_async(functions.get_productos)
+
+# ---- Ventas ----
+add_venta_async = _version_async(functions.add_venta)
+get_ventas_async = _version_async(functions.get_ventas)
+get_ventas_pagina_async = _version_async(functions.get_ventas_pagina)
+add_venta_detalle_async = _version_async(functions.add_venta_detalle)
+get_detalle_por_venta_async = _version_async(functions.get_detalle_por_venta)
+get_ventas_completas_async = _version_async(functions.get_ventas_completas)
+get_venta_completa_async = _version_async(functions.get_venta_completa)
+update_venta_total_async = _version_async(functions.update_venta_total)
+procesar_venta_completa_db_async = _version_async(functions.procesar_venta_completa_db)
+
+
+async def _esperar_todas(consultas):
+    resultados = await asyncio.gather(*consultas.values())
+    return dict(zip(consultas.keys(), resultados))
+
+
+def cargar_en_paralelo(**consultas):
+    """
+    Ejecuta varias lecturas independientes al mismo tiempo y espera a todas.
+    Se usa desde las vistas de Streamlit, que no son async:
+
+        datos = cargar_en_paralelo(
+            usuarios=get_usuarios_async(),
+            productos=get_productos_async(),
+        )
+
+    Retorna un diccionario con el resultado de cada consulta. El tiempo total
+    queda acotado por la consulta más lenta en lugar de la suma de todas.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_esperar_todas(consultas))
+
+    # Ya hay un loop corriendo en este hilo (por ejemplo en un notebook):
+    # se usa un hilo aparte con su propio loop.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, _esperar_todas(consultas)).result()
@@ -1,22 +1,46 @@
 # main.py
+import io
 import streamlit as st
+import pandas as pd
 import time
+import metricas
 from functions import (
     get_usuario_by_credentials,
-    get_productos,
     update_producto_stock,
     add_venta,
     add_venta_detalle,
-    get_ventas,
-    get_detalle_por_venta,
+    get_ventas_recientes,
+    get_ventas_pagina,
     get_venta_completa,
     update_venta_total,
-    procesar_venta_completa_db,
     add_usuario,
     get_usuarios,
     add_proveedor,
-    get_proveedores,
-    add_producto
+    add_producto,
+    get_pool_stats,
+    get_cache_stats,
+    get_prepared_stats,
+    get_ventas_recientes_stats,
+    get_tiendas
+)
+from catalogo import get_catalogo, get_catalogo_stats, iniciar_escucha
+from carga_masiva import importar_productos, importar_stock, exportar_catalogo
+from cola_ventas import registrar_venta, iniciar_sincronizacion, estado_cola
+from migraciones import migrar_al_iniciar, migraciones_pendientes_al_iniciar
+from particiones import iniciar_mantenimiento
+from exportacion import FORMATOS, exportar_ventas_por_tramos
+from functions_async import (
+    cargar_en_paralelo,
+    get_usuarios_async,
+    get_proveedores_async,
+    get_productos_async
+)
+from reportes import (
+    resumen_general,
+    ventas_por_periodo,
+    top_productos,
+    ventas_por_empleado,
+    consolidado
 )
 
 # --- Configuración de la página ---
@@ -26,6 +50,28 @@ st.set_page_config(
     layout="centered"
 )
 
+# --- Migraciones pendientes (solo si MIGRAR_AL_INICIAR=1, una vez por proceso) ---
+migrar_al_iniciar()
+
+# --- Sin todas las migraciones la app no puede vender: se frena acá ---
+pendientes = migraciones_pendientes_al_iniciar()
+if pendientes:
+    st.error(
+        "❌ La base no tiene todas las migraciones aplicadas: "
+        + "; ".join(pendientes)
+        + ". Correr `python migraciones.py` (o iniciar con MIGRAR_AL_INICIAR=1)."
+    )
+    st.stop()
+
+# --- Sincronización de ventas guardadas sin conexión (un hilo por proceso) ---
+iniciar_sincronizacion()
+
+# --- Escucha de cambios de productos (solo si CATALOGO_EN_VIVO=1, un hilo por proceso) ---
+iniciar_escucha()
+
+# --- Particiones de ventas de los próximos meses (un hilo por proceso) ---
+iniciar_mantenimiento()
+
 # --- Inicializar session_state ---
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
@@ -53,6 +99,31 @@ def login_user(username, password):
     return False
 
 
+# Segundos que un aviso sigue visible después de guardarlo
+AVISO_DURACION = 8
+
+
+def avisar(mensaje, tipo="success", detalle=None):
+    """Guarda un aviso en session_state para mostrarlo aunque haya un st.rerun() en el medio"""
+    st.session_state.setdefault("avisos", []).append({
+        "mensaje": mensaje,
+        "tipo": tipo,
+        "detalle": detalle,
+        "vence": time.monotonic() + AVISO_DURACION
+    })
+
+
+def mostrar_avisos():
+    """Muestra los avisos pendientes y descarta los vencidos, sin bloquear la sesión"""
+    ahora = time.monotonic()
+    vigentes = [aviso for aviso in st.session_state.get("avisos", []) if aviso["vence"] > ahora]
+    st.session_state["avisos"] = vigentes
+    for aviso in vigentes:
+        getattr(st, aviso["tipo"])(aviso["mensaje"])
+        if aviso["detalle"] is not None and not aviso["detalle"].empty:
+            st.dataframe(aviso["detalle"], hide_index=True, width='stretch')
+
+
 def logout_user():
     for key in ["logged_in", "username", "role", "user_id", "view"]:
         if key in st.session_state:
@@ -87,6 +158,12 @@ def show_home():
         st.session_state["view"] = "stock"
         st.rerun()
 
+    pendientes = estado_cola()
+    if pendientes.get("pendiente"):
+        st.warning(f"📡 Ventas pendientes de enviar: {pendientes['pendiente']}")
+    if st.session_state["role"] == "admin" and pendientes.get("rechazada"):
+        st.error(f"⚠️ Ventas sin conexión rechazadas por la base: {pendientes['rechazada']}")
+
     if st.session_state["role"] == "admin":
         if st.button("👥 ABM"):
             st.session_state["view"] = "abm"
@@ -94,6 +171,9 @@ def show_home():
         if st.button("📊 Reportes"):
             st.session_state["view"] = "reportes"
             st.rerun()
+        if st.button("📈 Métricas"):
+            st.session_state["view"] = "metricas"
+            st.rerun()
 
     if st.button("🚪 Logout"):
         logout_user()
@@ -113,25 +193,48 @@ def show_ventas():
     if "carrito" not in st.session_state:
         st.session_state["carrito"] = []
     
-    df_productos = get_productos()
-    if df_productos.empty:
+    if len(get_catalogo()) == 0:
         st.warning("No hay productos cargados.")
         return
 
     # Mostrar información de debugging
     st.info(f"🆔 Usuario actual: {st.session_state['username']} (ID: {st.session_state['user_id']})")
     
-    # Mostrar últimas ventas para verificar
+    # Cada sección es un fragment: interactuar con una solo vuelve a correr esa
+    # sección, no toda la página ni las consultas de las demás.
+    mostrar_ultimas_ventas()
+    st.divider()
+    mostrar_carrito()
+    st.divider()
+    mostrar_selector_productos()
+
+
+# Cada cuántos segundos se vuelve a dibujar la lista (se lee de memoria, no de la base)
+VENTAS_RECIENTES_REFRESCO = 10
+
+
+@st.fragment(run_every=VENTAS_RECIENTES_REFRESCO)
+def mostrar_ultimas_ventas():
+    """Últimas ventas, leídas del buffer compartido por todas las sesiones"""
     st.subheader("📋 Últimas ventas registradas")
-    df_ventas = get_ventas(limit=5)
+    df_ventas = get_ventas_recientes(limite=5)
     if not df_ventas.empty:
         st.dataframe(df_ventas, hide_index=True, width='stretch')
     else:
         st.info("No hay ventas registradas aún.")
 
-    st.divider()
-    
-    # === CARRITO DE COMPRAS ===
+
+def quitar_del_carrito(i):
+    st.session_state["carrito"].pop(i)
+
+
+def vaciar_carrito():
+    st.session_state["carrito"] = []
+
+
+@st.fragment
+def mostrar_carrito():
+    """Carrito de compras: solo usa session_state, no consulta la base"""
     st.subheader("🛒 Carrito de compras")
     
     # Mostrar carrito actual
@@ -152,64 +255,61 @@ def show_ventas():
                 st.write(f"${subtotal:.2f}")
                 total_carrito += subtotal
             with col5:
-                if st.button("🗑️", key=f"remove_{i}"):
-                    st.session_state["carrito"].pop(i)
-                    st.rerun()
+                st.button("🗑️", key=f"remove_{i}", on_click=quitar_del_carrito, args=(i,))
         
         st.write(f"**💰 Total del carrito: ${total_carrito:.2f}**")
         
         # Botones para el carrito
-        col1, col2, col3 = st.columns(3)
+        col1, col2 = st.columns(2)
         with col1:
-            if st.button("🧹 Limpiar carrito"):
-                st.session_state["carrito"] = []
-                st.rerun()
+            st.button("🧹 Limpiar carrito", on_click=vaciar_carrito)
         with col2:
             if st.button("✅ Confirmar venta"):
                 procesar_venta_completa(total_carrito)
-        with col3:
-            if st.button("➕ Agregar más productos"):
-                st.rerun()
     else:
         st.info("🛒 El carrito está vacío. Agrega productos para comenzar.")
-    
-    st.divider()
-    
-    # === AGREGAR PRODUCTOS ===
+
+
+@st.fragment
+def mostrar_selector_productos():
+    """Búsqueda y selección de productos sobre el catálogo en memoria"""
     st.subheader("➕ Agregar productos al carrito")
+    catalogo = get_catalogo()
     
     col1, col2 = st.columns(2)
     
     with col1:
-        producto = st.selectbox("Producto", df_productos["nombre"].tolist())
+        busqueda = st.text_input("Buscar producto")
+        producto_id = st.selectbox("Producto", catalogo.buscar(busqueda), format_func=catalogo.etiqueta)
         cantidad = st.number_input("Cantidad", min_value=1, value=1)
     
+    producto = catalogo.por_id(producto_id) if producto_id is not None else None
     with col2:
         # Mostrar información del producto seleccionado
         if producto:
-            prod_row = df_productos[df_productos["nombre"] == producto].iloc[0]
-            st.write(f"**Precio unitario:** ${prod_row['precio']:.2f}")
-            st.write(f"**Stock disponible:** {prod_row['cantidad']}")
-            subtotal = cantidad * float(prod_row["precio"])
+            st.write(f"**Precio unitario:** ${producto['precio']:.2f}")
+            st.write(f"**Stock disponible:** {producto['cantidad']}")
+            subtotal = cantidad * producto["precio"]
             st.write(f"**Subtotal:** ${subtotal:.2f}")
     
     if st.button("➕ Agregar al carrito"):
         if producto and cantidad > 0:
-            prod_row = df_productos[df_productos["nombre"] == producto].iloc[0]
-            
             # Verificar stock
-            if cantidad > int(prod_row["cantidad"]):
-                st.error(f"❌ No hay suficiente stock. Disponible: {prod_row['cantidad']}")
+            if cantidad > producto["cantidad"]:
+                st.error(f"❌ No hay suficiente stock. Disponible: {producto['cantidad']}")
             else:
                 # Agregar al carrito
                 nuevo_item = {
-                    "id": int(prod_row["id"]),
-                    "nombre": producto,
-                    "precio": float(prod_row["precio"]),
+                    "id": producto["id"],
+                    "nombre": producto["nombre"],
+                    "precio": producto["precio"],
                     "cantidad": int(cantidad)
                 }
                 st.session_state["carrito"].append(nuevo_item)
-                st.success(f"✅ {producto} agregado al carrito")
+                st.success(f"✅ {producto['nombre']} agregado al carrito")
+                # El carrito es otro fragment: se redibuja la página (las últimas
+                # ventas salen del buffer compartido de ventas recientes, sin
+                # consultar la base)
                 st.rerun()
         else:
             st.error("❌ Por favor selecciona un producto y cantidad")
@@ -224,30 +324,29 @@ def procesar_venta_completa(total_carrito):
         # Mostrar información antes de crear la venta
         st.info("🔄 Procesando venta completa...")
         
-        # Usar la nueva función que maneja todo en una sola transacción
-        success, result = procesar_venta_completa_db(
+        # Registrar la venta; si no hay conexión queda en la cola local y se envía después
+        success, result = registrar_venta(
             int(st.session_state["user_id"]), 
             st.session_state["carrito"], 
             descuento
         )
         
         if success:
-            venta_id = result
-            st.success(f"🎉 Venta registrada exitosamente!")
-            st.success(f"📄 Ticket ID: {venta_id}")
-            st.success(f"📦 Productos: {len(st.session_state['carrito'])}")
-            st.success(f"💰 Total: ${total_carrito:.2f}")
-            
-            # Mostrar el ticket completo
-            st.subheader("📋 Detalle del ticket")
-            detalle_df = get_detalle_por_venta(venta_id)
-            if not detalle_df.empty:
-                st.dataframe(detalle_df, hide_index=True, width='stretch')
+            ticket = result
+            # El resumen y el detalle del ticket se muestran en el inicio, sin esperar acá
+            if ticket.get("pendiente"):
+                avisar("📡 Sin conexión: la venta quedó guardada y se enviará automáticamente", "warning")
+                titulo = "🎉 Venta registrada exitosamente!"
+            else:
+                titulo = f"🎉 Venta registrada exitosamente! 📄 Ticket ID: {ticket['venta_id']}"
+            avisar(
+                f"{titulo} 📦 Productos: {len(st.session_state['carrito'])} 💰 Total: ${total_carrito:.2f}",
+                detalle=ticket["detalle"]
+            )
             
-            # Limpiar carrito
+            # Limpiar carrito (el checkout ya agregó la venta a las últimas ventas)
             st.session_state["carrito"] = []
             
-            time.sleep(3)  # Sleep para que se vea el mensaje
             st.session_state["view"] = "home"
             st.rerun()
         else:
@@ -268,24 +367,22 @@ def show_stock():
     
     st.divider()
 
-    df_productos = get_productos()
-    if df_productos.empty:
+    catalogo = get_catalogo()
+    if len(catalogo) == 0:
         st.warning("No hay productos cargados.")
         return
 
-    producto = st.selectbox("Producto", df_productos["nombre"].tolist())
+    busqueda = st.text_input("Buscar producto")
+    prod_id = st.selectbox("Producto", catalogo.buscar(busqueda), format_func=catalogo.etiqueta)
     nueva_cantidad = st.number_input("Nueva cantidad", min_value=0, value=0)
 
-    if st.button("📦 Actualizar stock"):
-        prod_id = int(df_productos[df_productos["nombre"] == producto].iloc[0]["id"])
+    if st.button("📦 Actualizar stock") and prod_id is not None:
         ok = update_producto_stock(prod_id, int(nueva_cantidad))
         if ok:
-            st.success("Stock actualizado")
-            time.sleep(2)  # Sleep para que se vea el mensaje
+            avisar("Stock actualizado")
             st.rerun()
         else:
             st.error("Error al actualizar stock")
-            time.sleep(2)  # Sleep para que se vea el mensaje
 
 
 def show_abm():
@@ -298,6 +395,13 @@ def show_abm():
     
     st.divider()
 
+    # Las tres tablas se leen al mismo tiempo en lugar de una detrás de otra
+    datos = cargar_en_paralelo(
+        usuarios=get_usuarios_async(),
+        proveedores=get_proveedores_async(),
+        productos=get_productos_async(),
+    )
+
     st.subheader("Usuarios")
     with st.form("form_usuario"):
         usuario = st.text_input("Usuario")
@@ -306,12 +410,12 @@ def show_abm():
         if st.form_submit_button("👤 Agregar usuario"):
             ok = add_usuario(usuario, contraseña, tipo)
             if ok:
-                st.success("Usuario agregado")
-                time.sleep(2)  # Sleep para que se vea el mensaje
+                # Al volver a correr, la tabla se lee de nuevo (la cache ya se invalidó)
+                avisar("Usuario agregado")
+                st.rerun()
             else:
                 st.error("Error al agregar usuario")
-                time.sleep(2)  # Sleep para que se vea el mensaje
-    st.dataframe(get_usuarios(), hide_index=True, width='stretch')
+    st.dataframe(datos["usuarios"], hide_index=True, width='stretch')
 
     st.subheader("Proveedores")
     with st.form("form_proveedor"):
@@ -319,15 +423,15 @@ def show_abm():
         if st.form_submit_button("🏢 Agregar proveedor"):
             ok = add_proveedor(nombre)
             if ok:
-                st.success("Proveedor agregado")
-                time.sleep(2)  # Sleep para que se vea el mensaje
+                # Al volver a correr, la tabla se lee de nuevo (la cache ya se invalidó)
+                avisar("Proveedor agregado")
+                st.rerun()
             else:
                 st.error("Error al agregar proveedor")
-                time.sleep(2)  # Sleep para que se vea el mensaje
-    st.dataframe(get_proveedores(), hide_index=True, width='stretch')
+    st.dataframe(datos["proveedores"], hide_index=True, width='stretch')
 
     st.subheader("Productos")
-    proveedores = get_proveedores()
+    proveedores = datos["proveedores"]
     with st.form("form_producto"):
         nombre = st.text_input("Nombre producto")
         proveedor = st.selectbox("Proveedor", proveedores["nombre"].tolist() if not proveedores.empty else [])
@@ -338,12 +442,41 @@ def show_abm():
                 prov_id = int(proveedores[proveedores["nombre"] == proveedor].iloc[0]["id"])
                 ok = add_producto(nombre, prov_id, int(cantidad), float(precio))
                 if ok:
-                    st.success("Producto agregado")
-                    time.sleep(2)  # Sleep para que se vea el mensaje
+                    # Al volver a correr, la tabla se lee de nuevo (la cache ya se invalidó)
+                    avisar("Producto agregado")
+                    st.rerun()
                 else:
                     st.error("Error al agregar producto")
-                    time.sleep(2)  # Sleep para que se vea el mensaje
-    st.dataframe(get_productos(), hide_index=True, width='stretch')
+    st.dataframe(datos["productos"], hide_index=True, width='stretch')
+
+    st.subheader("Importación masiva")
+    clave = st.radio("Identificar productos por", ["id", "nombre"], horizontal=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        archivo_productos = st.file_uploader("Lista de productos (CSV/Parquet)", type=["csv", "parquet"])
+        if archivo_productos and st.button("📥 Importar productos"):
+            ok, resultado = importar_productos(archivo_productos, clave=clave)
+            if ok:
+                st.success(f"Productos importados: {resultado}")
+            else:
+                st.error(f"Error al importar productos: {resultado}")
+    with col2:
+        archivo_stock = st.file_uploader("Conteo de stock (CSV/Parquet)", type=["csv", "parquet"])
+        if archivo_stock and st.button("📥 Importar stock"):
+            ok, resultado = importar_stock(archivo_stock, clave=clave)
+            if ok:
+                st.success(f"Productos actualizados: {resultado}")
+            else:
+                st.error(f"Error al importar stock: {resultado}")
+
+    if st.button("📤 Exportar catálogo"):
+        catalogo_csv = io.BytesIO()
+        if exportar_catalogo(catalogo_csv):
+            st.session_state["catalogo_csv"] = catalogo_csv.getvalue()
+        else:
+            st.error("Error al exportar el catálogo")
+    if "catalogo_csv" in st.session_state:
+        st.download_button("⬇️ Descargar catálogo", st.session_state["catalogo_csv"], file_name="productos.csv", mime="text/csv")
 
 
 def show_reportes():
@@ -356,16 +489,106 @@ def show_reportes():
     
     st.divider()
     
-    # Mostrar estadísticas generales
+    # Con varias tiendas se elige una o se consolidan todas
+    tiendas = get_tiendas()
+    tienda = None
+    if len(tiendas) > 1:
+        opciones = ["Todas"] + list(tiendas)
+        tienda = st.selectbox(
+            "Tienda",
+            opciones,
+            format_func=lambda t: t if t == "Todas" else tiendas[t].get("nombre", f"Tienda {t}"),
+        )
+    todas = tienda == "Todas"
+    errores_tiendas = {}
+
+    def reporte(funcion, *args):
+        if not todas:
+            return funcion(*args, tienda=tienda)
+        df, errores = consolidado(funcion, *args)
+        errores_tiendas.update(errores)
+        return df
+
+    # Filtros
+    col1, col2 = st.columns(2)
+    with col1:
+        rango = st.date_input("Rango de fechas", value=())
+    with col2:
+        empleados = {"Todos": None}
+        # Los empleados son de cada tienda: el filtro solo aplica a una
+        if not todas:
+            df_usuarios = get_usuarios(tienda=tienda)
+            if not df_usuarios.empty:
+                empleados.update(zip(df_usuarios["usuario"], df_usuarios["id"]))
+        empleado = st.selectbox("Empleado", list(empleados.keys()))
+
+    desde = rango[0] if len(rango) > 0 else None
+    hasta = rango[1] if len(rango) > 1 else desde
+    filtros = (tienda, desde, hasta, empleados[empleado])
+
+    # Cada página guarda el cursor con el que se pidió; si cambian los filtros se vuelve a la primera
+    if st.session_state.get("reportes_filtros") != filtros:
+        st.session_state["reportes_filtros"] = filtros
+        st.session_state["reportes_cursores"] = [None]
+    cursores = st.session_state["reportes_cursores"]
+
+    # Mostrar estadísticas generales (calculadas en la base)
     st.subheader("📊 Estadísticas de ventas")
-    df = get_ventas(limit=50)
+    resumen = reporte(resumen_general, desde, hasta)
+    if not resumen.empty and resumen.iloc[0]["cantidad_ventas"] > 0:
+        fila = resumen.iloc[0]
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Total de ventas", int(fila["cantidad_ventas"]))
+        col2.metric("Facturación neta", f"${float(fila['total_neto']):.2f}")
+        col3.metric("Ticket promedio", f"${float(fila['ticket_promedio']):.2f}")
+        col4.metric("Descuentos", f"${float(fila['total_descuento']):.2f}")
+
+        periodo = st.radio("Agrupar por", ["dia", "semana", "mes"], horizontal=True)
+        df_periodo = reporte(ventas_por_periodo, periodo, desde, hasta)
+        if not df_periodo.empty:
+            st.line_chart(df_periodo.set_index("periodo")["total_neto"].astype(float))
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("**🏆 Productos más vendidos**")
+            criterio = st.radio("Ordenar por", ["unidades", "ingresos"], horizontal=True)
+            st.dataframe(reporte(top_productos, criterio, 10, desde, hasta), hide_index=True, width='stretch')
+        with col2:
+            st.write("**👥 Ventas por empleado**")
+            st.dataframe(reporte(ventas_por_empleado, desde, hasta), hide_index=True, width='stretch')
+
+    if errores_tiendas:
+        st.warning(f"⚠️ Resultados parciales: no respondieron las tiendas {', '.join(map(str, errores_tiendas))}")
+
+    # La lista de ventas y la exportación van sobre una sola base
+    if todas:
+        st.info("Elegí una tienda para ver la lista de ventas.")
+        return
+
+    mostrar_exportacion(desde, hasta, tienda)
+
+    df, siguiente = get_ventas_pagina(
+        cursor=cursores[-1],
+        limite=50,
+        desde=desde,
+        hasta=hasta,
+        empleado_id=empleados[empleado],
+        tienda=tienda,
+    )
     if not df.empty:
-        total_ventas = len(df)
-        st.metric("Total de ventas", total_ventas)
-        
         # Mostrar tabla de ventas
-        st.subheader("📋 Lista de ventas")
+        st.subheader(f"📋 Lista de ventas (página {len(cursores)})")
         st.dataframe(df, hide_index=True, width='stretch')
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(cursores) > 1 and st.button("⬅️ Anterior"):
+                cursores.pop()
+                st.rerun()
+        with col2:
+            if siguiente and st.button("Siguiente ➡️"):
+                cursores.append(siguiente)
+                st.rerun()
         
         # Permitir ver detalle de una venta específica
         st.subheader("🔍 Ver detalle de venta")
@@ -373,7 +596,9 @@ def show_reportes():
         if venta_ids:
             venta_seleccionada = st.selectbox("Selecciona una venta para ver su detalle:", venta_ids)
             if st.button("Ver detalle"):
-                venta_info, detalle = get_venta_completa(venta_seleccionada)
+                # Con la fecha de la venta se busca solo en la partición de su mes
+                fecha = df.loc[df['id'] == venta_seleccionada, 'fecha'].iloc[0]
+                venta_info, detalle = get_venta_completa(venta_seleccionada, fecha=fecha, tienda=tienda)
                 if not venta_info.empty:
                     st.subheader(f"📄 Ticket #{venta_seleccionada}")
                     st.write(f"**Fecha:** {venta_info.iloc[0]['fecha']}")
@@ -390,10 +615,100 @@ def show_reportes():
         st.info("No hay ventas registradas.")
 
 
+def mostrar_exportacion(desde, hasta, tienda):
+    # La lista de abajo se ve de a una página; el archivo trae todas las ventas del rango
+    with st.expander("📥 Exportar ventas con detalle"):
+        formato = st.radio("Formato", list(FORMATOS), horizontal=True, key="exportacion_formato")
+        if st.button("Generar archivo"):
+            barra = st.progress(0.0, text="Exportando...")
+
+            def avance(terminados, total, filas):
+                barra.progress(terminados / total, text=f"Exportando... {filas} filas ({terminados}/{total} tramos)")
+
+            ok, resultado = exportar_ventas_por_tramos(formato, desde, hasta, progreso=avance, tienda=tienda)
+            barra.empty()
+            if ok:
+                st.session_state["exportacion"] = resultado
+            else:
+                st.error(f"❌ No se pudo exportar: {resultado}")
+
+        exportado = st.session_state.get("exportacion")
+        if exportado and exportado["ruta"].exists():
+            ruta = exportado["ruta"]
+            # El archivo se lee recién al hacer clic, no en cada rerun
+            st.download_button(
+                f"⬇️ Descargar {exportado['nombre']} ({exportado['filas']} filas)",
+                data=ruta.read_bytes,
+                file_name=exportado["nombre"],
+                mime=FORMATOS[ruta.suffix.lstrip(".")],
+                on_click="ignore",
+            )
+
+
+def show_metricas():
+    st.title("Métricas de la base de datos")
+    
+    # Botón Volver arriba
+    if st.button("⬅️ Volver"):
+        st.session_state["view"] = "home"
+        st.rerun()
+    
+    st.divider()
+
+    datos = metricas.snapshot()
+
+    st.subheader("⏱️ Latencia por query (ms)")
+    if datos["histogramas"]:
+        df = pd.DataFrame(datos["histogramas"])[
+            ["query", "fase", "cantidad", "p50_ms", "p95_ms", "p99_ms", "maximo_ms"]
+        ]
+        st.dataframe(df.round(2), hide_index=True, width='stretch')
+    else:
+        st.info("Todavía no se registraron queries.")
+
+    st.subheader("🔢 Contadores")
+    if datos["contadores"]:
+        st.dataframe(pd.DataFrame(datos["contadores"]), hide_index=True, width='stretch')
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.write("**Pool de conexiones**")
+        st.json(get_pool_stats())
+    with col2:
+        st.write("**Cache de catálogos**")
+        st.json(get_cache_stats())
+    with col3:
+        st.write("**Catálogo en vivo**")
+        st.json(get_catalogo_stats())
+    with col4:
+        st.write("**Ventas recientes**")
+        st.json(get_ventas_recientes_stats())
+
+    st.subheader("📝 Sentencias preparadas")
+    preparadas = get_prepared_stats()
+    if not preparadas["activas"]:
+        st.info("Desactivadas (Transaction Pooler o SUPABASE_PREPARED_STATEMENTS=0): las queries se mandan como texto.")
+    elif preparadas["sentencias"]:
+        st.dataframe(pd.DataFrame(preparadas["sentencias"]), hide_index=True, width='stretch')
+
+    st.caption(f"Se loguean las queries que tardan más de {metricas.SLOW_QUERY_MS:.0f} ms (SLOW_QUERY_MS).")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("⬇️ JSON", metricas.snapshot_json(), file_name="metricas.json", mime="application/json")
+    with col2:
+        st.download_button("⬇️ Prometheus", metricas.snapshot_prometheus(), file_name="metricas.prom", mime="text/plain")
+    with col3:
+        if st.button("🧹 Reiniciar métricas"):
+            metricas.reset()
+            st.rerun()
+
+
 # --- Router ---
 if not st.session_state["logged_in"]:
     show_login()
 else:
+    mostrar_avisos()
     if st.session_state["view"] == "home":
         show_home()
     elif st.session_state["view"] == "ventas":
@@ -404,5 +719,7 @@ else:
         show_abm()
     elif st.session_state["view"] == "reportes":
         show_reportes()
+    elif st.session_state["view"] == "metricas" and st.session_state["role"] == "admin":
+        show_metricas()
     else:
         show_home()
\ No newline at end of file
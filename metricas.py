@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# =====================================
+# MÉTRICAS DE QUERIES
+# =====================================
+# Histogramas en memoria por query y por fase (conexión, execute, fetch,
+# armado del DataFrame, total). Registrar una medición es sumar en un bucket,
+# así que el costo en el camino caliente es mínimo.
+
+# Límites superiores de los buckets, en milisegundos
+BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+# Las queries que tardan más que esto (en ms) se loguean
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+
+class Histograma:
+    """
+    Histograma de latencias con buckets fijos.
+    """
+
+    def __init__(self):
+        self.conteos = [0] * len(BUCKETS_MS)
+        self.cantidad = 0
+        self.suma_ms = 0.0
+        self.maximo_ms = 0.0
+
+    def observar(self, ms):
+        i = 0
+        while ms > BUCKETS_MS[i]:
+            i += 1
+        self.conteos[i] += 1
+        self.cantidad += 1
+        self.suma_ms += ms
+        if ms > self.maximo_ms:
+            self.maximo_ms = ms
+
+    def percentil(self, p):
+        """
+        Estima el percentil `p` (0-100) interpolando dentro del bucket.
+        """
+        if self.cantidad == 0:
+            return 0.0
+        objetivo = self.cantidad * p / 100
+        acumulado = 0
+        for i, conteo in enumerate(self.conteos):
+            if conteo and acumulado + conteo >= objetivo:
+                inferior = BUCKETS_MS[i - 1] if i > 0 else 0.0
+                superior = min(BUCKETS_MS[i], self.maximo_ms)
+                fraccion = (objetivo - acumulado) / conteo
+                return inferior + (superior - inferior) * fraccion
+            acumulado += conteo
+        return self.maximo_ms
+
+
+_histogramas = {}  # (query, fase) -> Histograma
+_contadores = {}  # (query, contador) -> int
+_lock = threading.Lock()
+
+
+def observar(query, fase, segundos):
+    """
+    Registra la duración de una fase de una query.
+    """
+    ms = segundos * 1000
+    with _lock:
+        histograma = _histogramas.get((query, fase))
+        if histograma is None:
+            histograma = _histogramas[(query, fase)] = Histograma()
+        histograma.observar(ms)
+
+
+def contar(query, contador, cantidad=1):
+    """
+    Suma `cantidad` a un contador de la query (por ejemplo filas devueltas).
+    """
+    with _lock:
+        _contadores[(query, contador)] = _contadores.get((query, contador), 0) + cantidad
+
+
+def registrar_lenta(query, segundos, sql=None):
+    """
+    Loguea la query si superó el umbral SLOW_QUERY_MS.
+    """
+    ms = segundos * 1000
+    if ms >= SLOW_QUERY_MS:
+        texto = " ".join(sql.split())[:200] if sql else ""
+        print(f"⚠️ Query lenta [{query}] {ms:.1f} ms {texto}")
+
+
+@contextmanager
+def medir(query, fase):
+    """
+    Mide el bloque y lo registra como una fase de la query:
+
+        with medir("get_productos", "execute"):
+            cursor.execute(...)
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(query, fase, time.perf_counter() - inicio)
+
+
+def snapshot():
+    """
+    Devuelve una copia de todas las métricas como diccionario.
+    """
+    with _lock:
+        histogramas = [
+            {
+                "query": query,
+                "fase": fase,
+                "cantidad": h.cantidad,
+                "suma_ms": h.suma_ms,
+                "maximo_ms": h.maximo_ms,
+                "p50_ms": h.percentil(50),
+                "p95_ms": h.percentil(95),
+                "p99_ms": h.percentil(99),
+                "buckets": list(zip(BUCKETS_MS, h.conteos)),
+            }
+            for (query, fase), h in sorted(_histogramas.items())
+        ]
+        contadores = [
+            {"query": query, "contador": contador, "valor": valor}
+            for (query, contador), valor in sorted(_contadores.items())
+        ]
+    return {"histogramas": histogramas, "contadores": contadores}
+
+
+def snapshot_json():
+    """
+    Métricas en formato JSON.
+    """
+    datos = snapshot()
+    for h in datos["histogramas"]:
+        h["buckets"] = [["+Inf" if b == float("inf") else b, c] for b, c in h["buckets"]]
+    return json.dumps(datos, indent=2)
+
+
+def snapshot_prometheus():
+    """
+    Métricas en el formato de texto de Prometheus.
+    """
+    lineas = [
+        "# TYPE kiosco_query_duracion_ms histogram",
+    ]
+    datos = snapshot()
+    for h in datos["histogramas"]:
+        etiquetas = f'query="{h["query"]}",fase="{h["fase"]}"'
+        acumulado = 0
+        for limite, conteo in h["buckets"]:
+            acumulado += conteo
+            le = "+Inf" if limite == float("inf") else limite
+            lineas.append(f'kiosco_query_duracion_ms_bucket{{{etiquetas},le="{le}"}} {acumulado}')
+        lineas.append(f"kiosco_query_duracion_ms_sum{{{etiquetas}}} {h['suma_ms']}")
+        lineas.append(f"kiosco_query_duracion_ms_count{{{etiquetas}}} {h['cantidad']}")
+    lineas.append("# TYPE kiosco_query_total counter")
+    for c in datos["contadores"]:
+        lineas.append(f'kiosco_query_total{{query="{c["query"]}",contador="{c["contador"]}"}} {c["valor"]}')
+    return "\n".join(lineas) + "\n"
+
+
+def reset():
+    """
+    Borra todas las métricas acumuladas.
+    """
+    with _lock:
+        _histogramas.clear()
+        _contadores.clear()
@@ -0,0 +1,283 @@
+import json
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from functions import (
+    QUERY_DETALLE_POR_VENTA,
+    QUERY_USUARIO_POR_NOMBRE,
+    QUERY_VENTAS,
+    connect_to_supabase,
+    get_tiendas,
+    query_ventas_pagina,
+    release_connection,
+)
+
+# =====================================
+# MIGRACIONES DEL ESQUEMA
+# =====================================
+# Cada archivo de migraciones/ se llama NNNN_descripcion.sql y se aplica una
+# sola vez, en orden, dentro de su propia transacción. Las versiones aplicadas
+# quedan en schema_migrations. Un advisory lock evita que dos procesos (por
+# ejemplo dos réplicas de la app arrancando a la vez) apliquen la misma
+# migración. Se usa el lock de transacción, que funciona también a través del
+# pooler de Supabase en modo transacción.
+#
+# Uso desde la consola:
+#     python migraciones.py             aplica las migraciones pendientes
+#     python migraciones.py estado      lista aplicadas y pendientes
+#     python migraciones.py verificar   revisa con EXPLAIN que las queries usen índices
+#
+# Con varias tiendas (TIENDAS_CONFIG) la consola y MIGRAR_AL_INICIAR
+# recorren la base de cada una.
+
+MIGRACIONES_DIR = Path(__file__).parent / "migraciones"
+# Si está activo, la app aplica las migraciones pendientes al arrancar
+MIGRAR_AL_INICIAR = os.getenv("MIGRAR_AL_INICIAR", "0") == "1"
+
+# Clave arbitraria del advisory lock de migraciones
+_LOCK_MIGRACIONES = 72510418
+
+_lock = threading.Lock()
+_migrado = False
+_pendientes = None
+
+
+def listar_migraciones():
+    """
+    Devuelve [(versión, nombre, ruta)] de los archivos de migraciones/, en orden.
+    """
+    migraciones = []
+    for ruta in sorted(MIGRACIONES_DIR.glob("*.sql")):
+        coincidencia = re.match(r"(\d+)_(.+)\.sql$", ruta.name)
+        if coincidencia:
+            migraciones.append((int(coincidencia.group(1)), coincidencia.group(2), ruta))
+    return migraciones
+
+
+def _preparar(cursor):
+    """
+    Toma el lock de migraciones y crea schema_migrations si no existe.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_MIGRACIONES,))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version integer PRIMARY KEY,
+            nombre text NOT NULL,
+            aplicada timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def versiones_aplicadas(tienda=None):
+    """
+    Devuelve el conjunto de versiones ya aplicadas en la base.
+    """
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return None
+    try:
+        aplicadas = _preparar(conn.cursor())
+        conn.commit()
+        return aplicadas
+    finally:
+        release_connection(conn, tienda)
+
+
+def aplicar_migraciones(tienda=None):
+    """
+    Aplica en orden las migraciones pendientes. Cada una corre en su propia
+    transacción junto con su registro en schema_migrations, así que si falla
+    no queda aplicada a medias y las anteriores siguen valiendo.
+    Retorna la lista de versiones aplicadas ahora, o None si no hay conexión.
+    """
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return None
+    aplicadas_ahora = []
+    try:
+        cursor = conn.cursor()
+        for version, nombre, ruta in listar_migraciones():
+            # El lock se vuelve a tomar en cada transacción y se relee lo
+            # aplicado, por si otro proceso avanzó mientras tanto.
+            if version in _preparar(cursor):
+                conn.commit()
+                continue
+            try:
+                cursor.execute(ruta.read_text(encoding="utf-8"))
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, nombre) VALUES (%s, %s)",
+                    (version, nombre),
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Error aplicando la migración {ruta.name}: {e}")
+                raise
+            print(f"Migración aplicada: {ruta.name}")
+            aplicadas_ahora.append(version)
+        return aplicadas_ahora
+    finally:
+        release_connection(conn, tienda)
+
+
+def migrar_al_iniciar():
+    """
+    Aplica las migraciones pendientes una sola vez por proceso si
+    MIGRAR_AL_INICIAR=1. Se llama desde main.py en cada ejecución del script.
+    """
+    global _migrado
+    if not MIGRAR_AL_INICIAR:
+        return
+    with _lock:
+        if not _migrado:
+            for tienda in list(get_tiendas()) or [None]:
+                aplicar_migraciones(tienda)
+            _migrado = True
+
+
+def migraciones_pendientes_al_iniciar():
+    """
+    Revisa una sola vez por proceso que cada tienda tenga todas las
+    migraciones aplicadas: el código (por ejemplo el checkout sobre las
+    tablas particionadas de 0006) no funciona con un esquema anterior.
+    Retorna una lista de textos "tienda: versiones faltantes", vacía si está
+    todo al día. Una tienda sin conexión no se cuenta como pendiente.
+    """
+    global _pendientes
+    with _lock:
+        if _pendientes is None:
+            versiones = [version for version, _, _ in listar_migraciones()]
+            pendientes = []
+            for tienda in list(get_tiendas()) or [None]:
+                try:
+                    aplicadas = versiones_aplicadas(tienda)
+                except Exception as e:
+                    print(f"Error revisando las migraciones: {e}")
+                    continue
+                if aplicadas is None:
+                    continue
+                faltan = [f"{version:04d}" for version in versiones if version not in aplicadas]
+                if faltan:
+                    pendientes.append(f"{'base' if tienda is None else f'tienda {tienda}'}: {', '.join(faltan)}")
+            _pendientes = pendientes
+        return _pendientes
+
+
+# ---- Verificación de índices ----
+# Las queries frecuentes de functions.py y el índice que debería resolverlas.
+# Se revisa el plan con enable_seqscan desactivado: así se comprueba que el
+# índice sirve para la query aunque la base de prueba tenga pocas filas y el
+# planificador prefiera un seq scan.
+def _consulta_ventas_pagina(nombre, indice, **filtros):
+    query, params = query_ventas_pagina(**filtros)
+    return (nombre, query, (*params, 21), indice)
+
+
+# Mismas queries que usan los helpers de functions.py, con parámetros de ejemplo
+CONSULTAS_VERIFICADAS = [
+    ("get_usuario_by_credentials", QUERY_USUARIO_POR_NOMBRE, ("admin",), "idx_usuarios_usuario"),
+    ("get_ventas", QUERY_VENTAS.format(where=""), (20,), "idx_ventas_fecha_id"),
+    _consulta_ventas_pagina(
+        "get_ventas_pagina",
+        "idx_ventas_fecha_id",
+        posicion=(datetime(2100, 1, 1, tzinfo=timezone.utc), 2147483647),
+    ),
+    _consulta_ventas_pagina("get_ventas_pagina (empleado)", "idx_ventas_empleado_fecha_id", empleado_id=1),
+    ("get_detalle_por_venta", QUERY_DETALLE_POR_VENTA, (1,), "idx_venta_detalle_venta_id"),
+    (
+        "productos por nombre",
+        "SELECT id, nombre, cantidad, precio FROM productos WHERE nombre = %s",
+        ("Alfajor",),
+        "idx_productos_nombre",
+    ),
+]
+
+
+def _indices_usados(plan):
+    """
+    Recorre un plan de EXPLAIN (FORMAT JSON) y devuelve los índices escaneados.
+    """
+    indices = set()
+    if plan.get("Node Type") in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+        indices.add(plan.get("Index Name"))
+    for hijo in plan.get("Plans", []):
+        indices |= _indices_usados(hijo)
+    return indices
+
+
+def verificar_indices(tienda=None):
+    """
+    Corre EXPLAIN sobre cada query de CONSULTAS_VERIFICADAS y comprueba que
+    use el índice esperado. En las tablas particionadas el plan nombra el
+    índice de cada partición, que se traduce al índice de la tabla padre.
+    Retorna [(nombre, índice esperado, índices usados, ok)].
+    """
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return None
+    resultados = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for nombre, query, params, indice in CONSULTAS_VERIFICADAS:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            usados = set()
+            for indice_usado in _indices_usados(plan[0]["Plan"]):
+                cursor.execute("SELECT pg_partition_root(%s::regclass)::text", (indice_usado,))
+                usados.add(cursor.fetchone()[0] or indice_usado)
+            resultados.append((nombre, indice, sorted(usados), indice in usados))
+        return resultados
+    finally:
+        conn.rollback()
+        release_connection(conn, tienda)
+
+
+def _main(argumentos):
+    comando = argumentos[0] if argumentos else "aplicar"
+    if comando not in ("aplicar", "estado", "verificar"):
+        print(f"Comando desconocido: {comando} (usar aplicar, estado o verificar)")
+        return 2
+    salida = 0
+    for tienda in list(get_tiendas()) or [None]:
+        if tienda is not None:
+            print(f"== Tienda {tienda} ==")
+        if comando == "aplicar":
+            aplicadas = aplicar_migraciones(tienda)
+            if aplicadas is None:
+                print("Error de conexión a la base de datos")
+                salida = 1
+                continue
+            print(f"Migraciones aplicadas: {len(aplicadas)}")
+        elif comando == "estado":
+            aplicadas = versiones_aplicadas(tienda)
+            if aplicadas is None:
+                print("Error de conexión a la base de datos")
+                salida = 1
+                continue
+            for version, nombre, _ in listar_migraciones():
+                marca = "✅" if version in aplicadas else "⏳"
+                print(f"{marca} {version:04d} {nombre}")
+        else:
+            resultados = verificar_indices(tienda)
+            if resultados is None:
+                print("Error de conexión a la base de datos")
+                salida = 1
+                continue
+            for nombre, indice, usados, ok in resultados:
+                marca = "✅" if ok else "❌"
+                print(f"{marca} {nombre}: esperado {indice}, usados {', '.join(usados) or 'ninguno'}")
+            if not all(ok for *_, ok in resultados):
+                salida = 1
+    return salida
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
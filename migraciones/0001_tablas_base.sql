@@ -0,0 +1,38 @@
+-- Tablas base del kiosco. En una base donde ya existen (por ejemplo creadas
+-- a mano desde el SQL Editor de Supabase) esta migración no cambia nada.
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id serial PRIMARY KEY,
+    usuario text NOT NULL,
+    contraseña text NOT NULL,
+    tipo_usuario text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS proveedores (
+    id serial PRIMARY KEY,
+    nombre text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS productos (
+    id serial PRIMARY KEY,
+    nombre text NOT NULL,
+    proveedor_id integer REFERENCES proveedores (id),
+    cantidad integer NOT NULL DEFAULT 0,
+    precio numeric(10, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ventas (
+    id serial PRIMARY KEY,
+    fecha timestamptz NOT NULL DEFAULT now(),
+    empleado_id integer NOT NULL REFERENCES usuarios (id),
+    descuento numeric(5, 4) NOT NULL DEFAULT 0,
+    total numeric(12, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS venta_detalle (
+    id serial PRIMARY KEY,
+    venta_id integer NOT NULL REFERENCES ventas (id),
+    producto_id integer NOT NULL REFERENCES productos (id),
+    cantidad integer NOT NULL,
+    subtotal numeric(12, 2) NOT NULL
+);
@@ -0,0 +1,39 @@
+-- Índices que usan las queries frecuentes y restricciones de integridad.
+
+-- Las contraseñas se guardan hasheadas ("pbkdf2_sha256$iteraciones$salt$hash"),
+-- que no entran en una columna de largo fijo chico.
+ALTER TABLE usuarios ALTER COLUMN contraseña TYPE text;
+
+-- El login busca al usuario solo por nombre y verifica la contraseña en Python
+-- (get_usuario_by_credentials), así que la búsqueda tiene que usar un índice.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_usuarios_usuario
+    ON usuarios (usuario);
+
+-- Paginación por keyset de ventas (get_ventas, get_ventas_pagina): cada página
+-- se resuelve recorriendo el índice desde el cursor, sin OFFSET.
+CREATE INDEX IF NOT EXISTS idx_ventas_fecha_id
+    ON ventas (fecha DESC, id DESC);
+
+-- Listado filtrado por empleado
+CREATE INDEX IF NOT EXISTS idx_ventas_empleado_fecha_id
+    ON ventas (empleado_id, fecha DESC, id DESC);
+
+-- Detalle de uno o varios tickets (get_detalle_por_venta, get_ventas_completas)
+CREATE INDEX IF NOT EXISTS idx_venta_detalle_venta_id
+    ON venta_detalle (venta_id);
+
+-- Búsqueda y carga masiva de productos por nombre
+CREATE INDEX IF NOT EXISTS idx_productos_nombre
+    ON productos (nombre);
+
+-- El checkout ya descuenta stock de forma condicional; esto es el respaldo
+-- por si alguna otra escritura intenta dejarlo negativo.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'productos_cantidad_no_negativa'
+    ) THEN
+        ALTER TABLE productos
+            ADD CONSTRAINT productos_cantidad_no_negativa CHECK (cantidad >= 0);
+    END IF;
+END $$;
@@ -0,0 +1,23 @@
+-- Tablas de resumen para los reportes (reportes.py).
+-- Son opcionales: se usan cuando REPORTES_USAR_RESUMENES=1 y se actualizan de
+-- forma incremental dentro de la misma transacción de cada venta.
+-- Para cargarlas con el historial existente usar reportes.reconstruir_resumenes().
+
+-- Totales por día y empleado
+CREATE TABLE IF NOT EXISTS resumen_ventas_diario (
+    dia date NOT NULL,
+    empleado_id integer NOT NULL REFERENCES usuarios (id),
+    cantidad_ventas integer NOT NULL DEFAULT 0,
+    total numeric NOT NULL DEFAULT 0,
+    total_descuento numeric NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, empleado_id)
+);
+
+-- Unidades e ingresos por día y producto
+CREATE TABLE IF NOT EXISTS resumen_productos_diario (
+    dia date NOT NULL,
+    producto_id integer NOT NULL REFERENCES productos (id),
+    unidades integer NOT NULL DEFAULT 0,
+    ingresos numeric NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, producto_id)
+);
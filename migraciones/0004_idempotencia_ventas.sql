@@ -0,0 +1,8 @@
+-- Claves de idempotencia de las ventas. La cola offline (cola_ventas.py)
+-- reintenta cada venta con la misma clave; la clave primaria garantiza que
+-- una venta reintentada no se grabe dos veces.
+CREATE TABLE IF NOT EXISTS ventas_idempotencia (
+    clave text PRIMARY KEY,
+    venta_id integer NOT NULL REFERENCES ventas (id),
+    creada timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,46 @@
+-- Publica cada cambio de productos en el canal productos_cambios con
+-- pg_notify. Cada proceso de la app escucha el canal (catalogo.py) y aplica
+-- el cambio a su catálogo en memoria, sin volver a leer la tabla.
+-- El mensaje lleva la fila completa, así que aplicarlo dos veces no cambia nada.
+
+CREATE OR REPLACE FUNCTION notificar_cambio_producto() RETURNS trigger AS $$
+DECLARE
+    fila productos%ROWTYPE;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('productos_cambios', json_build_object('op', TG_OP)::text);
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        fila := OLD;
+    ELSE
+        fila := NEW;
+    END IF;
+    PERFORM pg_notify('productos_cambios', json_build_object(
+        'op', TG_OP,
+        'id', fila.id,
+        'nombre', fila.nombre,
+        'cantidad', fila.cantidad,
+        'precio', fila.precio
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS productos_notificar ON productos;
+CREATE TRIGGER productos_notificar
+    AFTER INSERT OR DELETE ON productos
+    FOR EACH ROW EXECUTE FUNCTION notificar_cambio_producto();
+
+-- Solo se notifican los UPDATE que cambian algo
+DROP TRIGGER IF EXISTS productos_notificar_update ON productos;
+CREATE TRIGGER productos_notificar_update
+    AFTER UPDATE ON productos
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION notificar_cambio_producto();
+
+DROP TRIGGER IF EXISTS productos_notificar_truncate ON productos;
+CREATE TRIGGER productos_notificar_truncate
+    AFTER TRUNCATE ON productos
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_producto();
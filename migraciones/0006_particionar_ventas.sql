@@ -0,0 +1,158 @@
+-- Particiona ventas y venta_detalle por mes (rango sobre fecha).
+--
+-- Las queries que filtran por fecha (reportes, paginación, exportación) solo
+-- recorren los meses pedidos, y los meses viejos se pueden archivar y sacar
+-- de la base sin DELETE masivos (ver particiones.py).
+--
+-- En una tabla particionada la clave primaria tiene que incluir la columna de
+-- partición, así que pasa a ser (id, fecha). venta_detalle lleva la fecha de
+-- su venta: se particiona igual que ventas y la referencia con (venta_id, fecha).
+-- Los ids siguen saliendo de una secuencia, así que siguen siendo únicos.
+--
+-- Los límites de cada mes se calculan en UTC.
+--
+-- La migración copia todo el historial en una sola transacción y bloquea
+-- las dos tablas mientras tanto: conviene correrla fuera del horario de venta.
+
+-- Crea las particiones mensuales de ventas y venta_detalle que falten entre
+-- los meses de `desde` y `hasta` (inclusive). Devuelve cuántos meses creó.
+CREATE OR REPLACE FUNCTION crear_particiones_ventas(desde timestamptz, hasta timestamptz)
+RETURNS integer AS $$
+DECLARE
+    mes timestamp := date_trunc('month', desde AT TIME ZONE 'UTC');
+    sufijo text;
+    creadas integer := 0;
+BEGIN
+    -- Dos procesos creando la misma partición a la vez chocarían
+    PERFORM pg_advisory_xact_lock(72510419);
+    WHILE mes <= hasta AT TIME ZONE 'UTC' LOOP
+        sufijo := to_char(mes, 'YYYY_MM');
+        IF to_regclass('ventas_' || sufijo) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF ventas FOR VALUES FROM (%L) TO (%L)',
+                'ventas_' || sufijo, mes AT TIME ZONE 'UTC', (mes + interval '1 month') AT TIME ZONE 'UTC'
+            );
+            creadas := creadas + 1;
+        END IF;
+        IF to_regclass('venta_detalle_' || sufijo) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF venta_detalle FOR VALUES FROM (%L) TO (%L)',
+                'venta_detalle_' || sufijo, mes AT TIME ZONE 'UTC', (mes + interval '1 month') AT TIME ZONE 'UTC'
+            );
+        END IF;
+        mes := mes + interval '1 month';
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tabla text;
+    secuencia text;
+    restriccion record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'ventas'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    -- Las tablas actuales quedan con otro nombre hasta copiar sus filas. Se les
+    -- sacan la secuencia, las restricciones y los índices para que las tablas
+    -- nuevas puedan usar los mismos nombres.
+    FOREACH tabla IN ARRAY ARRAY['ventas', 'venta_detalle'] LOOP
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', tabla, tabla || '_sin_particionar');
+        tabla := tabla || '_sin_particionar';
+        secuencia := pg_get_serial_sequence(tabla, 'id');
+        IF EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = tabla::regclass AND attname = 'id' AND attidentity <> ''
+        ) THEN
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN id DROP IDENTITY', tabla);
+        ELSE
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN id DROP DEFAULT', tabla);
+            IF secuencia IS NOT NULL THEN
+                EXECUTE format('DROP SEQUENCE %s', secuencia);
+            END IF;
+        END IF;
+    END LOOP;
+
+    -- Al borrar las claves primarias se borran también las claves foráneas que
+    -- las referencian (incluida la de ventas_idempotencia)
+    FOR restriccion IN
+        SELECT conrelid::regclass AS tabla, conname
+        FROM pg_constraint
+        WHERE conrelid IN ('ventas_sin_particionar'::regclass, 'venta_detalle_sin_particionar'::regclass)
+          AND contype IN ('p', 'f', 'u')
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %I CASCADE', restriccion.tabla, restriccion.conname);
+    END LOOP;
+    DROP INDEX IF EXISTS idx_ventas_fecha_id, idx_ventas_empleado_fecha_id, idx_venta_detalle_venta_id;
+
+    CREATE TABLE ventas (
+        id serial,
+        fecha timestamptz NOT NULL DEFAULT now(),
+        empleado_id integer NOT NULL REFERENCES usuarios (id),
+        descuento numeric(5, 4) NOT NULL DEFAULT 0,
+        total numeric(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (id, fecha)
+    ) PARTITION BY RANGE (fecha);
+
+    CREATE TABLE venta_detalle (
+        id serial,
+        venta_id integer NOT NULL,
+        fecha timestamptz NOT NULL,
+        producto_id integer NOT NULL REFERENCES productos (id),
+        cantidad integer NOT NULL,
+        subtotal numeric(12, 2) NOT NULL,
+        PRIMARY KEY (id, fecha),
+        FOREIGN KEY (venta_id, fecha) REFERENCES ventas (id, fecha)
+    ) PARTITION BY RANGE (fecha);
+
+    -- Todos los meses con ventas y los próximos tres
+    PERFORM crear_particiones_ventas(
+        COALESCE((SELECT min(fecha) FROM ventas_sin_particionar), now()),
+        now() + interval '3 months'
+    );
+
+    INSERT INTO ventas (id, fecha, empleado_id, descuento, total)
+    SELECT id, fecha, empleado_id, descuento, total
+    FROM ventas_sin_particionar;
+
+    INSERT INTO venta_detalle (id, venta_id, fecha, producto_id, cantidad, subtotal)
+    SELECT vd.id, vd.venta_id, v.fecha, vd.producto_id, vd.cantidad, vd.subtotal
+    FROM venta_detalle_sin_particionar vd
+    JOIN ventas_sin_particionar v ON v.id = vd.venta_id;
+
+    PERFORM setval(pg_get_serial_sequence('ventas', 'id'), COALESCE((SELECT max(id) FROM ventas), 0) + 1, false);
+    PERFORM setval(pg_get_serial_sequence('venta_detalle', 'id'), COALESCE((SELECT max(id) FROM venta_detalle), 0) + 1, false);
+
+    -- Las claves de idempotencia referencian la venta con su fecha
+    ALTER TABLE ventas_idempotencia ADD COLUMN venta_fecha timestamptz;
+    UPDATE ventas_idempotencia vi
+    SET venta_fecha = v.fecha
+    FROM ventas_sin_particionar v
+    WHERE v.id = vi.venta_id;
+    DELETE FROM ventas_idempotencia WHERE venta_fecha IS NULL;
+    ALTER TABLE ventas_idempotencia
+        ALTER COLUMN venta_fecha SET NOT NULL,
+        ADD FOREIGN KEY (venta_id, venta_fecha) REFERENCES ventas (id, fecha);
+
+    DROP TABLE venta_detalle_sin_particionar, ventas_sin_particionar;
+END $$;
+
+-- Los mismos índices de 0002, creados en la tabla particionada: cada
+-- partición tiene el suyo y las consultas ordenadas por fecha recorren las
+-- particiones en orden, cortando apenas llegan al LIMIT.
+CREATE INDEX IF NOT EXISTS idx_ventas_fecha_id
+    ON ventas (fecha DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_ventas_empleado_fecha_id
+    ON ventas (empleado_id, fecha DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_venta_detalle_venta_id
+    ON venta_detalle (venta_id);
+
+-- El autovacuum analiza cada partición pero nunca la tabla particionada:
+-- sin estas estadísticas el planificador estima mal los joins sobre ventas.
+ANALYZE ventas;
+ANALYZE venta_detalle;
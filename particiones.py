@@ -0,0 +1,444 @@
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from functions import _clave_tienda, connect_to_supabase, execute_query, get_tiendas, release_connection
+
+# =====================================
+# PARTICIONES Y ARCHIVO DE VENTAS
+# =====================================
+# ventas y venta_detalle están particionadas por mes (ver
+# migraciones/0006_particionar_ventas.sql). Acá se crean por adelantado las
+# particiones de los próximos meses y se archivan los meses viejos: cada mes
+# se separa de la tabla, se exporta a Parquet comprimido y se borra de la base,
+# así las tablas conservan solo el historial reciente.
+#
+# Las tablas de resumen de reportes (REPORTES_USAR_RESUMENES=1) no se tocan:
+# los reportes siguen incluyendo los meses archivados.
+#
+# Con varias tiendas (TIENDAS_CONFIG) cada una archiva en su subcarpeta de
+# ARCHIVO_VENTAS_DIR, y la consola y el hilo de mantenimiento recorren todas.
+#
+# Uso desde la consola (por ejemplo desde cron):
+#     python particiones.py             crea las particiones que falten
+#     python particiones.py archivar    archiva los meses más viejos que ARCHIVO_VENTAS_MESES
+#     python particiones.py estado      lista las particiones y los meses archivados
+
+# Meses a futuro que se dejan creados
+PARTICIONES_ADELANTE = int(os.getenv("PARTICIONES_ADELANTE", "3"))
+# Cada cuántos segundos el hilo de mantenimiento revisa las particiones
+PARTICIONES_INTERVALO = float(os.getenv("PARTICIONES_INTERVALO", "86400"))
+# Meses que se conservan en la base (el actual incluido); los anteriores se archivan
+ARCHIVO_MESES = int(os.getenv("ARCHIVO_VENTAS_MESES", "24"))
+ARCHIVO_DIR = Path(os.getenv("ARCHIVO_VENTAS_DIR", "archivo_ventas"))
+# Si está activo, el hilo de mantenimiento también archiva
+ARCHIVO_AUTOMATICO = os.getenv("ARCHIVO_VENTAS_AUTOMATICO", "0") == "1"
+ARCHIVO_COMPRESION = os.getenv("ARCHIVO_VENTAS_COMPRESION", "zstd")
+# Filas que se leen por vez al exportar un mes
+ARCHIVO_LOTE = int(os.getenv("ARCHIVO_VENTAS_LOTE", "50000"))
+# Sacar la clave foránea del detalle separado necesita un lock sobre ventas
+# que frena a las cajas: se pide con este lock_timeout y se reintenta
+ARCHIVO_LOCK_TIMEOUT_MS = 100
+ARCHIVO_LOCK_INTENTOS = 60
+
+# Columnas de cada tabla con su tipo en Parquet (el mismo en todos los lotes)
+ESQUEMAS = {
+    "ventas": pa.schema([
+        ("id", pa.int32()),
+        ("fecha", pa.timestamp("us", tz="UTC")),
+        ("empleado_id", pa.int32()),
+        ("descuento", pa.decimal128(5, 4)),
+        ("total", pa.decimal128(12, 2)),
+    ]),
+    "venta_detalle": pa.schema([
+        ("id", pa.int32()),
+        ("venta_id", pa.int32()),
+        ("fecha", pa.timestamp("us", tz="UTC")),
+        ("producto_id", pa.int32()),
+        ("cantidad", pa.int32()),
+        ("subtotal", pa.decimal128(12, 2)),
+    ]),
+}
+
+_lock = threading.Lock()
+_worker = None
+
+
+def crear_particiones(meses=None, tienda=None):
+    """
+    Crea las particiones que falten desde el mes actual hasta `meses` meses
+    adelante. Retorna cuántos meses se crearon, o None si no hay conexión.
+    """
+    meses = PARTICIONES_ADELANTE if meses is None else meses
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT crear_particiones_ventas(now(), now() + make_interval(months => %s))",
+            (int(meses),),
+        )
+        creadas = cursor.fetchone()[0]
+        conn.commit()
+        return creadas
+    except Exception as e:
+        print(f"Error creando particiones: {e}")
+        conn.rollback()
+        return None
+    finally:
+        release_connection(conn, tienda)
+
+
+def analizar(tienda=None):
+    """
+    Actualiza las estadísticas de ventas y venta_detalle. El autovacuum
+    analiza cada partición pero nunca las tablas particionadas.
+    """
+    return execute_query("ANALYZE ventas, venta_detalle", is_select=False, nombre="analizar_particiones", tienda=tienda)
+
+
+def listar_particiones(tienda=None):
+    """
+    Devuelve las particiones de ventas con su mes y las filas estimadas.
+    """
+    df = execute_query(
+        """
+        SELECT c.relname AS particion, GREATEST(c.reltuples, 0)::bigint AS filas_estimadas
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'ventas'::regclass
+        ORDER BY c.relname
+        """,
+        is_select=True,
+        nombre="listar_particiones",
+        tienda=tienda,
+    )
+    if len(df.columns) > 0:
+        df.insert(1, "mes", df["particion"].str.extract(r"(\d{4}_\d{2})$")[0])
+    return df
+
+
+def _carpeta(destino, tienda):
+    """
+    Carpeta de archivo de una tienda: `destino` si se pasa, si no
+    ARCHIVO_VENTAS_DIR (con una subcarpeta por tienda si hay varias).
+    """
+    if destino:
+        return Path(destino)
+    clave = _clave_tienda(tienda)
+    return ARCHIVO_DIR if clave is None else ARCHIVO_DIR / clave
+
+
+def _tiendas():
+    return list(get_tiendas()) or [None]
+
+
+def _mes_limite(meses_a_conservar):
+    """
+    Primer mes (como "AAAA_MM") que se conserva: los anteriores se archivan.
+    """
+    hoy = pd.Timestamp.now(tz="UTC")
+    return (pd.Period(hoy.strftime("%Y-%m"), freq="M") - (meses_a_conservar - 1)).strftime("%Y_%m")
+
+
+def _exportar_particion(conn, tabla, ruta):
+    """
+    Escribe una partición en Parquet leyendo de a ARCHIVO_LOTE filas con un
+    cursor del servidor, así la memoria no depende del tamaño del mes.
+    Retorna la cantidad de filas escritas.
+    """
+    esquema = ESQUEMAS[re.sub(r"_\d{4}_\d{2}$", "", tabla)]
+    columnas = ", ".join(esquema.names)
+    cursor = conn.cursor(name=f"archivo_{tabla}")
+    cursor.itersize = ARCHIVO_LOTE
+    cursor.execute(f"SELECT {columnas} FROM {tabla} ORDER BY id")
+    filas = 0
+    with pq.ParquetWriter(ruta, esquema, compression=ARCHIVO_COMPRESION) as writer:
+        while True:
+            lote = cursor.fetchmany(ARCHIVO_LOTE)
+            if not lote:
+                break
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*lote), esquema)],
+                schema=esquema,
+            ))
+            filas += len(lote)
+    cursor.close()
+    # El archivo tiene que estar en disco antes de borrar el mes de la base
+    with open(ruta, "rb") as archivo:
+        os.fsync(archivo.fileno())
+    return filas
+
+
+def _estado_particion(cursor, tabla):
+    """
+    Estado de la partición de un mes: None si la tabla no existe, "adjunta",
+    "pendiente" (un DETACH CONCURRENTLY que se cortó a la mitad) o "separada".
+    """
+    cursor.execute("""
+        SELECT i.inhdetachpending
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.oid = to_regclass(%s)
+    """, (tabla,))
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    if fila[0] is None:
+        return "separada"
+    return "pendiente" if fila[0] else "adjunta"
+
+
+def _separar(cursor, padre, tabla):
+    """
+    Saca la partición de la tabla padre con DETACH ... CONCURRENTLY: solo
+    toma SHARE UPDATE EXCLUSIVE sobre el padre, así las ventas siguen
+    entrando mientras tanto. Necesita autocommit (no corre en transacción).
+    """
+    estado = _estado_particion(cursor, tabla)
+    if estado == "adjunta":
+        cursor.execute(f"ALTER TABLE {padre} DETACH PARTITION {tabla} CONCURRENTLY")
+    elif estado == "pendiente":
+        cursor.execute(f"ALTER TABLE {padre} DETACH PARTITION {tabla} FINALIZE")
+
+
+def _ddl_breve(cursor, sql):
+    """
+    Corre un DDL que necesita un lock sobre ventas pidiéndolo con un
+    lock_timeout corto y reintentando: mientras espera en la fila de locks
+    frena a los INSERT del checkout, así que nunca espera más que eso.
+    """
+    cursor.execute(f"SET lock_timeout = '{ARCHIVO_LOCK_TIMEOUT_MS}ms'")
+    try:
+        for intento in range(ARCHIVO_LOCK_INTENTOS):
+            try:
+                cursor.execute(sql)
+                return
+            except psycopg2.errors.LockNotAvailable:
+                if intento == ARCHIVO_LOCK_INTENTOS - 1:
+                    raise
+                time.sleep(1)
+    finally:
+        cursor.execute("SET lock_timeout = '5s'")
+
+
+def archivar_mes(mes, destino=None, tienda=None):
+    """
+    Archiva un mes ("AAAA_MM"): separa sus particiones de ventas y
+    venta_detalle, las exporta a Parquet y recién entonces las borra.
+
+    Las particiones se separan con DETACH ... CONCURRENTLY, que no frena a
+    las cajas, y la exportación lee tablas que ya nadie escribe, sin tener
+    locks tomados mientras se escriben los archivos. Si algo falla el mes
+    queda separado pero en la base, y archivar_particiones lo retoma.
+    Retorna (True, {tabla: filas}) o (False, mensaje de error).
+    """
+    if not re.fullmatch(r"\d{4}_\d{2}", mes):
+        return False, f"Mes inválido: {mes}"
+    destino = _carpeta(destino, tienda)
+    destino.mkdir(parents=True, exist_ok=True)
+    ventas, detalle = f"ventas_{mes}", f"venta_detalle_{mes}"
+
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return False, "Error de conexión a la base de datos"
+    temporales = []
+    try:
+        conn.rollback()
+        conn.autocommit = True
+        cursor = conn.cursor()
+        if _estado_particion(cursor, ventas) is None:
+            return False, f"No hay particiones del mes {mes}"
+        # Si otra sesión tiene un lock fuerte sobre las tablas se aborta y se
+        # reintenta otro día, en vez de quedar en la fila de locks
+        cursor.execute("SET lock_timeout = '5s'")
+
+        # Primero el detalle, que referencia a las ventas del mes. Una vez
+        # separado se le saca esa clave foránea, igual que las claves de
+        # idempotencia del mes, para poder separar las ventas.
+        _separar(cursor, "venta_detalle", detalle)
+        if _estado_particion(cursor, detalle) is not None:
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f' AND confrelid = 'ventas'::regclass",
+                (detalle,),
+            )
+            for (restriccion,) in cursor.fetchall():
+                _ddl_breve(cursor, f'ALTER TABLE {detalle} DROP CONSTRAINT "{restriccion}"')
+        cursor.execute("""
+            DELETE FROM ventas_idempotencia
+            WHERE venta_fecha >= %s::timestamp AT TIME ZONE 'UTC'
+              AND venta_fecha < (%s::timestamp + interval '1 month') AT TIME ZONE 'UTC'
+        """, (f"{mes.replace('_', '-')}-01",) * 2)
+        _separar(cursor, "ventas", ventas)
+        cursor.execute("RESET lock_timeout")
+        conn.autocommit = False
+
+        filas = {}
+        for tabla in (ventas, detalle):
+            if _estado_particion(cursor, tabla) is None:
+                continue
+            temporal = destino / f"{tabla}.parquet.tmp"
+            temporales.append(temporal)
+            filas[tabla] = _exportar_particion(conn, tabla, temporal)
+        conn.rollback()
+
+        # Los archivos quedan con su nombre definitivo antes de borrar. Si
+        # fallara el DROP, el mes se vuelve a archivar y se pisan los archivos.
+        for temporal in temporales:
+            os.replace(temporal, temporal.with_suffix(""))
+        cursor.execute(f"DROP TABLE IF EXISTS {detalle}, {ventas}")
+        conn.commit()
+        return True, filas
+    except Exception as e:
+        print(f"Error archivando {mes}: {e}")
+        if not conn.autocommit:
+            conn.rollback()
+        for temporal in temporales:
+            temporal.unlink(missing_ok=True)
+        return False, str(e)
+    finally:
+        if conn.autocommit:
+            conn.autocommit = False
+        release_connection(conn, tienda)
+
+
+def _meses_separados(tienda=None):
+    """
+    Meses cuyas particiones quedaron separadas pero sin borrar porque un
+    archivo anterior se cortó.
+    """
+    df = execute_query(
+        r"""
+        SELECT DISTINCT substring(c.relname FROM '(\d{4}_\d{2})$') AS mes
+        FROM pg_class c
+        WHERE c.relkind = 'r'
+          AND c.relname ~ '^(ventas|venta_detalle)_\d{4}_\d{2}$'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+        """,
+        is_select=True,
+        nombre="meses_separados",
+        tienda=tienda,
+    )
+    return [] if len(df.columns) == 0 else df["mes"].tolist()
+
+
+def archivar_particiones(meses_a_conservar=None, destino=None, tienda=None):
+    """
+    Archiva todos los meses anteriores a los últimos `meses_a_conservar`,
+    incluidos los que quedaron separados por un archivo que se cortó.
+    Retorna {mes: resultado de archivar_mes}.
+    """
+    limite = _mes_limite(ARCHIVO_MESES if meses_a_conservar is None else meses_a_conservar)
+    particiones = listar_particiones(tienda)
+    if len(particiones.columns) == 0:
+        return {}
+    meses = set(particiones["mes"].dropna()) | set(_meses_separados(tienda))
+    resultados = {}
+    for mes in sorted(meses):
+        if mes < limite:
+            resultados[mes] = archivar_mes(mes, destino, tienda)
+    return resultados
+
+
+def leer_mes_archivado(mes, destino=None, tienda=None):
+    """
+    Lee un mes archivado. Retorna (DataFrame de ventas, DataFrame de detalle).
+    """
+    destino = _carpeta(destino, tienda)
+    return (
+        pd.read_parquet(destino / f"ventas_{mes}.parquet"),
+        pd.read_parquet(destino / f"venta_detalle_{mes}.parquet"),
+    )
+
+
+def meses_archivados(destino=None, tienda=None):
+    """
+    Lista los meses ("AAAA_MM") que tienen archivo en disco.
+    """
+    destino = _carpeta(destino, tienda)
+    return sorted(
+        coincidencia.group(1)
+        for ruta in destino.glob("ventas_*.parquet")
+        if (coincidencia := re.match(r"ventas_(\d{4}_\d{2})\.parquet$", ruta.name))
+    )
+
+
+def _loop_mantenimiento():
+    while True:
+        for tienda in _tiendas():
+            try:
+                if crear_particiones(tienda=tienda) is None:
+                    print(
+                        f"ATENCIÓN: no se pudieron crear las particiones de ventas (tienda {tienda}). "
+                        "Si no se resuelve, el checkout las crea al vuelo cuando empiece el mes."
+                    )
+                if ARCHIVO_AUTOMATICO:
+                    archivar_particiones(tienda=tienda)
+                analizar(tienda)
+            except Exception as e:
+                print(f"Error en el mantenimiento de particiones: {e}")
+        time.sleep(PARTICIONES_INTERVALO)
+
+
+def iniciar_mantenimiento():
+    """
+    Arranca el hilo que mantiene creadas las particiones de los próximos
+    meses en todas las tiendas (uno solo por proceso). Se llama desde main.py
+    en cada ejecución.
+    """
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_loop_mantenimiento, name="particiones", daemon=True)
+            _worker.start()
+
+
+def _main(argumentos):
+    comando = argumentos[0] if argumentos else "crear"
+    if comando not in ("crear", "archivar", "estado"):
+        print(f"Comando desconocido: {comando} (usar crear, archivar o estado)")
+        return 2
+    salida = 0
+    for tienda in _tiendas():
+        if tienda is not None:
+            print(f"== Tienda {tienda} ==")
+        if comando == "crear":
+            creadas = crear_particiones(tienda=tienda)
+            if creadas is None:
+                print("Error de conexión a la base de datos")
+                salida = 1
+                continue
+            print(f"Meses creados: {creadas}")
+        elif comando == "archivar":
+            resultados = archivar_particiones(tienda=tienda)
+            for mes, (ok, resultado) in resultados.items():
+                marca = "✅" if ok else "❌"
+                print(f"{marca} {mes}: {resultado}")
+            if not resultados:
+                print("No hay meses para archivar")
+            if not all(ok for ok, _ in resultados.values()):
+                salida = 1
+        else:
+            particiones = listar_particiones(tienda)
+            if len(particiones.columns) == 0:
+                print("Error de conexión a la base de datos")
+                salida = 1
+                continue
+            for fila in particiones.itertuples(index=False):
+                print(f"🗄️  {fila.mes}: ~{fila.filas_estimadas} ventas")
+            for mes in meses_archivados(tienda=tienda):
+                print(f"📦 {mes}: archivado en {_carpeta(None, tienda)}")
+    return salida
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,278 @@
+import inspect
+
+import pandas as pd
+
+from functions import (
+    USAR_RESUMENES,
+    _rango_fechas,
+    connect_to_supabase,
+    ejecutar_en_tiendas,
+    execute_query,
+    release_connection,
+)
+
+# =====================================
+# REPORTES AGREGADOS
+# =====================================
+# Todas las agregaciones se calculan en la base y solo viajan las filas ya
+# agrupadas. Si REPORTES_USAR_RESUMENES=1 se leen las tablas de resumen de
+# migraciones/0003_resumenes_ventas.sql en lugar de recorrer ventas y venta_detalle.
+#
+# Cada reporte se calcula sobre la base de una tienda (`tienda`, ver
+# TIENDAS_CONFIG en functions.py); consolidado() lo corre en todas a la vez
+# y junta los resultados.
+
+PERIODOS = {"dia": "day", "semana": "week", "mes": "month"}
+
+
+def _filtro_fechas(columnas, desde=None, hasta=None):
+    """
+    WHERE para un rango de fechas y sus parámetros, con las mismas
+    condiciones que functions._rango_fechas.
+    """
+    condiciones, params = _rango_fechas(columnas, desde, hasta)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return where, params
+
+
+def ventas_por_periodo(periodo="dia", desde=None, hasta=None, tienda=None):
+    """
+    Facturación por día, semana o mes: cantidad de ventas, total,
+    descuentos y total neto.
+    """
+    if periodo not in PERIODOS:
+        raise ValueError(f"Periodo inválido: {periodo}")
+
+    if USAR_RESUMENES:
+        where, params = _filtro_fechas("r.dia", desde, hasta)
+        query = f"""
+            SELECT date_trunc(%s, r.dia)::date AS periodo,
+                   SUM(r.cantidad_ventas) AS cantidad_ventas,
+                   SUM(r.total) AS total,
+                   SUM(r.total_descuento) AS total_descuento,
+                   SUM(r.total - r.total_descuento) AS total_neto
+            FROM resumen_ventas_diario r
+            {where}
+            GROUP BY 1
+            ORDER BY 1
+        """
+    else:
+        where, params = _filtro_fechas("v.fecha", desde, hasta)
+        query = f"""
+            SELECT date_trunc(%s, v.fecha)::date AS periodo,
+                   COUNT(*) AS cantidad_ventas,
+                   SUM(v.total) AS total,
+                   SUM(v.total * v.descuento) AS total_descuento,
+                   SUM(v.total * (1 - v.descuento)) AS total_neto
+            FROM ventas v
+            {where}
+            GROUP BY 1
+            ORDER BY 1
+        """
+    return execute_query(query, params=tuple([PERIODOS[periodo]] + params), is_select=True, nombre="ventas_por_periodo", tienda=tienda)
+
+
+def top_productos(por="unidades", limite=10, desde=None, hasta=None, tienda=None):
+    """
+    Productos más vendidos, ordenados por unidades o por ingresos.
+    Con limite=None se devuelven todos.
+    """
+    if por not in ("unidades", "ingresos"):
+        raise ValueError(f"Criterio inválido: {por}")
+
+    tope = "" if limite is None else "LIMIT %s"
+    if USAR_RESUMENES:
+        where, params = _filtro_fechas("r.dia", desde, hasta)
+        query = f"""
+            SELECT p.id, p.nombre,
+                   SUM(r.unidades) AS unidades,
+                   SUM(r.ingresos) AS ingresos
+            FROM resumen_productos_diario r
+            JOIN productos p ON p.id = r.producto_id
+            {where}
+            GROUP BY p.id, p.nombre
+            ORDER BY {por} DESC
+            {tope}
+        """
+    else:
+        # El detalle lleva la fecha de la venta: no hace falta unir con ventas
+        where, params = _filtro_fechas("vd.fecha", desde, hasta)
+        query = f"""
+            SELECT p.id, p.nombre,
+                   SUM(vd.cantidad) AS unidades,
+                   SUM(vd.subtotal) AS ingresos
+            FROM venta_detalle vd
+            JOIN productos p ON p.id = vd.producto_id
+            {where}
+            GROUP BY p.id, p.nombre
+            ORDER BY {por} DESC
+            {tope}
+        """
+    if limite is not None:
+        params.append(int(limite))
+    return execute_query(query, params=tuple(params), is_select=True, nombre="top_productos", tienda=tienda)
+
+
+def ventas_por_empleado(desde=None, hasta=None, tienda=None):
+    """
+    Cantidad de ventas, total neto y ticket promedio por empleado.
+    """
+    if USAR_RESUMENES:
+        where, params = _filtro_fechas("r.dia", desde, hasta)
+        query = f"""
+            SELECT u.usuario AS empleado,
+                   SUM(r.cantidad_ventas) AS cantidad_ventas,
+                   SUM(r.total - r.total_descuento) AS total_neto,
+                   SUM(r.total - r.total_descuento) / NULLIF(SUM(r.cantidad_ventas), 0) AS ticket_promedio
+            FROM resumen_ventas_diario r
+            JOIN usuarios u ON u.id = r.empleado_id
+            {where}
+            GROUP BY u.usuario
+            ORDER BY total_neto DESC
+        """
+    else:
+        where, params = _filtro_fechas("v.fecha", desde, hasta)
+        query = f"""
+            SELECT u.usuario AS empleado,
+                   COUNT(*) AS cantidad_ventas,
+                   SUM(v.total * (1 - v.descuento)) AS total_neto,
+                   AVG(v.total * (1 - v.descuento)) AS ticket_promedio
+            FROM ventas v
+            JOIN usuarios u ON u.id = v.empleado_id
+            {where}
+            GROUP BY u.usuario
+            ORDER BY total_neto DESC
+        """
+    return execute_query(query, params=tuple(params), is_select=True, nombre="ventas_por_empleado", tienda=tienda)
+
+
+def resumen_general(desde=None, hasta=None, tienda=None):
+    """
+    Totales del rango: cantidad de ventas, total bruto, impacto de los
+    descuentos, total neto y ticket promedio. Devuelve un DataFrame de una fila.
+    """
+    if USAR_RESUMENES:
+        where, params = _filtro_fechas("r.dia", desde, hasta)
+        origen = f"""
+            SELECT SUM(r.cantidad_ventas) AS cantidad_ventas,
+                   SUM(r.total) AS total,
+                   SUM(r.total_descuento) AS total_descuento
+            FROM resumen_ventas_diario r
+            {where}
+        """
+    else:
+        where, params = _filtro_fechas("v.fecha", desde, hasta)
+        origen = f"""
+            SELECT COUNT(*) AS cantidad_ventas,
+                   SUM(v.total) AS total,
+                   SUM(v.total * v.descuento) AS total_descuento
+            FROM ventas v
+            {where}
+        """
+    query = f"""
+        SELECT COALESCE(t.cantidad_ventas, 0) AS cantidad_ventas,
+               COALESCE(t.total, 0) AS total,
+               COALESCE(t.total_descuento, 0) AS total_descuento,
+               COALESCE(t.total - t.total_descuento, 0) AS total_neto,
+               (t.total - t.total_descuento) / NULLIF(t.cantidad_ventas, 0) AS ticket_promedio,
+               t.total_descuento / NULLIF(t.total, 0) AS porcentaje_descuento
+        FROM ({origen}) t
+    """
+    return execute_query(query, params=tuple(params), is_select=True, nombre="resumen_general", tienda=tienda)
+
+
+def reconstruir_resumenes(tienda=None):
+    """
+    Vuelve a calcular las tablas de resumen desde todo el historial.
+    Se usa una vez al activar los resúmenes o para corregirlos.
+    """
+    conn = connect_to_supabase(tienda)
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            TRUNCATE resumen_ventas_diario, resumen_productos_diario;
+
+            INSERT INTO resumen_ventas_diario
+                (dia, empleado_id, cantidad_ventas, total, total_descuento)
+            SELECT v.fecha::date, v.empleado_id, COUNT(*), SUM(v.total), SUM(v.total * v.descuento)
+            FROM ventas v
+            GROUP BY v.fecha::date, v.empleado_id;
+
+            INSERT INTO resumen_productos_diario
+                (dia, producto_id, unidades, ingresos)
+            SELECT vd.fecha::date, vd.producto_id, SUM(vd.cantidad), SUM(vd.subtotal)
+            FROM venta_detalle vd
+            GROUP BY vd.fecha::date, vd.producto_id;
+        """)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error reconstruyendo resúmenes: {e}")
+        conn.rollback()
+        return False
+    finally:
+        release_connection(conn, tienda)
+
+
+# ---- Reportes de todas las tiendas ----
+def _combinar_periodos(df, **kwargs):
+    columnas = ["cantidad_ventas", "total", "total_descuento", "total_neto"]
+    return df.groupby("periodo", as_index=False)[columnas].sum().sort_values("periodo", ignore_index=True)
+
+
+def _combinar_productos(df, por="unidades", limite=10, **kwargs):
+    # Los ids de producto son de cada base: se junta por nombre
+    df = df.groupby("nombre", as_index=False)[["unidades", "ingresos"]].sum()
+    df = df.sort_values(por, ascending=False, ignore_index=True)
+    return df if limite is None else df.head(int(limite))
+
+
+def _combinar_empleados(df, **kwargs):
+    # Cada empleado es de su tienda: quedan separados por la columna tienda
+    return df.sort_values("total_neto", ascending=False, ignore_index=True)
+
+
+def _combinar_resumen(df, **kwargs):
+    totales = df[["cantidad_ventas", "total", "total_descuento", "total_neto"]].astype(float).sum()
+    cantidad = totales["cantidad_ventas"]
+    totales["ticket_promedio"] = totales["total_neto"] / cantidad if cantidad else None
+    totales["porcentaje_descuento"] = totales["total_descuento"] / totales["total"] if totales["total"] else None
+    return totales.to_frame().T
+
+
+_COMBINAR = {
+    ventas_por_periodo: _combinar_periodos,
+    top_productos: _combinar_productos,
+    ventas_por_empleado: _combinar_empleados,
+    resumen_general: _combinar_resumen,
+}
+
+
+def consolidado(reporte, *args, tiendas=None, por_tienda=False, **kwargs):
+    """
+    Corre un reporte (por ejemplo top_productos) en todas las tiendas en
+    paralelo y combina los resultados como si fuera una sola base.
+    Con por_tienda=True se devuelven las filas de cada tienda sin combinar,
+    con la columna "tienda".
+
+    Retorna (DataFrame, {tienda: error}) con las tiendas que no respondieron:
+    el resultado es parcial si alguna falló.
+    """
+    if reporte not in _COMBINAR:
+        raise ValueError(f"Reporte inválido: {getattr(reporte, '__name__', reporte)}")
+    # Todos los argumentos van por nombre, para la función que combina
+    kwargs = inspect.signature(reporte).bind_partial(*args, **kwargs).arguments
+    consulta = dict(kwargs)
+    if reporte is top_productos and not por_tienda:
+        # El tope se aplica después de sumar: un producto que queda apenas
+        # afuera del top de cada tienda puede ser el primero en el total
+        consulta["limite"] = None
+    df, errores = ejecutar_en_tiendas(reporte, tiendas=tiendas, **consulta)
+    if not isinstance(df, pd.DataFrame):
+        # Ninguna tienda respondió
+        return pd.DataFrame(), errores
+    if por_tienda:
+        return df, errores
+    return _COMBINAR[reporte](df, **kwargs), errores
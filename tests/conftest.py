@@ -0,0 +1,50 @@
+import os
+import uuid
+
+import psycopg2
+import pytest
+from psycopg2.extensions import parse_dsn
+
+import functions
+
+# Las pruebas que necesitan Postgres crean una base nueva en el servidor de
+# DATABASE_URL (el usuario tiene que poder hacer CREATE DATABASE), le aplican
+# todas las migraciones y la borran al terminar. Sin DATABASE_URL se saltean.
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def base():
+    """
+    Nombre de una base vacía con el esquema completo, a la que apuntan las
+    funciones de functions.py mientras duran las pruebas.
+    """
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL no está definida")
+    parametros = parse_dsn(DATABASE_URL)
+    nombre = f"kiosco_test_{uuid.uuid4().hex[:8]}"
+
+    admin = psycopg2.connect(**parametros)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {nombre}")
+
+    parche = pytest.MonkeyPatch()
+    parche.setenv("SUPABASE_DB_HOST", parametros.get("host", "localhost"))
+    parche.setenv("SUPABASE_DB_PORT", parametros.get("port", "5432"))
+    parche.setenv("SUPABASE_DB_NAME", nombre)
+    parche.setenv("SUPABASE_DB_USER", parametros.get("user", os.getenv("USER", "postgres")))
+    # _parametros_conexion exige una contraseña; con autenticación trust cualquiera sirve
+    parche.setenv("SUPABASE_DB_PASSWORD", parametros.get("password", "-"))
+    # Una sola base, sin el tiendas.json que pueda haber en el directorio
+    parche.setattr(functions, "_tiendas", {})
+    parche.setattr(functions, "_pools", {})
+    try:
+        import migraciones
+
+        migraciones.aplicar_migraciones()
+        yield nombre
+    finally:
+        functions.cerrar_pools()
+        parche.undo()
+        admin.cursor().execute(f"DROP DATABASE IF EXISTS {nombre} WITH (FORCE)")
+        admin.close()
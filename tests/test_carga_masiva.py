@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+import carga_masiva
+
+
+class _Subido(io.BytesIO):
+    """
+    Imita el archivo que devuelve st.file_uploader (tiene `name`).
+    """
+
+    def __init__(self, contenido, name):
+        super().__init__(contenido.encode())
+        self.name = name
+
+
+@pytest.fixture(autouse=True)
+def sin_base(monkeypatch):
+    # Un archivo mal formado se tiene que rechazar sin llegar a la base
+    def conectar(tienda=None):
+        raise AssertionError("no debería conectarse a la base")
+
+    monkeypatch.setattr(carga_masiva, "connect_to_supabase", conectar)
+
+
+def test_importar_productos_cantidad_no_numerica():
+    archivo = _Subido("id,nombre,proveedor_id,cantidad,precio\n1,Agua,1,muchas,800\n", "productos.csv")
+    ok, error = carga_masiva.importar_productos(archivo)
+    assert not ok
+    assert "muchas" in error
+
+
+def test_importar_productos_faltan_columnas():
+    archivo = _Subido("nombre,precio\nAgua,800\n", "productos.csv")
+    ok, error = carga_masiva.importar_productos(archivo, clave="nombre")
+    assert not ok
+    assert error == "Faltan columnas: proveedor_id, cantidad"
+
+
+def test_importar_stock_cantidad_no_numerica():
+    archivo = _Subido("id,cantidad\n1,diez\n", "stock.csv")
+    ok, error = carga_masiva.importar_stock(archivo)
+    assert not ok
+    assert "diez" in error
+
+
+def test_importar_stock_parquet_invalido():
+    archivo = _Subido("esto no es parquet", "stock.parquet")
+    ok, _ = carga_masiva.importar_stock(archivo)
+    assert not ok
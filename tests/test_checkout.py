@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from functions import connect_to_supabase, execute_query, procesar_venta_completa_db, release_connection
+
+STOCK = 10
+CAJAS = 40
+
+
+def _crear(query, params):
+    conn = connect_to_supabase()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query + " RETURNING id", params)
+        nuevo_id = cursor.fetchone()[0]
+        conn.commit()
+        return nuevo_id
+    finally:
+        release_connection(conn)
+
+
+def test_ventas_concurrentes_no_sobrevenden(base):
+    empleado = _crear(
+        "INSERT INTO usuarios (usuario, contraseña, tipo_usuario) VALUES (%s, '-', 'empleado')",
+        ("caja_concurrente",),
+    )
+    producto = _crear(
+        "INSERT INTO productos (nombre, cantidad, precio) VALUES (%s, %s, 100)",
+        ("Último alfajor", STOCK),
+    )
+    carrito = [{"id": producto, "nombre": "Último alfajor", "precio": 100.0, "cantidad": 1}]
+
+    # Más cajas que unidades, todas a la vez
+    with ThreadPoolExecutor(max_workers=CAJAS) as executor:
+        resultados = list(executor.map(lambda _: procesar_venta_completa_db(empleado, carrito), range(CAJAS)))
+
+    vendidas = [ticket for ok, ticket in resultados if ok]
+    rechazos = [error for ok, error in resultados if not ok]
+    assert len(vendidas) == STOCK
+    assert all("Stock insuficiente" in error for error in rechazos)
+
+    stock = execute_query("SELECT cantidad FROM productos WHERE id = %s", params=(producto,), is_select=True, as_tuples=True)
+    assert stock[0][0] == 0
+    lineas = execute_query(
+        "SELECT count(*), coalesce(sum(cantidad), 0) FROM venta_detalle WHERE producto_id = %s",
+        params=(producto,),
+        is_select=True,
+        as_tuples=True,
+    )
+    assert tuple(lineas[0]) == (STOCK, STOCK)
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from functions import copy_query, execute_query
+
+QUERY = """
+    SELECT * FROM (VALUES
+        (1, true, 'Agua', ''::text, NULL::boolean, 1.5::numeric, 7),
+        (2, false, NULL, 'x', true, NULL, NULL),
+        (3, true, '', NULL, false, 0, 0)
+    ) AS t(id, activo, nombre, nota, opcional, precio, cantidad)
+    ORDER BY id
+"""
+
+
+def test_copy_query_igual_a_execute_query(base):
+    rapido = copy_query(QUERY)
+    normal = execute_query(QUERY, is_select=True)
+    pd.testing.assert_frame_equal(rapido, normal)
+
+
+def test_copy_query_distingue_null_de_texto_vacio(base):
+    df = copy_query(QUERY)
+    assert df["nombre"].tolist() == ["Agua", None, ""]
+    assert df["nota"].tolist() == ["", "x", None]
+    assert df["activo"].tolist() == [True, False, True]
+    assert df["opcional"].isna().tolist() == [True, False, False]
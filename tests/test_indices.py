@@ -0,0 +1,82 @@
+import json
+import re
+
+import pytest
+
+from functions import connect_to_supabase, release_connection
+from migraciones import CONSULTAS_VERIFICADAS
+
+# Volumen parecido al de un kiosco con un año de uso: suficiente para que el
+# planificador prefiera un seq scan si a una query le falta su índice
+VENTAS = 100_000
+LINEAS_POR_VENTA = 3
+
+_TABLAS_VENTAS = re.compile(r"^(ventas|venta_detalle)(_\d{4}_\d{2})?$")
+
+
+@pytest.fixture(scope="module")
+def cursor(base):
+    conn = connect_to_supabase()
+    cursor = conn.cursor()
+    cursor.execute("SELECT crear_particiones_ventas(now() - interval '11 months', now())")
+    cursor.execute("""
+        INSERT INTO usuarios (usuario, contraseña, tipo_usuario)
+        SELECT CASE WHEN g = 1 THEN 'admin' ELSE 'empleado' || g END, '-', 'empleado'
+        FROM generate_series(1, 8) g
+    """)
+    cursor.execute("INSERT INTO proveedores (nombre) VALUES ('Proveedor')")
+    cursor.execute("""
+        INSERT INTO productos (nombre, proveedor_id, cantidad, precio)
+        SELECT 'Producto ' || g, (SELECT min(id) FROM proveedores), 1000, 100 + g
+        FROM generate_series(1, 500) g
+    """)
+    cursor.execute("""
+        INSERT INTO ventas (fecha, empleado_id, total)
+        SELECT now() - random() * interval '330 days', (SELECT min(id) FROM usuarios) + g %% 8, 500
+        FROM generate_series(1, %s) g
+    """, (VENTAS,))
+    cursor.execute("""
+        INSERT INTO venta_detalle (venta_id, fecha, producto_id, cantidad, subtotal)
+        SELECT v.id, v.fecha, (SELECT min(id) FROM productos) + (v.id * 7 + l) %% 500, 1, 100
+        FROM ventas v, generate_series(1, %s) l
+    """, (LINEAS_POR_VENTA,))
+    conn.commit()
+    cursor.execute("ANALYZE")
+    conn.commit()
+    yield cursor
+    conn.rollback()
+    release_connection(conn)
+
+
+def _seq_scans(plan):
+    """
+    Tablas de ventas (o sus particiones) que el plan recorre enteras.
+    """
+    tablas = []
+    if plan.get("Node Type") == "Seq Scan" and _TABLAS_VENTAS.match(plan.get("Relation Name", "")):
+        tablas.append(plan["Relation Name"])
+    for hijo in plan.get("Plans", []):
+        tablas += _seq_scans(hijo)
+    return tablas
+
+
+def _con_filas(cursor, tablas):
+    # Las particiones de los meses que vienen están vacías: recorrerlas no cuesta nada
+    if not tablas:
+        return []
+    cursor.execute("SELECT relname FROM pg_class WHERE relname = ANY(%s) AND reltuples > 0", (tablas,))
+    return sorted(fila[0] for fila in cursor.fetchall())
+
+
+@pytest.mark.parametrize(
+    "nombre, query, params",
+    [(nombre, query, params) for nombre, query, params, _ in CONSULTAS_VERIFICADAS],
+    ids=[nombre for nombre, *_ in CONSULTAS_VERIFICADAS],
+)
+def test_consultas_sin_seq_scan_en_ventas(cursor, nombre, query, params):
+    # Con el planificador tal cual, sin enable_seqscan = off
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    assert _con_filas(cursor, _seq_scans(plan[0]["Plan"])) == []
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from functions import PoolConexiones
+
+
+class _ConexionFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = False
+        self.cerrada_con_lock = None
+
+    def close(self):
+        # Si el pool cerrara con el lock tomado, otro hilo no podría tomarlo
+        libre = []
+
+        def probar():
+            if self.pool._cond.acquire(blocking=False):
+                self.pool._cond.release()
+                libre.append(True)
+
+        hilo = threading.Thread(target=probar)
+        hilo.start()
+        hilo.join()
+        self.cerrada_con_lock = not libre
+        self.closed = True
+
+    def rollback(self):
+        pass
+
+
+def test_desalojo_cierra_fuera_del_lock(monkeypatch):
+    pool = PoolConexiones({}, minimo=0, maximo=3, timeout_idle=60)
+    viejas = [_ConexionFalsa(pool) for _ in range(2)]
+    pool._libres = [(conn, time.monotonic() - 120) for conn in viejas]
+    nueva = _ConexionFalsa(pool)
+    monkeypatch.setattr(pool, "_abrir", lambda: nueva)
+
+    assert pool.obtener() is nueva
+    assert [conn.cerrada_con_lock for conn in viejas] == [False, False]
+    assert pool.stats["descartadas"] == 2
+    assert pool.estado()["en_uso"] == 1
+
+
+def test_cerrar_todo_cierra_fuera_del_lock():
+    pool = PoolConexiones({}, minimo=0, maximo=3)
+    libres = [_ConexionFalsa(pool) for _ in range(3)]
+    pool._libres = [(conn, time.monotonic()) for conn in libres]
+
+    pool.cerrar_todo()
+    assert [conn.cerrada_con_lock for conn in libres] == [False, False, False]
+    assert pool.estado()["libres"] == 0
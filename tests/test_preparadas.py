@@ -0,0 +1,26 @@
+import pytest
+
+from functions import ConexionPreparada, connect_to_supabase, execute_query, release_connection
+
+QUERY = "SELECT %s::int + 1 AS siguiente"
+
+
+@pytest.fixture
+def conexion(base):
+    conn = connect_to_supabase()
+    if not isinstance(conn, ConexionPreparada):
+        release_connection(conn)
+        pytest.skip("las sentencias preparadas están desactivadas")
+    yield conn
+    release_connection(conn)
+
+
+def test_sentencia_que_el_servidor_ya_tenia(conexion):
+    execute_query(QUERY, params=(1,), conn=conexion, nombre="prueba_duplicada", preparar=True)
+    # La lista local se pierde pero el servidor la sigue teniendo: el
+    # PREPARE falla con DuplicatePreparedStatement y se ejecuta igual
+    conexion.preparadas.clear()
+    conexion.rollback()
+    df = execute_query(QUERY, params=(41,), conn=conexion, nombre="prueba_duplicada", preparar=True)
+    assert df["siguiente"].tolist() == [42]
+    assert len(conexion.preparadas) == 1
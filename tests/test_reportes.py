@@ -0,0 +1,48 @@
+import pandas as pd
+
+import reportes
+
+
+def _tiendas_falsas(monkeypatch, ventas):
+    """
+    Reemplaza las consultas por tienda: `ventas` es {tienda: {nombre: unidades}}
+    y cada tienda respeta el LIMIT como lo haría la base.
+    """
+    def ejecutar_en_tiendas(funcion, tiendas=None, **kwargs):
+        assert funcion is reportes.top_productos
+        partes = []
+        for tienda, productos in ventas.items():
+            df = pd.DataFrame(
+                [(i, nombre, unidades, unidades * 10.0) for i, (nombre, unidades) in enumerate(productos.items())],
+                columns=["id", "nombre", "unidades", "ingresos"],
+            ).sort_values(kwargs.get("por", "unidades"), ascending=False)
+            if kwargs.get("limite") is not None:
+                df = df.head(kwargs["limite"])
+            partes.append(df.assign(tienda=tienda))
+        return pd.concat(partes, ignore_index=True), {}
+
+    monkeypatch.setattr(reportes, "ejecutar_en_tiendas", ejecutar_en_tiendas)
+
+
+def test_consolidado_top_productos_suma_antes_de_cortar(monkeypatch):
+    # X nunca entra en el top 3 de una tienda, pero es el primero en el total
+    _tiendas_falsas(monkeypatch, {
+        "1": {"A": 100, "B": 100, "C": 100, "X": 90},
+        "2": {"D": 100, "E": 100, "F": 100, "X": 90},
+        "3": {"G": 100, "H": 100, "I": 100, "X": 90},
+    })
+    df, errores = reportes.consolidado(reportes.top_productos, "unidades", 3)
+    assert errores == {}
+    assert len(df) == 3
+    assert df.iloc[0]["nombre"] == "X"
+    assert df.iloc[0]["unidades"] == 270
+
+
+def test_consolidado_por_tienda_respeta_el_limite(monkeypatch):
+    _tiendas_falsas(monkeypatch, {
+        "1": {"A": 100, "B": 100, "C": 100, "X": 90},
+        "2": {"D": 100, "E": 100, "F": 100, "X": 90},
+    })
+    df, _ = reportes.consolidado(reportes.top_productos, "unidades", limite=3, por_tienda=True)
+    assert len(df) == 6
+    assert "X" not in set(df["nombre"])
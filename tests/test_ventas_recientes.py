@@ -0,0 +1,22 @@
+import datetime as dt
+
+import pandas as pd
+
+import functions
+from functions import VentasRecientes
+
+
+def test_fechas_del_checkout_quedan_en_utc(monkeypatch):
+    # La base devuelve UTC; el checkout, el huso de su sesión (acá -03)
+    de_la_base = pd.Timestamp("2026-10-18 12:00", tz="UTC")
+    monkeypatch.setattr(functions, "get_ventas", lambda limit, tienda=None: pd.DataFrame(
+        [(1, de_la_base, "ana", 100.0, 0.0)], columns=VentasRecientes.COLUMNAS,
+    ))
+    buffer = VentasRecientes(capacidad=5)
+    buffer.revalidar()
+    buffer.agregar(2, dt.datetime(2026, 10, 18, 9, 30, tzinfo=dt.timezone(dt.timedelta(hours=-3))), "beto", 50, 0)
+
+    df = buffer.leer(5)
+    assert str(df["fecha"].dt.tz) == "UTC"
+    assert list(df["id"]) == [2, 1]
+    assert df.iloc[0]["fecha"] == pd.Timestamp("2026-10-18 12:30", tz="UTC")